@@ -1,80 +1,112 @@
-import requests
-import json
-import datetime
-import configparser
-from colorama import Fore, Style, init
-from snipe import Snipe
-
-# Initialize colorama for colored terminal output
-init()
-
-# Load config
-config = configparser.ConfigParser()
-config.read('settings.ini')
-
-snipe_url = config['snipe-it']['url']
-apiKey = config['snipe-it']['apiKey']
-defaultStatus = config['snipe-it']['defaultStatus']
-apple_manufacturer_id = int(config['snipe-it']['manufacturer_id'])
-macos_category_id = config['snipe-it']['macos_category_id']
-ios_category_id = config['snipe-it']['ios_category_id']
-tvos_category_id = config['snipe-it']['tvos_category_id']
-macos_fieldset_id = config['snipe-it']['macos_fieldset_id']
-ios_fieldset_id = config['snipe-it']['ios_fieldset_id']
-tvos_fieldset_id = config['snipe-it']['tvos_fieldset_id']
-snipe_rate_limit = int(config['snipe-it']['rate_limit'])
-apple_image_check = config['snipe-it'].getboolean('apple_image_check')
-
-# Initialize Snipe API
-snipe = Snipe(apiKey, snipe_url, apple_manufacturer_id, macos_category_id, ios_category_id, tvos_category_id,
-              snipe_rate_limit, macos_fieldset_id, ios_fieldset_id, tvos_fieldset_id, apple_image_check)
-
-# Fetch all models
-try:
-    response = snipe.listAllModels()
-    models = response.json()
-except Exception as e:
-    print(Fore.RED + f"Failed to get models: {e}" + Style.RESET_ALL)
-    exit(1)
-
-if 'rows' not in models:
-    print(Fore.RED + "No models found in response." + Style.RESET_ALL)
-    exit(1)
-
-# Process models
-for model in models['rows']:
-    model_id = model.get('id')
-    model_name = model.get("model_number") or model.get("name", "Unknown")
-    print(f"Processing model: {model_id} {model_name}")
-
-    manufacturer = model.get('manufacturer')
-    if not manufacturer or 'id' not in manufacturer:
-        print(Fore.YELLOW + f"Model {model_id} has no manufacturer info. Skipping." + Style.RESET_ALL)
-        continue
-
-    manufacturer_id = int(manufacturer['id'])
-    print(f"Is the model's manufacturer Apple? checking manufacturer id {manufacturer_id} against {apple_manufacturer_id}")
-
-    if manufacturer_id != apple_manufacturer_id:
-        print(Fore.YELLOW + "Model is not Apple. Skipping." + Style.RESET_ALL)
-        continue
-
-    print(Fore.GREEN + "Yes! Checking for photo..." + Style.RESET_ALL)
-
-    if not model.get('image'):
-        print("No photo found. Attempting download...")
-
-        try:
-            image_response = snipe.getImageForModel(model_name)
-            if image_response:
-                print(Fore.CYAN + "Photo downloaded. Updating model..." + Style.RESET_ALL)
-
-                payload = {"image": image_response}
-                snipe.updateModel(str(model_id), payload)
-            else:
-                print(Fore.YELLOW + f"No photo found for model {model_name}. Skipping." + Style.RESET_ALL)
-        except Exception as e:
-            print(Fore.RED + f"Error downloading image for model {model_name}: {e}" + Style.RESET_ALL)
-
-    else:
-        print("Picture already set. Skipping.")
+"""
+Apple model image backfill for MosyleSnipeSync.
+Pages through every Snipe-IT model, picks out the Apple ones by
+manufacturer_id and fills in missing images from AppleDB.
+
+Run it through the main entry point:
+    python3 main.py --config settings.ini backfill-images --workers 8
+"""
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from logger_config import get_logger
+
+
+def _backfill_model(snipe, model_id, model_name):
+    """Resolve and upload the image for one model. Returns 'updated', 'missing' or 'failed'."""
+    logger = get_logger()
+    # Lookup errors are raised, so they count as failed rather than missing
+    image = snipe.getImageForModel(model_name, raise_errors=True)
+    if not image:
+        logger.info(f"No photo found for model {model_id} {model_name}")
+        return 'missing'
+
+    response = snipe.updateModel(str(model_id), {"image": image})
+    if response is None or response.status_code >= 400:
+        status = response.status_code if response is not None else 'no response'
+        logger.error(f"Failed to update image for model {model_id} {model_name}: {status}")
+        return 'failed'
+
+    logger.info(f"Updated image for model {model_id} {model_name}")
+    return 'updated'
+
+
+def backfill_model_images(snipe, workers=8):
+    """
+    Fill in missing images for every Apple model in Snipe-IT.
+
+    Models are paged through /models, filtered by the configured Apple
+    manufacturer_id, and the ones without an image are resolved against the
+    shared AppleDB index on a bounded thread pool.
+
+    Args:
+        snipe: Snipe client
+        workers: Maximum number of models resolved concurrently
+
+    Returns:
+        dict: Counts of checked, skipped, updated, missing and failed models
+    """
+    logger = get_logger()
+    summary = {'checked': 0, 'skipped': 0, 'updated': 0, 'missing': 0, 'failed': 0}
+
+    if not snipe.apple_image_check:
+        logger.warning("apple_image_check is disabled in settings.ini, nothing to backfill")
+        return summary
+
+    apple_manufacturer_id = int(snipe.manufacturer_id)
+    pending = []
+    for model in snipe.iterAllModels():
+        summary['checked'] += 1
+        model_id = model.get('id')
+        model_name = model.get("model_number") or model.get("name", "Unknown")
+
+        manufacturer = model.get('manufacturer')
+        if not manufacturer or 'id' not in manufacturer:
+            logger.debug(f"Model {model_id} has no manufacturer info, skipping")
+            summary['skipped'] += 1
+            continue
+        if int(manufacturer['id']) != apple_manufacturer_id:
+            logger.debug(f"Model {model_id} {model_name} is not Apple, skipping")
+            summary['skipped'] += 1
+            continue
+        if model.get('image'):
+            logger.debug(f"Model {model_id} {model_name} already has a picture, skipping")
+            summary['skipped'] += 1
+            continue
+
+        pending.append((model_id, model_name))
+
+    logger.info(f"Found {len(pending)} Apple models without a picture out of {summary['checked']} models")
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = {
+            executor.submit(_backfill_model, snipe, model_id, model_name): (model_id, model_name)
+            for model_id, model_name in pending
+        }
+        for future in as_completed(futures):
+            model_id, model_name = futures[future]
+            try:
+                summary[future.result()] += 1
+            except Exception as e:
+                logger.error(f"Error backfilling image for model {model_id} {model_name}: {e}")
+                summary['failed'] += 1
+
+    logger.info(
+        f"Image backfill complete: {summary['updated']} updated, {summary['missing']} missing, "
+        f"{summary['failed']} failed, {summary['skipped']} skipped"
+    )
+    return summary
+
+
+if __name__ == "__main__":
+    # Kept for existing cron entries; equivalent to `main.py backfill-images`.
+    # --workers and the top-level options (--config, --log-dir, ...) may
+    # come in any order.
+    import argparse
+    from main import build_parser, main
+    backfill_parser = argparse.ArgumentParser(add_help=False)
+    backfill_parser.add_argument('--workers', type=int, default=8)
+    backfill_args, rest = backfill_parser.parse_known_args()
+    args = build_parser().parse_args(rest)
+    args.command = 'backfill-images'
+    args.workers = backfill_args.workers
+    main(args)
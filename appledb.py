@@ -0,0 +1,201 @@
+"""
+AppleDB lookups for MosyleSnipeSync.
+Downloads the AppleDB device list, indexes it by model identifier and
+resolves model images from img.appledb.dev. The index is refreshed once a
+day, so a long-running daemon picks up models AppleDB adds later.
+"""
+import base64
+import threading
+import time
+
+import requests
+
+import jsonstream
+
+APPLEDB_DEVICE_URL = "https://api.appledb.dev/device/main.json"
+APPLEDB_IMAGE_URL = "https://img.appledb.dev"
+
+# Seconds an index is used before main.json is downloaded again. Models
+# without an image are looked up again after each refresh.
+INDEX_MAX_AGE = 24 * 3600
+# Seconds before a failed refresh is tried again, meanwhile the old index is kept
+RELOAD_RETRY = 300
+
+
+class AppleDBIndex:
+    """
+    Process-wide AppleDB index.
+
+    main.json is several MB, so it is stream-parsed on first use and a
+    compact index is kept for `max_age` seconds. Lookups and image resolution are thread-safe,
+    and resolved images are cached per model number so a model is only
+    probed once no matter how many callers ask for it. Models found without
+    an image are forgotten whenever the index is refreshed.
+    """
+
+    def __init__(self, url=APPLEDB_DEVICE_URL, session=None, max_age=INDEX_MAX_AGE, clock=time.monotonic):
+        self.url = url
+        self.session = session or requests.Session()
+        self.max_age = max_age
+        self.clock = clock
+        self._by_identifier = None
+        self._expires_at = None
+        self._images = {}
+        # One lock per model number being resolved, so concurrent callers
+        # asking for the same model wait for the first probe
+        self._image_locks = {}
+        self._lock = threading.Lock()
+        self._image_locks_lock = threading.Lock()
+
+    def _fresh(self):
+        return self._by_identifier is not None and self.clock() < self._expires_at
+
+    def load(self):
+        """Fetch and index main.json if it has not been loaded yet or is older than max_age."""
+        if self._fresh():
+            return
+        with self._lock:
+            if self._fresh():
+                return
+            try:
+                self._download()
+            except (requests.exceptions.RequestException, ValueError) as e:
+                if self._by_identifier is None:
+                    raise
+                print(f"Failed to refresh the AppleDB device index, keeping the old one: {e}")
+                self._expires_at = self.clock() + RELOAD_RETRY
+
+    def _download(self):
+        print(f"Downloading AppleDB device index from {self.url}")
+        response = self.session.get(self.url, timeout=60, stream=True)
+        response.raise_for_status()
+
+        # main.json is parsed entry by entry as it downloads, and only the
+        # fields needed to build image URLs are kept
+        by_identifier = {}
+        device_count = 0
+        for device in jsonstream.iter_response_array(response):
+            device_count += 1
+            colors = device.get("colors") or []
+            entry = {
+                "name": device.get("name"),
+                "imageKey": device.get("imageKey"),
+                "key": device.get("key"),
+                "colors": colors[:1],
+            }
+            for key in ("identifier", "deviceMap"):
+                values = device.get(key) or []
+                if isinstance(values, str):
+                    values = [values]
+                for value in values:
+                    # First entry wins, matching the old linear scan
+                    by_identifier.setdefault(value, entry)
+
+        self._by_identifier = by_identifier
+        self._expires_at = self.clock() + self.max_age
+        # A model missing from the old index, or without an image then, may have one now
+        for model_number, image in dict(self._images).items():
+            if image is False:
+                self._images.pop(model_number, None)
+        print(f"AppleDB index loaded: {device_count} devices, {len(by_identifier)} identifiers")
+
+    def lookup(self, model_number):
+        """Return the AppleDB device entry for a model number, or None."""
+        self.load()
+        return self._by_identifier.get(model_number)
+
+    def image_urls(self, device, model_number):
+        """Candidate image URLs for a device, in order of preference."""
+        image_key = device.get("imageKey") or device.get("key") or model_number
+        colors = device.get("colors", [])
+        if colors and isinstance(colors[0], dict) and "key" in colors[0]:
+            color = colors[0]["key"]
+        else:
+            color = "Silver"
+
+        return [
+            f"{APPLEDB_IMAGE_URL}/device@256/{image_key}/{color}.png",  # Original format
+            f"{APPLEDB_IMAGE_URL}/device/{image_key}/{color}.png",       # Without size
+            f"{APPLEDB_IMAGE_URL}/device@256/{image_key}.png",           # Without color
+            f"{APPLEDB_IMAGE_URL}/device/{image_key}.png",               # Simplest format
+        ]
+
+    def image_for(self, model_number):
+        """
+        Resolve a model number to a base64 data URL suitable for Snipe-IT.
+
+        Returns:
+            str: data URL of the image, or False if AppleDB has none
+
+        Raises:
+            requests.exceptions.RequestException: if the index could not be
+                downloaded, or no image was found and some image URL failed
+                with a network error or a 5xx. Nothing is cached then, so a
+                later call tries again.
+        """
+        image = self._cached_image(model_number)
+        if image is not None:
+            return image
+        with self._image_locks_lock:
+            lock = self._image_locks.setdefault(model_number, threading.Lock())
+        with lock:
+            image = self._cached_image(model_number)
+            if image is not None:
+                return image
+            return self._probe_image(model_number)
+
+    def _cached_image(self, model_number):
+        """The cached image, False while a miss is still current, else None."""
+        image = self._images.get(model_number)
+        if image is False and not self._fresh():
+            # Probed against an index that is due for a refresh
+            return None
+        return image
+
+    def _probe_image(self, model_number):
+        device = self.lookup(model_number)
+        if device is None:
+            print(f"No matching identifier or deviceMap found for {model_number}")
+            self._images[model_number] = False
+            return False
+
+        print(f"Found device in AppleDB: {device.get('name', 'Unknown')}")
+        error = None
+        for image_url in self.image_urls(device, model_number):
+            try:
+                print(f"Trying image URL: {image_url}")
+                img_response = self.session.get(image_url, timeout=5)
+                if img_response.status_code == 200:
+                    print(f"Successfully fetched image from: {image_url}")
+                    base64encoded = base64.b64encode(img_response.content).decode("utf8")
+                    image = "data:image/png;name=image.png;base64," + base64encoded
+                    self._images[model_number] = image
+                    return image
+                if img_response.status_code >= 500 or img_response.status_code == 429:
+                    raise requests.exceptions.HTTPError(
+                        f"{img_response.status_code} from {image_url}", response=img_response)
+                print(f"  {img_response.status_code} - Image not found at {image_url}")
+            except requests.exceptions.RequestException as e:
+                print(f"  Error fetching {image_url}: {e}")
+                error = e
+
+        print(f"Could not fetch image from any URL format for {model_number}")
+        # Errors are not cached so a later call can retry
+        if error is not None:
+            raise error
+        self._images[model_number] = False
+        return False
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    """Return the shared AppleDB index for this process."""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = AppleDBIndex()
+    return _index
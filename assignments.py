@@ -0,0 +1,164 @@
+"""
+User assignment phase for MosyleSnipeSync.
+Assignment changes found while walking the Mosyle devices are collected in an
+AssignmentPlan and applied together at the end of the run: checkouts are
+grouped by target user so each user is looked up once (before any check-in,
+so a reassignment to an unknown user leaves the asset with its current user),
+check-ins are pipelined, and a user's assets can go out in a single bulk
+checkout.
+"""
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from logger_config import get_logger
+from snipe import response_ok
+
+# Upper bound on assets sent in one bulk checkout request
+BULK_CHECKOUT_CHUNK = 100
+
+
+class AssignmentPlan:
+    """Pending checkouts and check-ins collected during a sync run."""
+
+    def __init__(self):
+        # asset_id -> serial, for assets that must be checked in first
+        self.checkins = {}
+        # lower-cased email -> {asset_id: serial}
+        self.checkouts = {}
+
+    def __len__(self):
+        return len(self.checkins) + sum(len(assets) for assets in self.checkouts.values())
+
+    def checkout(self, asset_id, serial, email):
+        """Queue a checkout of an unassigned asset to a user."""
+        self.checkouts.setdefault(email.lower(), {})[asset_id] = serial
+
+    def checkin(self, asset_id, serial):
+        """Queue a check-in of an assigned asset."""
+        self.checkins[asset_id] = serial
+
+    def reassign(self, asset_id, serial, email):
+        """Queue a check-in followed by a checkout to a different user."""
+        self.checkin(asset_id, serial)
+        self.checkout(asset_id, serial, email)
+
+    def serials(self):
+        """Serial numbers of every asset with a pending change."""
+        serials = set(self.checkins.values())
+        for assets in self.checkouts.values():
+            serials.update(assets.values())
+        return serials
+
+    def apply(self, snipe, workers=4, bulk=False):
+        """
+        Apply the plan against Snipe-IT.
+
+        Args:
+            snipe: Snipe client
+            workers: Number of per-asset requests kept in flight
+            bulk: Try the bulk checkout API route (not in stock Snipe-IT) before per-asset calls
+
+        Returns:
+            dict: Counts of checked_in, checked_out, unknown_users and failed,
+            and the failures as (serial, step, error class, error) tuples
+        """
+        logger = get_logger()
+        summary = {'checked_in': 0, 'checked_out': 0, 'unknown_users': 0, 'failed': 0, 'failures': []}
+        if not len(self):
+            return summary
+
+        logger.info(
+            f"Applying assignment changes: {len(self.checkins)} check-ins, "
+            f"{sum(len(a) for a in self.checkouts.values())} checkouts to {len(self.checkouts)} users"
+        )
+
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            # Target users first, each looked up once, so a reassigned asset
+            # is only checked in once its new user is known to exist
+            lookups = {executor.submit(snipe.findUser, email, raise_errors=True): email for email in self.checkouts}
+            users = {}
+            for lookup in as_completed(lookups):
+                email = lookups[lookup]
+                assets = self.checkouts[email]
+                try:
+                    user_row = lookup.result()
+                except Exception as e:
+                    logger.error(f"Error looking up user {email}: {e}")
+                    summary['failed'] += len(assets)
+                    summary['failures'].extend((serial, 'user lookup', type(e).__name__, str(e))
+                                               for serial in assets.values())
+                    continue
+                if user_row:
+                    users[email] = user_row
+                    continue
+                logger.warning(f"No Snipe-IT user matches {email}, leaving {len(assets)} assets as they are")
+                summary['unknown_users'] += len(assets)
+                # A reassigned asset keeps its current user; queue it so the
+                # reassignment is tried again once the user exists
+                summary['failures'].extend((serial, 'user lookup', 'UnknownUser', f"no Snipe-IT user matches {email}")
+                                           for asset_id, serial in assets.items() if asset_id in self.checkins)
+
+            # Check-ins next, so reassigned assets are free to be checked out again
+            checkins = {asset_id: serial for asset_id, serial in self.checkins.items()
+                        if not any(asset_id in assets and email not in users
+                                   for email, assets in self.checkouts.items())}
+            failed_checkins = set()
+            futures = {executor.submit(snipe.unasigneAsset, asset_id): asset_id for asset_id in checkins}
+            for future in as_completed(futures):
+                asset_id = futures[future]
+                error = ('RequestFailed', "check-in failed")
+                try:
+                    ok = response_ok(future.result())
+                except Exception as e:
+                    logger.error(f"Error checking in asset {asset_id}: {e}")
+                    ok = False
+                    error = (type(e).__name__, str(e))
+                if ok:
+                    summary['checked_in'] += 1
+                else:
+                    logger.error(f"Failed to check in asset {asset_id} ({self.checkins[asset_id]})")
+                    failed_checkins.add(asset_id)
+                    summary['failed'] += 1
+                    summary['failures'].append((self.checkins[asset_id], 'checkin') + error)
+
+            per_asset = []
+            for email, user_row in users.items():
+                asset_ids = [asset_id for asset_id in self.checkouts[email] if asset_id not in failed_checkins]
+                remaining = asset_ids
+                if bulk and len(asset_ids) > 1:
+                    remaining = []
+                    for start in range(0, len(asset_ids), BULK_CHECKOUT_CHUNK):
+                        chunk = asset_ids[start:start + BULK_CHECKOUT_CHUNK]
+                        response = snipe.bulkCheckout(user_row['id'], chunk)
+                        if response_ok(response):
+                            logger.info(f"Bulk checked out {len(chunk)} assets to {email}")
+                            summary['checked_out'] += len(chunk)
+                        else:
+                            remaining.extend(chunk)
+
+                per_asset.extend((asset_id, user_row['id'], email) for asset_id in remaining)
+
+            futures = {
+                executor.submit(snipe.checkoutAsset, asset_id, user_id): (asset_id, email)
+                for asset_id, user_id, email in per_asset
+            }
+            for future in as_completed(futures):
+                asset_id, email = futures[future]
+                error = ('RequestFailed', "checkout failed")
+                try:
+                    ok = response_ok(future.result())
+                except Exception as e:
+                    logger.error(f"Error checking out asset {asset_id} to {email}: {e}")
+                    ok = False
+                    error = (type(e).__name__, str(e))
+                if ok:
+                    summary['checked_out'] += 1
+                else:
+                    logger.error(f"Failed to check out asset {asset_id} ({self.checkouts[email][asset_id]}) to {email}")
+                    summary['failed'] += 1
+                    summary['failures'].append((self.checkouts[email][asset_id], 'checkout') + error)
+
+        logger.info(
+            f"Assignment phase complete: {summary['checked_in']} checked in, {summary['checked_out']} checked out, "
+            f"{summary['unknown_users']} with unknown users, {summary['failed']} failed"
+        )
+        return summary
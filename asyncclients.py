@@ -0,0 +1,349 @@
+"""
+Asyncio clients for MosyleSnipeSync.
+AsyncSnipe and AsyncMosyle offer the same operations as the blocking Snipe
+and Mosyle clients as coroutines, on one pooled httpx client each (HTTP/2
+when the h2 package is installed), so hundreds of requests can be in flight
+from a single thread. Every AsyncSnipe sharing an AsyncRateLimiter stays
+within one Snipe-IT rate limit, and both clients go through the same
+process-wide circuit breakers as the blocking ones.
+
+httpx is optional; without it available() is False and the sync uses the
+blocking clients only.
+"""
+import asyncio
+
+try:
+    import httpx
+except ImportError:  # optional
+    httpx = None
+
+try:
+    import h2  # noqa: F401  (httpx needs it for HTTP/2)
+except ImportError:  # optional
+    h2 = None
+
+from breaker import CircuitOpenError, get_breaker
+from inventory import AssetCache
+from logger_config import get_logger
+from snipe import RequestWindow, response_ok
+
+# Seconds waited on a 429, matching the Snipe-IT rate limit window
+RATE_LIMIT_WINDOW = 60
+
+
+def available():
+    """True if httpx is installed."""
+    return httpx is not None
+
+
+def _client(http2=False, max_connections=100, **kwargs):
+    if httpx is None:
+        raise RuntimeError("The asyncio clients need httpx (pip install httpx, or httpx[http2] for HTTP/2)")
+    return httpx.AsyncClient(
+        http2=http2 and h2 is not None,
+        limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        timeout=httpx.Timeout(60.0),
+        **kwargs
+    )
+
+
+class AsyncRateLimiter:
+    """
+    At most `rate_limit` requests in any `period` seconds, shared by every
+    coroutine (and client) that acquires from it. Waiters are served in
+    order.
+
+    Pass the `window` of a blocking Snipe client to draw on the same
+    budget as its threads instead of starting a fresh one.
+    """
+
+    def __init__(self, rate_limit=None, period=RATE_LIMIT_WINDOW, window=None):
+        self.window = window or RequestWindow(rate_limit, period)
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        """Wait until a request may be sent, and count it."""
+        async with self._lock:
+            while True:
+                wait = self.window.try_acquire()
+                if not wait:
+                    return
+                await asyncio.sleep(wait)
+
+    def in_window(self):
+        """Requests sent during the last `period` seconds."""
+        return self.window.in_window()
+
+
+class AsyncSnipe:
+    """Asyncio counterpart of snipe.Snipe for the per-device operations."""
+
+    def __init__(self, snipetoken, url, rate_limit, limiter=None, assets=None, http2=False, max_connections=100,
+                 shared_limiter=None):
+        self.url = url
+        self._snipetoken = snipetoken
+        self.limiter = limiter or AsyncRateLimiter(rate_limit)
+        # ratelimit.SharedRateLimiter, which then takes the place of limiter
+        self.shared_limiter = shared_limiter
+        # Shared with every other client of this Snipe-IT instance in the process
+        self.breaker = get_breaker("Snipe-IT", url)
+        self.assets = assets if assets is not None else AssetCache()
+        self._user_cache = {}
+        self.client = _client(http2=http2, max_connections=max_connections, headers={
+            "authorization": "Bearer " + snipetoken,
+            "accept": "application/json",
+            "content-type": "application/json",
+        })
+
+    @classmethod
+    def from_client(cls, snipe, **kwargs):
+        """
+        An async client for the same instance as a blocking Snipe client,
+        sharing its asset cache and its rate limit budget.
+        """
+        kwargs.setdefault('assets', snipe.assets)
+        kwargs.setdefault('shared_limiter', snipe.shared_limiter)
+        if 'limiter' not in kwargs:
+            kwargs['limiter'] = AsyncRateLimiter(window=snipe.window)
+        return cls(snipe._snipetoken, snipe.url, snipe.rate_limit, **kwargs)
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def request(self, method, url, params=None, json=None, max_retries=10):
+        """
+        Send a request with the same retry and circuit breaker behaviour as
+        Snipe.snipeItRequest(). Returns the httpx response, or None once
+        the retries are used up.
+
+        A half-open probe that ends without a result (the task is cancelled,
+        say) is released, so the breaker lets the next call probe instead.
+        """
+        logger = get_logger()
+        for attempt in range(max_retries):
+            probe = self.breaker.check()
+            backoff = min(RATE_LIMIT_WINDOW, 5 * 2 ** attempt)
+            try:
+                if self.shared_limiter is not None:
+                    # The shared limiter blocks on a file lock, so wait in a thread
+                    await asyncio.to_thread(self.shared_limiter.acquire)
+                else:
+                    await self.limiter.acquire()
+                try:
+                    response = await self.client.request(method, self.url + url, params=params, json=json)
+                except httpx.TransportError as e:
+                    if self.breaker.record_failure(e):
+                        raise CircuitOpenError(self.breaker)
+                    logger.warning(f"Snipe-IT {method} {url} failed (attempt {attempt + 1}/{max_retries}): {e}. "
+                                   f"Retrying in {backoff} seconds")
+                    await asyncio.sleep(backoff)
+                    continue
+
+                if response.status_code == 429:
+                    self.breaker.record_success()
+                    await asyncio.sleep(RATE_LIMIT_WINDOW)
+                    continue
+                if response.status_code >= 500:
+                    if self.breaker.record_failure(f"HTTP {response.status_code}"):
+                        raise CircuitOpenError(self.breaker)
+                    await asyncio.sleep(backoff)
+                    continue
+                self.breaker.record_success()
+                return response
+            finally:
+                self.breaker.release(probe)
+
+        logger.error(f"Snipe-IT {method} {url} failed after {max_retries} attempts")
+        return None
+
+    async def listHardware(self, serial):
+        response = await self.request("GET", "/hardware/byserial/" + serial)
+        if response_ok(response):
+            rows = response.json().get('rows')
+            if rows:
+                self.assets.store_rows(rows)
+            else:
+                self.assets.record_missing(serial)
+        return response
+
+    async def searchModel(self, model):
+        """Search models. Unlike Snipe.searchModel() this never sets a missing model image."""
+        return await self.request("GET", "/models", params={
+            "limit": "50", "offset": "0", "search": model, "sort": "created_at", "order": "asc"
+        })
+
+    async def createAsset(self, model, payload):
+        payload = dict(payload, status_id=2, model_id=model, asset_tag=payload['serial'])
+        response = await self.request("POST", "/hardware", json=payload)
+        if not response_ok(response):
+            return None
+        result = response.json()
+        self.assets.record_create(result, payload)
+        return result
+
+    async def updateAsset(self, asset_id, payload, model_id=None):
+        payload = dict(payload)
+        payload.pop('serial', None)
+        if model_id:
+            payload['model_id'] = model_id
+        response = await self.request("PATCH", f"/hardware/{asset_id}", json=payload)
+        if response_ok(response):
+            self.assets.record_update(asset_id, response.json(), payload)
+        return response
+
+    async def findUser(self, user):
+        """Snipe-IT user row with exactly this email, cached like Snipe.findUser()."""
+        email = user.lower()
+        if email not in self._user_cache:
+            response = await self.request("GET", "/users", params={"search": email, "limit": 10})
+            if not response_ok(response):
+                # Not cached, so a transient error is retried on the next call
+                return None
+            rows = response.json().get('rows', [])
+            self._user_cache[email] = next((row for row in rows if (row.get('email') or '').lower() == email), None)
+        return self._user_cache[email]
+
+    async def assignAsset(self, user, asset_id):
+        user_row = await self.findUser(user)
+        if not user_row:
+            return None
+        response = await self.request("POST", f"/hardware/{asset_id}/checkout", json={
+            "assigned_user": user_row['id'],
+            "checkout_to_type": "user"
+        })
+        if response_ok(response):
+            self.assets.record_checkout(asset_id, user_row)
+        return response
+
+
+class AsyncMosyle:
+    """Asyncio counterpart of mosyle.Mosyle. Call login() (or use `async with`) first."""
+
+    def __init__(self, access_token, email, password, url="https://managerapi.mosyle.com/v2",
+                 http2=False, max_connections=100):
+        self.url = url
+        self.access_token = access_token
+        self.email = email
+        self.password = password
+        # Shared with every other client of this Mosyle API in the process
+        self.breaker = get_breaker("Mosyle", url)
+        self.client = _client(http2=http2, max_connections=max_connections)
+
+    async def login(self):
+        response = await self._send("login", {
+            "accessToken": self.access_token,
+            "email": self.email,
+            "password": self.password
+        })
+        auth_header = response.headers.get("Authorization", "")
+        if response.status_code != 200 or not auth_header.startswith("Bearer "):
+            raise Exception(f"Login failed. Could not obtain JWT token (HTTP {response.status_code})")
+        self.client.headers.update({"Authorization": auth_header, "Content-Type": "application/json"})
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    async def __aenter__(self):
+        await self.login()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def _send(self, endpoint, data):
+        probe = self.breaker.check()
+        try:
+            try:
+                response = await self.client.post(f"{self.url}/{endpoint}", json=data)
+            except httpx.TransportError as e:
+                self.breaker.record_failure(e)
+                raise
+            if response.status_code >= 500:
+                self.breaker.record_failure(f"HTTP {response.status_code}")
+            else:
+                self.breaker.record_success()
+            return response
+        finally:
+            self.breaker.release(probe)
+
+    async def _post(self, endpoint, data):
+        data["accessToken"] = self.access_token
+        response = await self._send(endpoint, data)
+        try:
+            return response.json()
+        except ValueError:
+            return {"error": "Invalid JSON response", "text": response.text}
+
+    async def list(self, os, specific_columns=None, page=1):
+        data = {"operation": "list", "options": {"os": os, "page": page}}
+        if specific_columns:
+            data["specific_columns"] = specific_columns
+        return await self._post("listdevices", data)
+
+    async def setAssetTag(self, serialnumber, tag):
+        return await self._post("devices", {
+            "operation": "update_device",
+            "serialnumber": serialnumber,
+            "asset_tag": tag
+        })
+
+
+async def lookup_hardware(snipe, serials, concurrency=50):
+    """
+    Look up many serials concurrently, at most `concurrency` in flight, and
+    cache the rows on the client's AssetCache, serials without an asset
+    included.
+
+    Every lookup runs to completion even when some raise, so none is left
+    holding a breaker probe.
+
+    Returns:
+        set: serials whose lookup failed
+
+    Raises:
+        CircuitOpenError: if the Snipe-IT breaker opened during the lookups
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    serials = list(serials)
+
+    async def lookup(serial):
+        async with semaphore:
+            return response_ok(await snipe.listHardware(serial))
+
+    results = await asyncio.gather(*(lookup(serial) for serial in serials), return_exceptions=True)
+    failed = {serial for serial, result in zip(serials, results) if result is not True}
+    for result in results:
+        if isinstance(result, CircuitOpenError):
+            raise result
+    for result in results:
+        if isinstance(result, BaseException):
+            get_logger().warning(f"Snipe-IT hardware lookup failed: {result}")
+    return failed
+
+
+def prefetch_hardware(snipe, serials, concurrency=50, http2=False):
+    """
+    Fill a blocking Snipe client's asset cache with concurrent lookups of
+    `serials`, so sync_device() finds every existing asset, and learns which
+    serials have none, without a request. The requests are charged to what
+    is left of the client's per-minute (or shared) budget.
+
+    Returns:
+        set: serials whose lookup failed; sync_device() looks those up itself
+    """
+    serials = [serial for serial in serials
+               if snipe.assets.get(serial) is None and not snipe.assets.is_missing(serial)]
+    if not serials:
+        return set()
+
+    async def run():
+        async with AsyncSnipe.from_client(snipe, http2=http2, max_connections=concurrency) as client:
+            return await lookup_hardware(client, serials, concurrency)
+
+    return asyncio.run(run())
@@ -0,0 +1,112 @@
+"""
+Benchmark: buffered vs streaming JSON decoding of a large Mosyle listdevices body.
+
+Writes a synthetic listdevices response to a temporary file, then decodes it
+in a fresh subprocess per mode and reports parse time and peak RSS:
+
+    buffered         read the whole body, json.loads it, then build MosyleDevice records
+    buffered-orjson  same, with orjson (if installed)
+    stream           jsonstream.iter_array over 64 KiB chunks, building records as items arrive
+
+Usage:
+    python3 benchmarks/json_decoding.py --devices 50000
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import jsonstream  # noqa: E402
+from mosyle import MosyleDevice  # noqa: E402
+
+MODES = ('buffered', 'buffered-orjson', 'stream')
+
+
+def write_payload(path, devices):
+    """Write a listdevices-shaped body with `devices` devices of ~45 fields each."""
+    with open(path, 'w') as f:
+        f.write('{"status": "OK", "response": {"devices": [')
+        for i in range(devices):
+            device = {f'extra_field_{k}': f'value {k} for device {i}' for k in range(32)}
+            device.update({
+                'serial_number': f'C02X{i:08d}',
+                'device_name': f'Student iPad {i}',
+                'device_model': 'iPad13,1',
+                'os': 'ios',
+                'osversion': '17.4.1',
+                'cpu_model': None,
+                'bluetooth_mac_address': 'aa:bb:cc:dd:ee:ff',
+                'wifi_mac_address': 'aa:bb:cc:dd:ee:00',
+                'ethernet_mac_address': None,
+                'useremail': f'student{i}@example.org',
+                'CurrentConsoleManagedUser': f'student{i}',
+                'asset_tag': str(100000 + i),
+            })
+            if i:
+                f.write(',')
+            json.dump(device, f)
+        f.write(']}}')
+
+
+def run_mode(mode, path):
+    """Decode the payload once in this process and return (seconds, device count)."""
+    started = time.perf_counter()
+    if mode == 'stream':
+        with open(path, 'rb') as f:
+            chunks = iter(lambda: f.read(jsonstream.CHUNK_SIZE), b'')
+            records = [MosyleDevice.from_json(d) for d in jsonstream.iter_array(chunks, ('response', 'devices'))]
+    else:
+        with open(path, 'rb') as f:
+            body = f.read()
+        if mode == 'buffered-orjson':
+            data = jsonstream.orjson.loads(body)
+        else:
+            data = json.loads(body)
+        del body
+        records = [MosyleDevice.from_json(d) for d in data['response']['devices']]
+        del data
+    return time.perf_counter() - started, len(records)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--devices', type=int, default=50000, help='Devices in the synthetic body (default: 50000)')
+    parser.add_argument('--mode', choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument('--payload', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        # Child process: run a single mode and report as JSON
+        seconds, count = run_mode(args.mode, args.payload)
+        peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform == 'darwin':
+            peak_kb //= 1024
+        print(json.dumps({'seconds': seconds, 'devices': count, 'peak_rss_kb': peak_kb}))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'listdevices.json')
+        write_payload(path, args.devices)
+        size_mb = os.path.getsize(path) / 1024 / 1024
+        print(f"Payload: {args.devices} devices, {size_mb:.1f} MB. Backends: {jsonstream.backend()}")
+        print(f"{'mode':<18}{'parse s':>10}{'peak RSS MB':>14}")
+        for mode in MODES:
+            if mode == 'buffered-orjson' and jsonstream.orjson is None:
+                print(f"{mode:<18}{'(orjson not installed)':>24}")
+                continue
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--mode', mode, '--payload', path],
+                check=True, capture_output=True, text=True
+            ).stdout
+            result = json.loads(output)
+            print(f"{mode:<18}{result['seconds']:>10.2f}{result['peak_rss_kb'] / 1024:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
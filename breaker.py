@@ -0,0 +1,207 @@
+"""
+Circuit breakers for MosyleSnipeSync.
+One breaker per upstream (each Snipe-IT and Mosyle URL) is shared by every
+client and thread in the process. After `failure_threshold` consecutive
+failures (network errors, HTTP 5xx) the breaker opens and further calls fail
+immediately with CircuitOpenError instead of each retrying for minutes. Once
+`reset_timeout` has passed a single half-open probe is let through: success
+closes the breaker, failure opens it again for twice as long (up to
+`max_reset_timeout`). A probe that never reports back (cancelled, or ended
+by an unexpected exception) is released by its caller, and one that has
+been out for `reset_timeout` is given up on, so another call can probe.
+"""
+import threading
+import time
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+# Settings for breakers created by get_breaker(), unless changed with configure()
+DEFAULTS = {
+    'failure_threshold': 5,
+    'reset_timeout': 60,
+    'max_reset_timeout': 900,
+}
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of making a call while an upstream's breaker is open."""
+
+    def __init__(self, breaker):
+        self.breaker = breaker
+        super().__init__(
+            f"{breaker.name} circuit is open after {breaker.failures} consecutive failures "
+            f"(last error: {breaker.last_error or 'unknown'}), retrying in {breaker.retry_after():.0f}s"
+        )
+
+
+class CircuitBreaker:
+    """Closed/open/half-open breaker for one upstream. Thread-safe."""
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=60, max_reset_timeout=900,
+                 clock=time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.clock = clock
+
+        self.state = CLOSED
+        self.failures = 0
+        self.last_error = None
+        self.times_opened = 0
+        self.rejected = 0
+        self._timeout = reset_timeout
+        self._opened_at = None
+        self._probing = False
+        self._probe_started = None
+        self._lock = threading.Lock()
+
+    def _admit(self):
+        """None if the call is refused, True if it is the half-open probe, else False."""
+        with self._lock:
+            if self.state == CLOSED:
+                return False
+            now = self.clock()
+            if self.state == OPEN and now >= self._opened_at + self._timeout:
+                self.state = HALF_OPEN
+                self._probing = False
+            if self.state == HALF_OPEN and self._probing and now >= self._probe_started + self.reset_timeout:
+                # The probe never reported back; let another call try
+                self._probing = False
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                self._probe_started = now
+                return True
+            self.rejected += 1
+            return None
+
+    def allow(self):
+        """
+        Whether a call may go ahead now. While half-open only the one probe
+        call is allowed; it must report back with record_success() or
+        record_failure(), or give up its slot with release().
+        """
+        return self._admit() is not None
+
+    def check(self):
+        """
+        Raise CircuitOpenError unless a call may go ahead. Returns True if
+        the call is the half-open probe; callers pass that to release() in a
+        finally block, so a probe that ends without reporting frees its slot.
+        """
+        probe = self._admit()
+        if probe is None:
+            raise CircuitOpenError(self)
+        return probe
+
+    def release(self, probe=True):
+        """End a call started by check() that may not have reported back. A no-op unless it was the probe."""
+        if not probe:
+            return
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probing = False
+
+    def record_success(self):
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self._timeout = self.reset_timeout
+            self._probing = False
+
+    def record_failure(self, error=None):
+        """Count a failed call. Returns True if the breaker is (now) open."""
+        with self._lock:
+            self.failures += 1
+            if error is not None:
+                self.last_error = str(error)
+            if self.state == HALF_OPEN:
+                # The probe failed: stay away for longer this time
+                self._timeout = min(self.max_reset_timeout, self._timeout * 2)
+                self._open()
+            elif self.state == CLOSED and self.failures >= self.failure_threshold:
+                self._timeout = self.reset_timeout
+                self._open()
+            return self.state == OPEN
+
+    def _open(self):
+        self.state = OPEN
+        self._opened_at = self.clock()
+        self._probing = False
+        self.times_opened += 1
+
+    @property
+    def is_open(self):
+        """True while calls are being refused (open, or half-open with a probe in flight)."""
+        with self._lock:
+            return self.state != CLOSED
+
+    def retry_after(self):
+        """Seconds until the next half-open probe is allowed (0 if calls are allowed now)."""
+        with self._lock:
+            if self.state != OPEN:
+                return 0.0
+            return max(0.0, self._opened_at + self._timeout - self.clock())
+
+    def status(self):
+        """State for logs and status reports."""
+        with self._lock:
+            return {
+                'state': self.state,
+                'failures': self.failures,
+                'times_opened': self.times_opened,
+                'rejected': self.rejected,
+                'last_error': self.last_error,
+            }
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+# Settings from configure(), by upstream (None for every upstream)
+_settings = {}
+
+
+def _settings_for(upstream):
+    return dict(DEFAULTS, **_settings.get(None, {}), **_settings.get(upstream, {}))
+
+
+def get_breaker(upstream, url):
+    """Return the process-wide breaker for an upstream ('Snipe-IT', 'Mosyle') at a URL."""
+    key = (upstream, url)
+    with _breakers_lock:
+        breaker = _breakers.get(key)
+        if breaker is None:
+            # The URL is only needed in the name once there are several of an upstream
+            name = upstream if all(k[0] != upstream for k in _breakers) else f"{upstream} ({url})"
+            breaker = _breakers[key] = CircuitBreaker(name, **_settings_for(upstream))
+        return breaker
+
+
+def configure(upstream=None, **settings):
+    """
+    Change the settings of the existing and future breakers of one upstream,
+    or of every upstream. DEFAULTS is left as it is.
+    """
+    unknown = set(settings) - set(DEFAULTS)
+    if unknown:
+        raise TypeError(f"Unknown circuit breaker settings: {', '.join(sorted(unknown))}")
+    with _breakers_lock:
+        _settings.setdefault(upstream, {}).update(settings)
+        for (breaker_upstream, _), breaker in _breakers.items():
+            if upstream is not None and breaker_upstream != upstream:
+                continue
+            with breaker._lock:
+                for key, value in _settings_for(breaker_upstream).items():
+                    setattr(breaker, key, value)
+                if breaker.state == CLOSED:
+                    breaker._timeout = breaker.reset_timeout
+
+
+def all_breakers():
+    """Every breaker created in this process, by name."""
+    with _breakers_lock:
+        return {breaker.name: breaker for breaker in _breakers.values()}
@@ -0,0 +1,395 @@
+"""
+HTTP record/replay for MosyleSnipeSync.
+Record mode captures every request/response that goes through a requests
+Session (Snipe-IT, Mosyle and AppleDB all use one) into a gzip-compressed
+JSON-lines cassette, with credentials redacted. Replay mode serves the
+cassette back without touching the network, sleeping for the recorded (or
+scaled) latency of each call, so a production run can be reproduced offline
+and compared request for request.
+
+The cassette is written as a series of gzip members, each flushed to disk
+as it is completed, so a recording cut short by a crash or a stop keeps
+everything up to its last flush.
+"""
+import base64
+import gzip
+import hashlib
+import json
+import threading
+import time
+from collections import deque
+from datetime import timedelta
+from pathlib import Path
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+from logger_config import get_logger
+from snipe import Snipe
+
+CASSETTE_VERSION = 1
+
+REDACTED = "REDACTED"
+
+# Header, query parameter and JSON field names whose values are never written
+SECRET_HEADERS = ('authorization', 'cookie', 'set-cookie', 'x-webhook-token')
+SECRET_FIELDS = ('accesstoken', 'access_token', 'password', 'token', 'apikey', 'api_key',
+                 'jwt', 'refresh_token', 'secret')
+
+# A recording is flushed to disk after this many exchanges or seconds,
+# whichever comes first
+FLUSH_EVERY = 50
+FLUSH_INTERVAL = 5.0
+
+# Bytes read per chunk when draining the rest of a streamed response
+CHUNK_SIZE = 64 * 1024
+
+# Response headers worth keeping; the rest only bloat the cassette
+KEPT_RESPONSE_HEADERS = ('content-type', 'authorization', 'retry-after', 'x-ratelimit-remaining',
+                         'x-ratelimit-limit')
+
+
+def _redact_json(node):
+    if isinstance(node, dict):
+        return {key: (REDACTED if key.lower() in SECRET_FIELDS else _redact_json(value))
+                for key, value in node.items()}
+    if isinstance(node, list):
+        return [_redact_json(item) for item in node]
+    return node
+
+
+def redact_url(url):
+    parts = urlsplit(url)
+    if not parts.query:
+        return url
+    query = [(key, REDACTED if key.lower() in SECRET_FIELDS else value)
+             for key, value in parse_qsl(parts.query, keep_blank_values=True)]
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+def redact_headers(headers, keep=None):
+    redacted = {}
+    for key, value in headers.items():
+        name = key.lower()
+        if keep is not None and name not in keep:
+            continue
+        if name in SECRET_HEADERS:
+            # Keep the scheme so "Bearer <token>" still parses on replay
+            scheme = value.split(' ', 1)[0] if ' ' in value else ''
+            value = f"{scheme} {REDACTED}".strip()
+        redacted[name] = value
+    return redacted
+
+
+def redact_body(body):
+    """Redacted body as text (JSON re-serialized with sorted keys), or None if not JSON."""
+    if not body:
+        return ''
+    if isinstance(body, bytes):
+        try:
+            body = body.decode('utf8')
+        except UnicodeDecodeError:
+            return None
+    try:
+        return json.dumps(_redact_json(json.loads(body)), sort_keys=True)
+    except ValueError:
+        return None
+
+
+def _redact_response_body(content, content_type):
+    # Only parse bodies that can contain a secret at all; Mosyle device pages
+    # and AppleDB's main.json are large and never do
+    if 'json' not in (content_type or '') or not any(
+            f'"{field}"'.encode('utf8') in content.lower() for field in SECRET_FIELDS):
+        return content
+    redacted = redact_body(content)
+    return content if redacted is None else redacted.encode('utf8')
+
+
+def request_key(method, url, body):
+    """Key a request is matched on: method, redacted URL and a digest of the redacted JSON body."""
+    redacted = redact_body(body)
+    # Non-JSON bodies (multipart image uploads) carry random boundaries
+    digest = hashlib.sha1(redacted.encode('utf8')).hexdigest() if redacted else ''
+    return f"{method} {redact_url(url)} {digest}"
+
+
+def _encode_body(content):
+    try:
+        return {'body': content.decode('utf8')}
+    except UnicodeDecodeError:
+        return {'body_b64': base64.b64encode(content).decode('ascii')}
+
+
+def _decode_body(entry):
+    if 'body_b64' in entry:
+        return base64.b64decode(entry['body_b64'])
+    return entry.get('body', '').encode('utf8')
+
+
+class _SessionHook:
+    """Mounts an adapter on every requests.Session created while installed."""
+
+    def __init__(self):
+        self._original_init = None
+
+    def install(self):
+        adapter = self
+        original = self._original_init = requests.Session.__init__
+
+        def __init__(session, *args, **kwargs):
+            original(session, *args, **kwargs)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+
+        requests.Session.__init__ = __init__
+
+    def uninstall(self):
+        if self._original_init is not None:
+            requests.Session.__init__ = self._original_init
+            self._original_init = None
+
+
+class CassetteRecorder(_SessionHook, HTTPAdapter):
+    """Transport adapter that performs real requests and appends them to a cassette."""
+
+    def __init__(self, path):
+        HTTPAdapter.__init__(self)
+        _SessionHook.__init__(self)
+        self.path = Path(path)
+        self.count = 0
+        self._started = time.monotonic()
+        self._lock = threading.Lock()
+        self._pending = []
+        self._flushed_at = self._started
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, 'wb')
+        self._write({'type': 'header', 'version': CASSETTE_VERSION, 'recorded_at': time.time()})
+        self._flush()
+
+    def _write(self, entry):
+        self._pending.append(json.dumps(entry) + '\n')
+        if len(self._pending) >= FLUSH_EVERY or time.monotonic() - self._flushed_at >= FLUSH_INTERVAL:
+            self._flush()
+
+    def _flush(self):
+        """Append the pending entries as one complete gzip member."""
+        if self._pending:
+            self._file.write(gzip.compress(''.join(self._pending).encode('utf8')))
+            self._file.flush()
+            self._pending = []
+        self._flushed_at = time.monotonic()
+
+    def _record(self, request, response, content, started, latency, partial=False):
+        entry = {
+            'type': 'exchange',
+            'key': request_key(request.method, request.url, request.body),
+            'method': request.method,
+            'url': redact_url(request.url),
+            'status': response.status_code,
+            'reason': response.reason,
+            'headers': redact_headers(response.headers, keep=KEPT_RESPONSE_HEADERS),
+            'latency': round(latency, 6),
+            'offset': round(started - self._started, 6),
+        }
+        if partial:
+            entry['partial'] = True
+        entry.update(_encode_body(_redact_response_body(content, response.headers.get('content-type'))))
+        with self._lock:
+            if self._file is None:
+                return
+            self._write(entry)
+            self.count += 1
+
+    def send(self, request, **kwargs):
+        started = time.monotonic()
+        response = super().send(request, **kwargs)
+        if kwargs.get('stream'):
+            self._tee(request, response, started, time.monotonic() - started)
+            return response
+        # Read the whole body so its transfer time is part of the latency
+        content = response.content
+        self._record(request, response, content, started, time.monotonic() - started)
+        return response
+
+    def _tee(self, request, response, started, latency):
+        """
+        Record a streamed response as the caller reads it, so stream=True
+        callers (Mosyle device pages, AppleDB) still parse it incrementally.
+        The latency is the time to the response headers, as the transfer
+        overlaps with the caller's parsing.
+        """
+        recorder = self
+        iter_content = response.iter_content
+        close = response.close
+        chunks = []
+        state = {'done': False}
+
+        def finish(partial):
+            if not state['done']:
+                state['done'] = True
+                content = b''.join(chunk.encode('utf8') if isinstance(chunk, str) else chunk for chunk in chunks)
+                recorder._record(request, response, content, started, latency, partial=partial)
+
+        def tee_content(chunk_size=1, decode_unicode=False):
+            for chunk in iter_content(chunk_size, decode_unicode):
+                chunks.append(chunk)
+                yield chunk
+            finish(partial=False)
+
+        def tee_close():
+            if not state['done']:
+                # A streaming parser stops once it has what it needs; read
+                # the rest (usually a few closing brackets) for the recording
+                try:
+                    chunks.extend(iter_content(CHUNK_SIZE))
+                    finish(partial=False)
+                except requests.RequestException:
+                    finish(partial=True)
+            close()
+
+        response.iter_content = tee_content
+        response.close = tee_close
+
+    def close(self):
+        """Finish the cassette. Safe to call twice."""
+        self.uninstall()
+        with self._lock:
+            if self._file is None:
+                return
+            self._write({'type': 'end', 'requests': self.count,
+                         'elapsed': round(time.monotonic() - self._started, 6)})
+            self._flush()
+            self._file.close()
+            self._file = None
+        get_logger().info(f"Recorded {self.count} HTTP requests to {self.path}")
+        HTTPAdapter.close(self)
+
+
+class CassettePlayer(_SessionHook, BaseAdapter):
+    """
+    Transport adapter that answers requests from a cassette.
+
+    Requests are matched on method, URL and body. Identical requests are
+    answered in recorded order; once their recordings run out the last one is
+    repeated. A request that was never recorded raises ConnectionError, which
+    the clients already treat as a network failure.
+    """
+
+    def __init__(self, path, latency_scale=1.0, sleep=None):
+        BaseAdapter.__init__(self)
+        _SessionHook.__init__(self)
+        self.path = Path(path)
+        self.latency_scale = latency_scale
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._queues = {}
+        self._last = {}
+        self.recorded = 0
+        self.recorded_elapsed = None
+        self.served = 0
+        self.repeated = 0
+        self.unmatched = 0
+        self._started = time.monotonic()
+
+        with gzip.open(self.path, 'rt', encoding='utf8') as f:
+            try:
+                for line in f:
+                    entry = json.loads(line)
+                    kind = entry.get('type')
+                    if kind == 'header' and entry.get('version') != CASSETTE_VERSION:
+                        raise ValueError(f"Unsupported cassette version {entry.get('version')} in {self.path}")
+                    if kind == 'exchange':
+                        self._queues.setdefault(entry['key'], deque()).append(entry)
+                        self.recorded += 1
+                    elif kind == 'end':
+                        self.recorded_elapsed = entry.get('elapsed')
+            except (EOFError, json.JSONDecodeError):
+                # The recording was killed while writing its last flush
+                get_logger().warning(f"{self.path} ends early; replaying the {self.recorded} complete requests")
+        if self.recorded_elapsed is None:
+            get_logger().warning(f"{self.path} has no end record, the recording was interrupted")
+
+    def _take(self, key):
+        with self._lock:
+            queue = self._queues.get(key)
+            if queue:
+                entry = queue.popleft()
+                self._last[key] = entry
+                self.served += 1
+                return entry
+            entry = self._last.get(key)
+            if entry is not None:
+                self.repeated += 1
+            else:
+                self.unmatched += 1
+            return entry
+
+    def send(self, request, **kwargs):
+        key = request_key(request.method, request.url, request.body)
+        entry = self._take(key)
+        if entry is None:
+            raise requests.exceptions.ConnectionError(
+                f"No recorded response for {request.method} {redact_url(request.url)}", request=request)
+
+        latency = entry.get('latency', 0) * self.latency_scale
+        if latency > 0:
+            (self._sleep or time.sleep)(latency)
+
+        response = requests.Response()
+        response.status_code = entry['status']
+        response.reason = entry.get('reason')
+        response.headers = CaseInsensitiveDict(entry.get('headers', {}))
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        response._content = _decode_body(entry)
+        response._content_consumed = True
+        response.url = request.url
+        response.request = request
+        response.elapsed = timedelta(seconds=latency)
+        return response
+
+    def install(self):
+        """Serve new sessions from the cassette, and stop Snipe clients waiting for their rate budget."""
+        super().install()
+        # Replayed responses cost nothing, so waiting out the per-minute
+        # budget only makes the replay slower than the recording
+        self._reserve_request = Snipe.__dict__['_reserveRequest']
+        Snipe._reserveRequest = lambda snipe: None
+
+    def uninstall(self):
+        super().uninstall()
+        if getattr(self, '_reserve_request', None) is not None:
+            Snipe._reserveRequest = self._reserve_request
+            self._reserve_request = None
+
+    def unused(self):
+        with self._lock:
+            return sum(len(queue) for queue in self._queues.values())
+
+    def stats(self):
+        """Replay counters for comparing a run against the recording."""
+        return {
+            'recorded': self.recorded,
+            'served': self.served,
+            'repeated': self.repeated,
+            'unmatched': self.unmatched,
+            'unused': self.unused(),
+            'elapsed': round(time.monotonic() - self._started, 3),
+            'recorded_elapsed': self.recorded_elapsed,
+        }
+
+    def close(self):
+        """Stop serving new sessions and log how the run compared to the recording."""
+        if self._original_init is None:
+            return
+        self.uninstall()
+        stats = self.stats()
+        recorded_elapsed = stats['recorded_elapsed']
+        get_logger().info(
+            f"Replayed {stats['served']} of {stats['recorded']} recorded requests "
+            f"({stats['repeated']} repeated, {stats['unmatched']} unmatched, {stats['unused']} unused). "
+            f"Wall time {stats['elapsed']:.1f}s"
+            + (f" vs {recorded_elapsed:.1f}s recorded" if recorded_elapsed is not None else "")
+        )
@@ -14,6 +14,7 @@ NC='\033[0m' # No Color
 APP_DIR="/opt/mosyle-snipe-sync"
 CONFIG_DIR="/etc/mosyle-snipe-sync"
 LOG_DIR="/var/log/mosyle-snipe-sync"
+STATE_DIR="/var/lib/mosyle-snipe-sync"
 USER="mosyle-snipe"
 GROUP="mosyle-snipe"
 
@@ -52,6 +53,7 @@ echo -e "${GREEN}Creating directories...${NC}"
 mkdir -p "$APP_DIR"
 mkdir -p "$CONFIG_DIR"
 mkdir -p "$LOG_DIR"
+mkdir -p "$STATE_DIR"
 
 # Step 4: Copy application files
 echo -e "${GREEN}Copying application files...${NC}"
@@ -63,6 +65,19 @@ cp "$SCRIPT_DIR"/requirements.txt "$APP_DIR/" 2>/dev/null || true
 echo -e "${GREEN}Copying configuration file...${NC}"
 cp "$SETTINGS_FILE" "$CONFIG_DIR/settings.ini"
 chmod 600 "$CONFIG_DIR/settings.ini"
+# Manual runs against this settings.ini share the units' state (rate limit budget, retry queue)
+if grep -q '^state_dir *= *[^ ]' "$CONFIG_DIR/settings.ini"; then
+    if ! grep -q "^state_dir *= *$STATE_DIR *$" "$CONFIG_DIR/settings.ini"; then
+        echo -e "${YELLOW}Warning: settings.ini sets a state_dir other than $STATE_DIR, which the systemd units use${NC}"
+    fi
+else
+    if grep -q '^\[general\]' "$CONFIG_DIR/settings.ini"; then
+        sed -i "/^\[general\]/a state_dir = $STATE_DIR" "$CONFIG_DIR/settings.ini"
+        sed -i '/^state_dir *= *$/d' "$CONFIG_DIR/settings.ini"
+    else
+        printf '\n[general]\nstate_dir = %s\n' "$STATE_DIR" >> "$CONFIG_DIR/settings.ini"
+    fi
+fi
 
 # Step 6: Copy .env file if it exists
 if [ -f "$SCRIPT_DIR/.env" ]; then
@@ -87,9 +102,11 @@ echo -e "${GREEN}Setting permissions...${NC}"
 chown -R "$USER:$GROUP" "$APP_DIR"
 chown -R "$USER:$GROUP" "$CONFIG_DIR"
 chown -R "$USER:$GROUP" "$LOG_DIR"
+chown -R "$USER:$GROUP" "$STATE_DIR"
 chmod 755 "$APP_DIR"
 chmod 755 "$CONFIG_DIR"
 chmod 755 "$LOG_DIR"
+chmod 755 "$STATE_DIR"
 
 # Step 8: Create Python virtual environment
 echo -e "${GREEN}Creating Python virtual environment...${NC}"
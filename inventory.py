@@ -0,0 +1,145 @@
+"""
+Write-through Snipe-IT asset cache for MosyleSnipeSync.
+Keeps the hardware rows seen during a run, keyed by serial, and updates them
+from the response bodies of the sync's own create, PATCH, checkout and
+check-in calls. Rows use the same shape as /hardware/byserial results, so the
+sync never has to re-read an asset it has just written.
+"""
+import threading
+
+
+def _user_summary(user_row):
+    """Reduce a /users row to the assigned_to shape used by hardware rows."""
+    return {
+        'id': user_row.get('id'),
+        'username': user_row.get('username'),
+        'name': user_row.get('name'),
+        'email': user_row.get('email'),
+        'type': 'user',
+    }
+
+
+class AssetCache:
+    """
+    In-memory hardware rows keyed by serial number, plus an id index and the
+    serials a lookup found no asset for.
+    """
+
+    def __init__(self):
+        self._by_serial = {}
+        self._serial_by_id = {}
+        self._missing = set()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._by_serial)
+
+    def _store(self, row):
+        serial = row.get('serial')
+        if not serial:
+            return
+        self._by_serial[serial] = row
+        self._missing.discard(serial)
+        if row.get('id') is not None:
+            self._serial_by_id[row['id']] = serial
+
+    def _row_for_id(self, asset_id):
+        serial = self._serial_by_id.get(asset_id)
+        return self._by_serial.get(serial) if serial else None
+
+    def get(self, serial):
+        """Return the cached row for a serial, or None if it has not been seen."""
+        with self._lock:
+            return self._by_serial.get(serial)
+
+    def get_by_id(self, asset_id):
+        """Return the cached row for an asset id, or None."""
+        with self._lock:
+            return self._row_for_id(asset_id)
+
+    def as_response(self, serial):
+        """
+        Return the cached asset in /hardware/byserial response shape
+        ({'total': n, 'rows': [...]}), an empty listing if a lookup found no
+        asset for it, or None if the serial is not cached.
+        """
+        with self._lock:
+            row = self._by_serial.get(serial)
+            if row is None:
+                return {'total': 0, 'rows': []} if serial in self._missing else None
+        return {'total': 1, 'rows': [row]}
+
+    def is_missing(self, serial):
+        """True if a lookup found no asset for the serial (and none was cached since)."""
+        with self._lock:
+            return serial in self._missing
+
+    def record_missing(self, serial):
+        """Remember that a hardware lookup found no asset for a serial."""
+        with self._lock:
+            if serial not in self._by_serial:
+                self._missing.add(serial)
+
+    def store_rows(self, rows):
+        """Cache rows from a hardware listing."""
+        with self._lock:
+            for row in rows or []:
+                if isinstance(row, dict):
+                    self._store(row)
+
+    def record_create(self, response_body, request_payload):
+        """
+        Cache an asset from a successful POST /hardware.
+
+        The create response carries the flat model attributes (model_id,
+        status_id, ...) rather than the nested shape of a listing, so it is
+        normalized here.
+        """
+        created = (response_body or {}).get('payload') or {}
+        if created.get('id') is None:
+            return None
+        row = {
+            'id': created['id'],
+            'name': created.get('name', request_payload.get('name')),
+            'asset_tag': created.get('asset_tag', request_payload.get('asset_tag')),
+            'serial': created.get('serial', request_payload.get('serial')),
+            'model': {'id': created.get('model_id', request_payload.get('model_id'))},
+            'status_label': {'id': created.get('status_id', request_payload.get('status_id'))},
+            'assigned_to': None,
+        }
+        with self._lock:
+            self._store(row)
+        return row
+
+    def record_update(self, asset_id, response_body, request_payload):
+        """Merge a successful PATCH /hardware/{id} into the cached row."""
+        updated = (response_body or {}).get('payload') or {}
+        with self._lock:
+            row = self._row_for_id(asset_id)
+            if row is None:
+                return None
+            for key in ('name', 'asset_tag', 'serial'):
+                if key in updated:
+                    row[key] = updated[key]
+                elif key in request_payload:
+                    row[key] = request_payload[key]
+            model_id = updated.get('model_id', request_payload.get('model_id'))
+            if model_id is not None:
+                row['model'] = dict(row.get('model') or {}, id=model_id)
+            return row
+
+    def record_checkout(self, asset_id, user_row):
+        """Mark a cached asset as checked out to a user row from /users."""
+        with self._lock:
+            row = self._row_for_id(asset_id)
+            if row is not None:
+                row['assigned_to'] = _user_summary(user_row)
+            return row
+
+    def record_checkin(self, asset_id):
+        """Mark a cached asset as checked in."""
+        with self._lock:
+            row = self._row_for_id(asset_id)
+            if row is not None:
+                row['assigned_to'] = None
+            return row
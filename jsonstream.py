@@ -0,0 +1,226 @@
+"""
+JSON decoding helpers for MosyleSnipeSync.
+Large API bodies (Mosyle listdevices pages, AppleDB main.json) can be
+stream-parsed item by item instead of buffering and decoding the whole body
+at once. orjson is used for whole-body decoding and ijson for streaming when
+they are installed; otherwise the standard library is used.
+"""
+import codecs
+import json
+
+try:
+    import orjson
+except ImportError:  # optional
+    orjson = None
+
+try:
+    import ijson
+except ImportError:  # optional
+    ijson = None
+
+# Exceptions raised for malformed or truncated JSON, whichever backend is used
+DECODE_ERRORS = (ValueError,) + ((ijson.JSONError,) if ijson is not None else ())
+
+# Bytes requested from the HTTP response per read when streaming
+CHUNK_SIZE = 64 * 1024
+
+# Drop consumed text from the buffer once this much has piled up
+_COMPACT_AT = 1024 * 1024
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = ' \t\n\r'
+
+
+def backend():
+    """Names of the (whole-body, streaming) JSON backends in use."""
+    return ('orjson' if orjson else 'json', 'ijson' if ijson else 'json')
+
+
+def loads(data):
+    """Decode a complete JSON document from bytes or str."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class _ChunkReader:
+    """Incrementally decoded text buffer over an iterable of byte chunks."""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._utf8 = codecs.getincrementaldecoder('utf-8')()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        """Read one more chunk. Returns False once the input is exhausted."""
+        if self.eof:
+            return False
+        if self.pos > _COMPACT_AT:
+            self.buf = self.buf[self.pos:]
+            self.pos = 0
+        for chunk in self._chunks:
+            if chunk:
+                self.buf += self._utf8.decode(chunk)
+                return True
+        self.buf += self._utf8.decode(b'', final=True)
+        self.eof = True
+        return False
+
+    def peek(self):
+        """Skip whitespace and return the next character ('' at end of input)."""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                return ''
+
+    def expect(self, char):
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"Expected '{char}' at offset {self.pos}, found {found!r}")
+        self.pos += 1
+
+    def value(self):
+        """Decode the next complete JSON value, reading more input as needed."""
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if self.fill():
+                    continue
+                raise
+            # A number running into the end of the buffer (or stopping at a
+            # dangling '.', 'e' or sign) may be cut short
+            if (isinstance(value, (int, float)) and not isinstance(value, bool) and not self.eof
+                    and (end == len(self.buf) or self.buf[end] in '.eE+-') and self.fill()):
+                continue
+            self.pos = end
+            return value
+
+
+# ijson event types of scalar values
+_SCALAR_EVENTS = ('string', 'number', 'boolean', 'null')
+
+
+def _seek(reader, path, header=None):
+    """
+    Advance the reader to the opening '[' of the array at `path`. False if
+    absent. Scalar members of the top-level object passed on the way are
+    stored in header.
+    """
+    for depth, key in enumerate(path):
+        if reader.peek() != '{':
+            return False
+        reader.expect('{')
+        while True:
+            if reader.peek() == '}':
+                return False
+            name = reader.value()
+            reader.expect(':')
+            if name == key:
+                break
+            value = reader.value()
+            if header is not None and depth == 0 and not isinstance(value, (dict, list)):
+                header[name] = value
+            if reader.peek() == ',':
+                reader.pos += 1
+    if reader.peek() != '[':
+        return False
+    reader.expect('[')
+    return True
+
+
+def _finish(reader, depth, header):
+    """Read the members left in the `depth` objects around the array, storing top-level scalars in header."""
+    for level in reversed(range(depth)):
+        while reader.peek() == ',':
+            reader.pos += 1
+            name = reader.value()
+            reader.expect(':')
+            value = reader.value()
+            if level == 0 and not isinstance(value, (dict, list)):
+                header[name] = value
+        reader.expect('}')
+
+
+def _iter_stdlib(chunks, path, header=None):
+    reader = _ChunkReader(chunks)
+    if not _seek(reader, path, header):
+        return
+    if reader.peek() != ']':
+        while True:
+            yield reader.value()
+            separator = reader.peek()
+            if separator == ']':
+                break
+            if separator != ',':
+                raise ValueError(f"Expected ',' or ']' at offset {reader.pos}, found {separator!r}")
+            reader.pos += 1
+    reader.pos += 1
+    if header is not None:
+        # Members after the array, such as a trailing status
+        _finish(reader, len(path), header)
+
+
+class _ChunkFile:
+    """File-like wrapper so ijson can read from an iterable of chunks."""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+
+    def read(self, size=-1):
+        if size == 0:
+            # ijson probes the stream type with read(0); don't spend a chunk on it
+            return b''
+        for chunk in self._chunks:
+            if chunk:
+                return chunk
+        return b''
+
+
+def _recording(events, header):
+    """Pass ijson events through, storing scalar members of the top-level object in header."""
+    for prefix, event, value in events:
+        if prefix and '.' not in prefix and event in _SCALAR_EVENTS:
+            header[prefix] = value
+        yield prefix, event, value
+
+
+def iter_array(chunks, path=(), header=None):
+    """
+    Yield the items of a JSON array as they are parsed.
+
+    Args:
+        chunks: Iterable of bytes, e.g. response.iter_content(CHUNK_SIZE)
+        path: Keys leading from the top-level object to the array, e.g.
+            ('response', 'devices'). Empty for a top-level array.
+        header: Optional dict that receives the scalar members of the
+            top-level object, e.g. a status field next to the array. The
+            whole document is read then, so it is also checked for
+            truncation after the array
+
+    Yields nothing if the path does not exist in the document.
+    """
+    if ijson is not None:
+        prefix = '.'.join(tuple(path) + ('item',))
+        # use_float keeps numbers as float/int like the json module
+        if header is None:
+            yield from ijson.items(_ChunkFile(chunks), prefix, use_float=True)
+        else:
+            events = _recording(ijson.parse(_ChunkFile(chunks), use_float=True), header)
+            yield from ijson.items(events, prefix)
+    else:
+        yield from _iter_stdlib(chunks, path, header)
+
+
+def iter_response_array(response, path=(), header=None):
+    """iter_array() over a streamed requests response (requests.get(..., stream=True))."""
+    try:
+        yield from iter_array(response.iter_content(CHUNK_SIZE), path, header)
+    finally:
+        response.close()
@@ -4,23 +4,134 @@ Synchronizes Apple device data from Mosyle to Snipe-IT.
 Can run as a one-time sync or as a scheduled daemon.
 """
 import json
+import csv
 import datetime
 import configparser
 import argparse
 import time
+import threading
 import sys
+import signal
+import cProfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 import os
 from pathlib import Path
 from rich.progress import Progress
-from rich.console import Console
 
-from mosyle import Mosyle
+from mosyle import Mosyle, MosyleDevice
 from snipe import Snipe
+from appleInfo import backfill_model_images
+from assignments import AssignmentPlan
+from scheduler import AdaptiveScheduler
+from webhook import WebhookReceiver
+from profiling import Profiler
+from cassette import CassettePlayer, CassetteRecorder
+from ratelimit import SharedRateLimiter
+from retryqueue import SKIPPED_STEP, RetryQueue
+from breaker import CircuitOpenError, all_breakers, configure as configure_breakers
+import asyncclients
+from onboarding import DEFAULT_CHUNK_SIZE, bulk_onboard
+from status import StatusServer, get_status
+from snapshot import SNAPSHOT_FIELDS, SnapshotCollector, format_table, parse_filter, query, write_snapshot
+from sharding import (
+    ShardLease, merge_summaries, parse_shard, read_shard_summaries, shard_for, shard_name, write_shard_summary
+)
 from logger_config import setup_logging, get_logger
 
+# Run state when neither --state-dir nor [general] state_dir is set: next to
+# main.py rather than in the working directory, so every run of one install
+# shares it
+DEFAULT_STATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'state')
+
+
+def _tenant_section(config, base, name=None):
+    """
+    Settings for one tenant: the [base:name] section layered over [base], so
+    values shared by every tenant only need to be written once.
+    """
+    values = dict(config[base]) if config.has_section(base) else {}
+    section = base if name is None else f"{base}:{name}"
+    if name is not None and config.has_section(section):
+        values.update(config[section])
+    merged = configparser.ConfigParser(interpolation=None)
+    merged.read_dict({section: values})
+    return merged[section]
+
+
+def _read_mosyle_settings(section):
+    """Extract the Mosyle settings from a (merged) configuration section."""
+    logger = get_logger()
+
+    try:
+        mosyle_url = section['url']
+        mosyle_token = section['token']
+        mosyle_user = section['user']
+        mosyle_password = section['password']
+        deviceTypes = section['deviceTypes'].split(',')
+        calltype = section.get('calltype', 'all')
+    except KeyError as e:
+        logger.error(f"Missing required Mosyle configuration in [{section.name}]: {e}")
+        raise ValueError(f"Missing required Mosyle configuration in [{section.name}]: {e}")
+
+    # Verify required Mosyle credentials
+    if not all([mosyle_url, mosyle_token, mosyle_user, mosyle_password]):
+        logger.error(f"Missing required Mosyle credentials in [{section.name}]")
+        raise ValueError(f"Missing Mosyle credentials in settings.ini [{section.name}] section")
+
+    return {
+        'url': mosyle_url,
+        'token': mosyle_token,
+        'user': mosyle_user,
+        'password': mosyle_password,
+        'deviceTypes': deviceTypes,
+        'calltype': calltype
+    }
+
+
+def _read_snipe_settings(section):
+    """Extract the Snipe-IT settings from a (merged) configuration section."""
+    logger = get_logger()
+
+    try:
+        return {
+            'url': section['url'],
+            'apiKey': section['apiKey'],
+            'manufacturer_id': section['manufacturer_id'],
+            'macos_category_id': section['macos_category_id'],
+            'ios_category_id': section['ios_category_id'],
+            'tvos_category_id': section['tvos_category_id'],
+            'macos_fieldset_id': section['macos_fieldset_id'],
+            'ios_fieldset_id': section['ios_fieldset_id'],
+            'tvos_fieldset_id': section['tvos_fieldset_id'],
+            'rate_limit': int(section['rate_limit']),
+            'apple_image_check': section.getboolean('apple_image_check'),
+            'bulk_checkout': section.getboolean('bulk_checkout', fallback=False),
+            'assignment_workers': section.getint('assignment_workers', fallback=4),
+            'async_lookups': section.getboolean('async_lookups', fallback=False),
+            'async_concurrency': section.getint('async_concurrency', fallback=50),
+            'http2': section.getboolean('http2', fallback=False),
+            'shared_rate_limit': section.getboolean('shared_rate_limit', fallback=True)
+        }
+    except KeyError as e:
+        logger.error(f"Missing required configuration key in [{section.name}]: {e}")
+        raise
+
+
+def tenant_names(config):
+    """Names of the [mosyle:NAME] tenant sections, in file order."""
+    return [section.split(':', 1)[1].strip() for section in config.sections()
+            if section.startswith('mosyle:')]
+
 
 def load_configuration(config_file='settings.ini'):
-    """Load configuration from settings.ini."""
+    """
+    Load configuration from settings.ini.
+
+    A file may describe several tenants as [mosyle:NAME] sections, each
+    paired with an optional [snipe-it:NAME] section. Tenant sections inherit
+    anything they leave out from [mosyle] and [snipe-it]. Without tenant
+    sections, [mosyle] and [snipe-it] form the single tenant "default".
+    """
     logger = get_logger()
 
     # Load configuration file
@@ -31,81 +142,118 @@ def load_configuration(config_file='settings.ini'):
     config = configparser.ConfigParser(interpolation=None)
     config.read(config_file)
 
-    # Extract Mosyle config
-    try:
-        mosyle_url = config['mosyle']['url']
-        mosyle_token = config['mosyle']['token']
-        mosyle_user = config['mosyle']['user']
-        mosyle_password = config['mosyle']['password']
-        deviceTypes = config['mosyle']['deviceTypes'].split(',')
-        calltype = config['mosyle'].get('calltype', 'all')
-    except KeyError as e:
-        logger.error(f"Missing required Mosyle configuration: {e}")
-        raise ValueError(f"Missing required Mosyle configuration: {e}")
+    names = tenant_names(config)
+    if len(set(names)) != len(names):
+        raise ValueError("Duplicate [mosyle:NAME] tenant sections in settings.ini")
+    orphans = [section for section in config.sections()
+               if section.startswith('snipe-it:') and section.split(':', 1)[1].strip() not in names]
+    if orphans:
+        raise ValueError(f"No matching [mosyle:NAME] section for {', '.join(orphans)}")
 
-    # Verify required Mosyle credentials
-    if not all([mosyle_url, mosyle_token, mosyle_user, mosyle_password]):
-        logger.error("Missing required Mosyle credentials in settings.ini")
-        raise ValueError("Missing Mosyle credentials in settings.ini [mosyle] section")
+    tenants = []
+    for name in names or [None]:
+        tenants.append({
+            'name': name or 'default',
+            'mosyle': _read_mosyle_settings(_tenant_section(config, 'mosyle', name)),
+            'snipe': _read_snipe_settings(_tenant_section(config, 'snipe-it', name)),
+        })
 
-    # Extract Snipe-IT config
-    try:
-        snipe_url = config['snipe-it']['url']
-        apiKey = config['snipe-it']['apiKey']
-        apple_manufacturer_id = config['snipe-it']['manufacturer_id']
-        macos_category_id = config['snipe-it']['macos_category_id']
-        ios_category_id = config['snipe-it']['ios_category_id']
-        tvos_category_id = config['snipe-it']['tvos_category_id']
-        macos_fieldset_id = config['snipe-it']['macos_fieldset_id']
-        ios_fieldset_id = config['snipe-it']['ios_fieldset_id']
-        tvos_fieldset_id = config['snipe-it']['tvos_fieldset_id']
-        snipe_rate_limit = int(config['snipe-it']['rate_limit'])
-        apple_image_check = config['snipe-it'].getboolean('apple_image_check')
-    except KeyError as e:
-        logger.error(f"Missing required configuration key: {e}")
-        raise
+    # Optional webhook receiver settings (daemon mode only)
+    webhook_token = config.get('webhook', 'token', fallback='') or None
 
-    logger.info("Configuration loaded successfully")
+    # Tenants synced at the same time
+    tenant_workers = config.getint('tenants', 'workers', fallback=4)
+
+    # Circuit breakers for Snipe-IT and Mosyle outages
+    on_open = config.get('circuit-breaker', 'on_open', fallback='abort').strip().lower()
+    if on_open not in ('abort', 'pause'):
+        raise ValueError(f"Invalid [circuit-breaker] on_open '{on_open}', expected abort or pause")
+    breaker_settings = {
+        'failure_threshold': config.getint('circuit-breaker', 'failure_threshold', fallback=5),
+        'reset_timeout': config.getint('circuit-breaker', 'reset_timeout', fallback=60),
+        'max_reset_timeout': config.getint('circuit-breaker', 'max_reset_timeout', fallback=900),
+        'max_pause': config.getint('circuit-breaker', 'max_pause', fallback=900) if on_open == 'pause' else 0,
+    }
+
+    logger.info(f"Configuration loaded successfully ({len(tenants)} tenant{'s' if len(tenants) != 1 else ''})")
+
+    # Retry queue for devices that failed during a run
+    retry_settings = {
+        'enabled': config.getboolean('retry-queue', 'enabled', fallback=True),
+        'max_attempts': config.getint('retry-queue', 'max_attempts', fallback=8),
+        'base_delay': config.getint('retry-queue', 'base_delay', fallback=300),
+        'max_delay': config.getint('retry-queue', 'max_delay', fallback=6 * 3600),
+    }
+
+    configure_breakers(**{key: value for key, value in breaker_settings.items() if key != 'max_pause'})
 
     return {
-        'mosyle': {
-            'url': mosyle_url,
-            'token': mosyle_token,
-            'user': mosyle_user,
-            'password': mosyle_password,
-            'deviceTypes': deviceTypes,
-            'calltype': calltype
-        },
-        'snipe': {
-            'url': snipe_url,
-            'apiKey': apiKey,
-            'manufacturer_id': apple_manufacturer_id,
-            'macos_category_id': macos_category_id,
-            'ios_category_id': ios_category_id,
-            'tvos_category_id': tvos_category_id,
-            'macos_fieldset_id': macos_fieldset_id,
-            'ios_fieldset_id': ios_fieldset_id,
-            'tvos_fieldset_id': tvos_fieldset_id,
-            'rate_limit': snipe_rate_limit,
-            'apple_image_check': apple_image_check
+        # Overridden by --state-dir
+        'state_dir': config.get('general', 'state_dir', fallback='').strip() or None,
+        # Whether every host running --shard workers sees the same state_dir
+        'state_dir_shared': config.getboolean('general', 'state_dir_shared', fallback=False),
+        # The first tenant doubles as the top-level settings for single-tenant callers
+        'mosyle': tenants[0]['mosyle'],
+        'snipe': tenants[0]['snipe'],
+        'tenants': tenants,
+        'tenant_workers': max(1, tenant_workers),
+        'breaker': breaker_settings,
+        'retry': retry_settings,
+        'webhook': {
+            'token': webhook_token
         }
     }
 
 
-def run_sync(config):
-    """
-    Execute a single synchronization run.
+def tenant_config(config, tenant):
+    """Configuration for a run against one tenant."""
+    return dict(config, mosyle=tenant['mosyle'], snipe=tenant['snipe'], tenant=tenant['name'])
 
-    Args:
-        config: Configuration dictionary from load_configuration()
 
-    Returns:
-        int: Total number of devices processed
+def configured_device_types(config):
+    """Every device type configured for any tenant, in configuration order."""
+    device_types = []
+    for tenant in config.get('tenants') or [config]:
+        for device_type in tenant['mosyle']['deviceTypes']:
+            device_type = device_type.strip()
+            if device_type not in device_types:
+                device_types.append(device_type)
+    return device_types
+
+
+def create_snipe_client(config):
     """
-    logger = get_logger()
-    console = Console()
+    Build a Snipe client from the [snipe-it] section of the configuration.
+    With shared_rate_limit (the default) and a state directory, its requests
+    count against a rate budget shared by every process on the host that
+    uses the same Snipe-IT instance and API key.
+    """
+    snipe = Snipe(
+        config['snipe']['apiKey'],
+        config['snipe']['url'],
+        config['snipe']['manufacturer_id'],
+        config['snipe']['macos_category_id'],
+        config['snipe']['ios_category_id'],
+        config['snipe']['tvos_category_id'],
+        config['snipe']['rate_limit'],
+        config['snipe']['macos_fieldset_id'],
+        config['snipe']['ios_fieldset_id'],
+        config['snipe']['tvos_fieldset_id'],
+        config['snipe']['apple_image_check']
+    )
+    if config['snipe'].get('shared_rate_limit') and config.get('state_dir'):
+        snipe.shared_limiter = SharedRateLimiter(
+            config['state_dir'],
+            f"{config['snipe']['url']} {config['snipe']['apiKey']}",
+            config['snipe']['rate_limit']
+        )
+    get_status().track_client(snipe)
+    return snipe
 
-    logger.info("=== Starting synchronization run ===")
+
+def connect_clients(config):
+    """Log in to Mosyle and build the Snipe-IT client. Returns (mosyle, snipe)."""
+    logger = get_logger()
 
     try:
         # Initialize Mosyle
@@ -122,30 +270,461 @@ def run_sync(config):
 
     try:
         # Initialize Snipe-IT
-        snipe = Snipe(
-            config['snipe']['apiKey'],
-            config['snipe']['url'],
-            config['snipe']['manufacturer_id'],
-            config['snipe']['macos_category_id'],
-            config['snipe']['ios_category_id'],
-            config['snipe']['tvos_category_id'],
-            config['snipe']['rate_limit'],
-            config['snipe']['macos_fieldset_id'],
-            config['snipe']['ios_fieldset_id'],
-            config['snipe']['tvos_fieldset_id'],
-            config['snipe']['apple_image_check']
-        )
+        snipe = create_snipe_client(config)
         logger.info("Successfully connected to Snipe-IT")
     except Exception as e:
         logger.error(f"Failed to connect to Snipe-IT: {e}")
         raise
 
+    return mosyle, snipe
+
+
+def new_summary():
+    """Empty run summary, filled in by sync_device() and run_sync()."""
+    return {
+        'processed': 0,
+        'created': 0,
+        'assignment_changes': 0,
+        'tags_synced': 0,
+        'skipped': 0,
+        'paused_seconds': 0,
+        'failed': 0,
+        # Device types whose device list could not be fetched or synced
+        'device_types_failed': 0,
+        'changes_by_type': {},
+        # Devices that failed or were skipped, for the retry queue
+        'failed_devices': [],
+    }
+
+
+def failure_entry(sn, step, error_class, error, device_type=None):
+    """A failed_devices entry for one device."""
+    return {
+        'serial': sn['serial_number'],
+        'device_type': device_type or sn.get('os'),
+        'step': step,
+        'error_class': error_class,
+        'error': error,
+    }
+
+
+def record_failure(summary, sn, step, error_class, error, device_type=None):
+    """Record that a device failed at `step` in the run summary. Returns None."""
+    summary['failed'] = summary.get('failed', 0) + 1
+    summary.setdefault('failed_devices', []).append(failure_entry(sn, step, error_class, error, device_type))
+    return None
+
+
+def sync_device(sn, snipe, mosyle, assignment_plan, summary):
+    """
+    Sync a single Mosyle device into Snipe-IT.
+
+    Looks up (or creates) the model and asset, updates the asset, queues any
+    user assignment change on assignment_plan and writes the Snipe-IT asset
+    tag back to Mosyle.
+
+    Args:
+        sn: Mosyle device
+        snipe: Snipe client
+        mosyle: Mosyle client
+        assignment_plan: AssignmentPlan collecting checkouts and check-ins
+        summary: Run summary, updated in place
+
+    Returns:
+        int: Number of changes made, or None if the device was not processed
+    """
+    logger = get_logger()
+    changes = 0
+
+    # Look up existing asset, from the run's asset cache when we already have it
+    asset = snipe.assets.as_response(sn['serial_number'])
+    if asset is None:
+        asset_response = snipe.listHardware(sn['serial_number'])
+        if asset_response is None:
+            logger.error(f"Failed to search asset {sn['serial_number']}: API request failed")
+            return record_failure(summary, sn, 'hardware lookup', 'RequestFailed', "API request failed")
+        if asset_response.status_code >= 400:
+            logger.error(f"Failed to search asset {sn['serial_number']}: HTTP {asset_response.status_code}")
+            return record_failure(summary, sn, 'hardware lookup', 'HTTPError', f"HTTP {asset_response.status_code}")
+        try:
+            asset = asset_response.json()
+        except (ValueError, TypeError) as e:
+            logger.error(f"Failed to parse asset response JSON for {sn['serial_number']}: {e}")
+            logger.error(f"Response status: {asset_response.status_code}, body: {asset_response.text}")
+            return record_failure(summary, sn, 'hardware lookup', type(e).__name__, str(e))
+        if asset is None:
+            logger.error(f"Asset response was null for {sn['serial_number']}")
+            return record_failure(summary, sn, 'hardware lookup', 'InvalidResponse', "null asset response")
+        if isinstance(asset, dict):
+            snipe.assets.store_rows(asset.get('rows'))
+
+    # Look up or create model
+    model_response = snipe.searchModel(sn['device_model'])
+    if model_response is None:
+        logger.error(f"Failed to search model for {sn['device_model']}: API request failed")
+        return record_failure(summary, sn, 'model search', 'RequestFailed', "API request failed")
+
+    try:
+        model = model_response.json()
+    except (ValueError, TypeError) as e:
+        logger.error(f"Failed to parse model response JSON for {sn['device_model']}: {e}")
+        logger.error(f"Response status: {model_response.status_code}, body: {model_response.text}")
+        return record_failure(summary, sn, 'model search', type(e).__name__, str(e))
+
+    if model['total'] == 0:
+        logger.info(f"Creating new model: {sn['device_model']}")
+        if sn['os'] == "mac":
+            create_response = snipe.createModel(sn['device_model'])
+        elif sn['os'] == "ios":
+            create_response = snipe.createMobileModel(sn['device_model'])
+        elif sn['os'] == "tvos":
+            create_response = snipe.createAppleTvModel(sn['device_model'])
+        else:
+            logger.error(f"Unknown OS type: {sn['os']}")
+            return record_failure(summary, sn, 'model create', 'UnsupportedDevice', f"unknown OS type {sn['os']}")
+
+        if create_response is None:
+            logger.error(f"Failed to create model for {sn['device_model']}: API request failed")
+            return record_failure(summary, sn, 'model create', 'RequestFailed', "API request failed")
+
+        try:
+            model_data = create_response.json()
+            model = model_data['payload']['id']
+        except (ValueError, TypeError, KeyError, AttributeError) as e:
+            logger.error(f"Failed to parse model creation response for {sn['device_model']}: {e}")
+            if hasattr(create_response, 'status_code'):
+                logger.error(f"Response status: {create_response.status_code}, body: {create_response.text}")
+            return record_failure(summary, sn, 'model create', type(e).__name__, str(e))
+    else:
+        model = model['rows'][0]['id']
+
+    # Check for assigned user
+    mosyle_user = sn.get('useremail') if sn.get('CurrentConsoleManagedUser') and 'useremail' in sn else None
+    devicePayload = snipe.buildPayloadFromMosyle(sn)
+
+    # Create asset if doesn't exist
+    if asset.get('total', 0) == 0:
+        logger.info(f"Creating new asset: {sn['serial_number']} ({sn['device_model']})")
+        create_asset_response = snipe.createAsset(model, devicePayload)
+        logger.debug(f"createAsset returned: {create_asset_response} (type: {type(create_asset_response)})")
+        if create_asset_response is None:
+            logger.error(f"Failed to create asset for {sn['serial_number']}: API request failed")
+            return record_failure(summary, sn, 'asset create', 'RequestFailed', "API request failed")
+        new_asset_id = create_asset_response.get('payload', {}).get('id') if isinstance(create_asset_response, dict) else None
+        # createAsset writes the new row into the asset cache, so downstream
+        # assignment and tag sync work from it without refetching
+        asset = snipe.assets.as_response(sn['serial_number']) if new_asset_id else None
+        if asset is None:
+            logger.error(f"Failed to extract asset ID from creation response for {sn['serial_number']}")
+            record_failure(summary, sn, 'asset create', 'InvalidResponse', "no asset id in create response")
+            return changes
+        created = True
+        summary['created'] += 1
+        changes += 1
+    else:
+        created = False
+
+    # Safety check before accessing asset structure
+    if not isinstance(asset, dict):
+        logger.error(f"Asset is not a dict for {sn['serial_number']}: {type(asset)}")
+        return record_failure(summary, sn, 'asset update', 'InvalidResponse', f"asset is a {type(asset).__name__}")
+
+    # Update existing asset (a freshly created one already has this payload).
+    # updateAsset merges the PATCH response into the cached row.
+    if not created and asset.get('total') == 1 and asset.get('rows'):
+        logger.info(f"Updating asset: {sn['serial_number']}")
+        snipe.updateAsset(asset['rows'][0]['id'], devicePayload, model)
+        asset = snipe.assets.as_response(sn['serial_number']) or asset
+
+    # Queue user assignment changes for the assignment phase
+    queued_before = len(assignment_plan)
+    if mosyle_user:
+        if not asset.get('rows'):
+            logger.error(f"Asset has no rows for {sn['serial_number']}, cannot sync user assignment")
+            record_failure(summary, sn, 'assignment', 'InvalidResponse', "asset has no rows")
+            return changes
+        asset_id = asset['rows'][0]['id']
+        assigned = asset['rows'][0]['assigned_to']
+        if assigned is None and sn.get('useremail'):
+            logger.info(f"Queueing assignment of asset {asset_id} to user: {sn['useremail']}")
+            assignment_plan.checkout(asset_id, sn['serial_number'], sn['useremail'])
+        elif sn.get('useremail') is None:
+            logger.info(f"Queueing unassignment of asset: {asset_id}")
+            assignment_plan.checkin(asset_id, sn['serial_number'])
+        elif assigned and assigned['username'] != sn['useremail']:
+            logger.info(f"Queueing reassignment of asset {asset_id} from {assigned['username']} to {sn['useremail']}")
+            assignment_plan.reassign(asset_id, sn['serial_number'], sn['useremail'])
+    if len(assignment_plan) != queued_before:
+        summary['assignment_changes'] += 1
+        changes += 1
+
+    # Sync asset tag back to Mosyle
+    asset_tag = asset['rows'][0].get('asset_tag') if asset.get('rows') else None
+    if not sn.get('asset_tag') or sn['asset_tag'] != asset_tag:
+        if asset_tag:
+            logger.info(f"Syncing asset tag to Mosyle: {sn['serial_number']} -> {asset_tag}")
+            mosyle.setAssetTag(sn['serial_number'], asset_tag)
+            summary['tags_synced'] += 1
+            changes += 1
+
+    return changes
+
+
+def wait_for_breaker(error, summary, max_pause):
+    """
+    Sleep until an open circuit breaker allows a probe, if the run's pause
+    budget allows it. Returns False when the run should be aborted instead.
+    """
+    logger = get_logger()
+    # At least a second, in case another thread's probe is in flight
+    wait = max(1.0, error.breaker.retry_after())
+    if summary.get('paused_seconds', 0) + wait > max_pause:
+        return False
+    logger.warning(f"{error}. Pausing the run for {wait:.0f} seconds")
+    time.sleep(wait)
+    summary['paused_seconds'] = summary.get('paused_seconds', 0) + round(wait)
+    return True
+
+
+def sync_devices(devices, deviceType, snipe, mosyle, assignment_plan, summary, show_progress=True, max_pause=0):
+    """
+    Sync a list of Mosyle devices of one type, with a progress bar unless
+    show_progress is False (only one progress bar can be live at a time).
+
+    When an upstream's circuit breaker opens, the run pauses until the
+    breaker lets a probe through, for at most max_pause seconds in total,
+    and is then aborted: the remaining devices are counted as skipped and
+    summary['aborted'] says why.
+
+    Returns:
+        tuple: (devices processed, changes made)
+    """
+    logger = get_logger()
+    status = get_status()
+    status.add_planned(len(devices))
+    processed = 0
+    type_changes = 0
+
+    with Progress(disable=not show_progress) as progress:
+        task = progress.add_task(f"[green]Processing {deviceType} devices...", total=len(devices))
+
+        for device_index, sn in enumerate(devices, 1):
+            try:
+                if sn['serial_number'] is None:
+                    logger.warning(f"{deviceType} device at index {device_index} has no serial number, skipping")
+                    continue
+
+                while True:
+                    try:
+                        changes = sync_device(sn, snipe, mosyle, assignment_plan, summary)
+                        break
+                    except CircuitOpenError as e:
+                        if not wait_for_breaker(e, summary, max_pause):
+                            raise
+                if changes is not None:
+                    processed += 1
+                    type_changes += changes
+
+            except CircuitOpenError as e:
+                skipped = len(devices) - device_index + 1
+                summary['skipped'] = summary.get('skipped', 0) + skipped
+                summary['aborted'] = str(e)
+                # Queued so a retry can pick them up without a full run
+                summary.setdefault('failed_devices', []).extend(
+                    failure_entry(device, SKIPPED_STEP, type(e).__name__, str(e), deviceType)
+                    for device in devices[device_index - 1:] if device['serial_number']
+                )
+                logger.error(f"Aborting {deviceType} devices: {e}. {skipped} devices not processed")
+                break
+            except Exception as e:
+                logger.error(f"Error processing device {sn.get('serial_number', 'unknown')}: {e}")
+                if sn.get('serial_number'):
+                    record_failure(summary, sn, 'sync', type(e).__name__, str(e))
+                continue
+            finally:
+                progress.advance(task)
+                status.advance()
+
+    return processed, type_changes
+
+
+def apply_assignments(config, snipe, assignment_plan):
+    """Apply user assignment changes collected during a run."""
+    logger = get_logger()
+    try:
+        return assignment_plan.apply(
+            snipe,
+            workers=config['snipe']['assignment_workers'],
+            bulk=config['snipe']['bulk_checkout']
+        )
+    except Exception as e:
+        logger.error(f"Error applying user assignments: {e}")
+        return None
+
+
+def finish_assignments(config, snipe, assignment_plan, summary, device_types=None, label=""):
+    """
+    Apply a tenant run's assignment changes and add the devices whose change
+    failed to summary['failed_devices'], so the retry queue picks them up.
+    While Snipe-IT is down nothing is sent and every pending device is queued.
+
+    Args:
+        device_types: Device type by serial number, for routing retries
+    """
+    logger = get_logger()
+    device_types = device_types or {}
+    if snipe.breaker.is_open:
+        if len(assignment_plan):
+            logger.warning(f"{label}Snipe-IT is unavailable, leaving {len(assignment_plan)} assignment changes for a retry")
+        failures = [(serial, 'assignment', 'CircuitOpenError', "Snipe-IT unavailable")
+                    for serial in sorted(assignment_plan.serials())]
+    else:
+        result = apply_assignments(config, snipe, assignment_plan)
+        failures = result['failures'] if result else []
+    for serial, step, error_class, error in failures:
+        record_failure(summary, {'serial_number': serial}, step, error_class, error, device_types.get(serial))
+
+
+def run_tenants(config, run, device_types=None):
+    """
+    Call run(tenant_config, tenant_device_types) for every tenant, several at
+    a time. Each tenant gets its own clients (and so its own Snipe-IT rate
+    limiter); the AppleDB index and image cache are shared by the process.
+
+    Returns:
+        list: (tenant name, result) for every tenant that did not fail
+    """
+    logger = get_logger()
+    tenants = config.get('tenants') or [{'name': 'default', 'mosyle': config['mosyle'], 'snipe': config['snipe']}]
+
+    jobs = []
+    for tenant in tenants:
+        tenant_types = [t.strip() for t in tenant['mosyle']['deviceTypes']]
+        if device_types is not None:
+            tenant_types = [t for t in device_types if t in tenant_types]
+            if not tenant_types:
+                continue
+        jobs.append((tenant, tenant_types))
+
+    if len(tenants) == 1:
+        return [(tenant['name'], run(tenant_config(config, tenant), tenant_types)) for tenant, tenant_types in jobs]
+
+    results = []
+    with ThreadPoolExecutor(max_workers=min(len(jobs) or 1, config.get('tenant_workers', 4))) as executor:
+        futures = {
+            executor.submit(run, dict(tenant_config(config, tenant), show_progress=False), tenant_types): tenant['name']
+            for tenant, tenant_types in jobs
+        }
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                results.append((name, future.result()))
+            except Exception as e:
+                logger.error(f"Tenant {name} failed: {e}")
+    return results
+
+
+def merge_tenant_summaries(results):
+    """Merge per-tenant run summaries, keeping the change count of each tenant."""
+    merged = merge_summaries(summary for _, summary in results)
+    merged.setdefault('changes_by_type', {})
+    aborted = [f"{name}: {summary['aborted']}" for name, summary in results if summary and summary.get('aborted')]
+    if aborted:
+        merged['aborted'] = '; '.join(aborted)
+    if len(results) > 1:
+        merged['changes_by_tenant'] = {
+            name: sum(summary.get('changes_by_type', {}).values()) for name, summary in results if summary
+        }
+    return merged
+
+
+def run_sync(config, device_types=None, shard=None):
+    """
+    Execute a single synchronization run across all configured tenants.
+
+    Args:
+        config: Configuration dictionary from load_configuration()
+        device_types: Device types to sync (default: all configured deviceTypes)
+        shard: Optional (index, count); only serials that hash to this shard are synced
+
+    Returns:
+        dict: Run summary with the number of devices processed, assets
+        created, assignment changes queued and asset tags synced, plus the
+        number of changes seen per device type (and per tenant, if there are
+        several)
+    """
+    logger = get_logger()
+    snapshot_path = config.get('snapshot_path')
+    if snapshot_path:
+        config = dict(config, snapshot=SnapshotCollector())
+
+    results = run_tenants(config, lambda cfg, types: run_tenant_sync(cfg, types, shard), device_types)
+
+    if snapshot_path:
+        write_run_snapshot(config['snapshot'], snapshot_path)
+
+    if not results:
+        return new_summary()
+    if len(results) == 1 and len(config.get('tenants') or ()) <= 1:
+        return results[0][1]
+
+    summary = merge_tenant_summaries(results)
+    logger.info(f"=== {len(results)} tenants synchronized. Total devices processed: {summary.get('processed', 0)} ===")
+    for name, changes in sorted(summary.get('changes_by_tenant', {}).items()):
+        logger.info(f"  {name}: {changes} changes")
+    return summary
+
+
+def write_run_snapshot(collector, path):
+    """Write a run's fleet snapshot, keeping rows for device types the run skipped."""
+    logger = get_logger()
+    try:
+        carried = collector.carry_over(path)
+        write_snapshot(path, collector.rows)
+        logger.info(f"Fleet snapshot written to {path}: {len(collector)} devices"
+                    + (f" ({carried} carried over from the previous snapshot)" if carried else ""))
+    except OSError as e:
+        logger.error(f"Failed to write fleet snapshot {path}: {e}")
+
+
+def run_tenant_sync(config, device_types=None, shard=None):
+    """
+    Execute a single synchronization run for one tenant.
+
+    Args:
+        config: Tenant configuration from tenant_config()
+        device_types: Device types to sync (default: the tenant's deviceTypes)
+        shard: Optional (index, count); only serials that hash to this shard are synced
+
+    Returns:
+        dict: Run summary, as for run_sync()
+    """
+    logger = get_logger()
+    label = f"[{config['tenant']}] " if len(config.get('tenants') or ()) > 1 else ""
+    snapshot = config.get('snapshot')
+    tenant = config.get('tenant') or 'default'
+    status = get_status()
+    synced_devices = []
+
+    logger.info(f"=== {label}Starting synchronization run ===")
+
+    mosyle, snipe = connect_clients(config)
+
     total_devices_processed = 0
     ts = datetime.datetime.now().timestamp() - 200
+    assignment_plan = AssignmentPlan()
+    summary = new_summary()
+    max_pause = config.get('breaker', {}).get('max_pause', 0)
+    # Serial number -> device type of every device this run tried to sync
+    attempted = {}
 
-    for deviceType in config['mosyle']['deviceTypes']:
+    for deviceType in device_types or config['mosyle']['deviceTypes']:
         deviceType = deviceType.strip()
-        logger.info(f"Processing device type: {deviceType}")
+        if summary.get('aborted'):
+            logger.warning(f"{label}Skipping device type {deviceType}: run aborted")
+            continue
+        logger.info(f"{label}Processing device type: {deviceType}")
+        status.set_phase('mosyle fetch', tenant, deviceType)
 
         try:
             # Fetch devices from Mosyle
@@ -154,16 +733,7 @@ def run_sync(config):
                 mosyle_response = mosyle.listTimestamp(ts, ts, deviceType)
             else:
                 logger.debug(f"Using 'all' mode for {deviceType} (paginated)")
-                all_devices = []
-                page = 1
-                while True:
-                    response = mosyle.list(deviceType, page=page)
-                    devices = response.get('response', {}).get('devices', [])
-                    if not devices:
-                        break
-                    all_devices.extend(devices)
-                    logger.debug(f"Retrieved {len(devices)} devices from page {page}")
-                    page += 1
+                all_devices = list(mosyle.iterDevices(deviceType))
                 mosyle_response = {"status": "OK", "response": {"devices": all_devices}}
 
             if mosyle_response.get('status') != "OK":
@@ -171,197 +741,498 @@ def run_sync(config):
                 continue
 
             devices = mosyle_response['response'].get('devices', [])
+            if shard is not None:
+                shard_index, shard_count = shard
+                devices = [d for d in devices if shard_for(d.get('serial_number'), shard_count) == shard_index]
             device_count = len(devices)
-            logger.info(f"Found {device_count} {deviceType} devices in Mosyle")
+            logger.info(f"{label}Found {device_count} {deviceType} devices in Mosyle"
+                        + (f" for shard {shard[0]}/{shard[1]}" if shard is not None else ""))
+
+            if config['snipe'].get('async_lookups'):
+                status.set_phase('asset prefetch', tenant, deviceType)
+                prefetch_assets(config, snipe, devices, label)
 
             # Process each device
-            with Progress() as progress:
-                task = progress.add_task(f"[green]Processing {deviceType} devices...", total=device_count)
+            status.set_phase('devices', tenant, deviceType)
+            attempted.update((device['serial_number'], deviceType) for device in devices if device['serial_number'])
+            processed, type_changes = sync_devices(devices, deviceType, snipe, mosyle, assignment_plan, summary,
+                                                   show_progress=config.get('show_progress', True),
+                                                   max_pause=max_pause)
+            total_devices_processed += processed
+            # A type cut short by an outage keeps its previous snapshot rows
+            if snapshot is not None and not summary.get('aborted'):
+                synced_devices.append((deviceType, devices))
 
-                for device_index, sn in enumerate(devices, 1):
-                    try:
-                        if sn['serial_number'] is None:
-                            logger.warning(f"{deviceType} device at index {device_index} has no serial number, skipping")
-                            progress.advance(task)
-                            continue
-
-                        # Look up existing asset
-                        asset_response = snipe.listHardware(sn['serial_number'])
-                        if asset_response is None:
-                            logger.error(f"Failed to search asset {sn['serial_number']}: API request failed")
-                            progress.advance(task)
-                            continue
-                        if asset_response.status_code >= 400:
-                            logger.error(f"Failed to search asset {sn['serial_number']}: HTTP {asset_response.status_code}")
-                            progress.advance(task)
-                            continue
-                        try:
-                            asset = asset_response.json()
-                        except (ValueError, TypeError) as e:
-                            logger.error(f"Failed to parse asset response JSON for {sn['serial_number']}: {e}")
-                            logger.error(f"Response status: {asset_response.status_code}, body: {asset_response.text}")
-                            progress.advance(task)
-                            continue
-                        if asset is None:
-                            logger.error(f"Asset response was null for {sn['serial_number']}")
-                            progress.advance(task)
-                            continue
-
-                        # Look up or create model
-                        model_response = snipe.searchModel(sn['device_model'])
-                        if model_response is None:
-                            logger.error(f"Failed to search model for {sn['device_model']}: API request failed")
-                            progress.advance(task)
-                            continue
+            summary['changes_by_type'][deviceType] = type_changes
+            logger.info(f"{label}Finished {deviceType}: {total_devices_processed} total devices processed, {type_changes} changes")
 
-                        try:
-                            model = model_response.json()
-                        except (ValueError, TypeError) as e:
-                            logger.error(f"Failed to parse model response JSON for {sn['device_model']}: {e}")
-                            logger.error(f"Response status: {model_response.status_code}, body: {model_response.text}")
-                            progress.advance(task)
-                            continue
-
-                        if model['total'] == 0:
-                            logger.info(f"Creating new model: {sn['device_model']}")
-                            if sn['os'] == "mac":
-                                create_response = snipe.createModel(sn['device_model'])
-                            elif sn['os'] == "ios":
-                                create_response = snipe.createMobileModel(sn['device_model'])
-                            elif sn['os'] == "tvos":
-                                create_response = snipe.createAppleTvModel(sn['device_model'])
-                            else:
-                                logger.error(f"Unknown OS type: {sn['os']}")
-                                progress.advance(task)
-                                continue
-
-                            if create_response is None:
-                                logger.error(f"Failed to create model for {sn['device_model']}: API request failed")
-                                progress.advance(task)
-                                continue
+        except CircuitOpenError as e:
+            summary['aborted'] = str(e)
+            logger.error(f"{label}Aborting run while fetching {deviceType} devices: {e}")
+        except Exception as e:
+            logger.error(f"{label}Error processing device type {deviceType}: {e}")
+            summary['device_types_failed'] += 1
+            continue
 
-                            try:
-                                model_data = create_response.json()
-                                model = model_data['payload']['id']
-                            except (ValueError, TypeError, KeyError, AttributeError) as e:
-                                logger.error(f"Failed to parse model creation response for {sn['device_model']}: {e}")
-                                if hasattr(create_response, 'status_code'):
-                                    logger.error(f"Response status: {create_response.status_code}, body: {create_response.text}")
-                                progress.advance(task)
-                                continue
-                        else:
-                            model = model['rows'][0]['id']
-
-                        # Check for assigned user
-                        mosyle_user = sn.get('useremail') if sn.get('CurrentConsoleManagedUser') and 'useremail' in sn else None
-                        devicePayload = snipe.buildPayloadFromMosyle(sn)
-
-                        # Create asset if doesn't exist
-                        if asset.get('total', 0) == 0:
-                            logger.info(f"Creating new asset: {sn['serial_number']} ({sn['device_model']})")
-                            create_asset_response = snipe.createAsset(model, devicePayload)
-                            logger.debug(f"createAsset returned: {create_asset_response} (type: {type(create_asset_response)})")
-                            if create_asset_response is None:
-                                logger.error(f"Failed to create asset for {sn['serial_number']}: API request failed")
-                                progress.advance(task)
-                                continue
-                            asset = create_asset_response
-                            logger.debug(f"asset type: {type(asset)}, value: {asset}")
-                            new_asset_id = asset.get('payload', {}).get('id') if isinstance(asset, dict) else None
-                            if new_asset_id:
-                                # Assign user to newly created asset
-                                if mosyle_user:
-                                    logger.info(f"Assigning asset to user: {mosyle_user}")
-                                    snipe.assignAsset(mosyle_user, new_asset_id)
-
-                                # Refetch the asset to get consistent response structure for downstream code
-                                logger.debug(f"Refetching newly created asset {sn['serial_number']} for consistent structure")
-                                asset_refetch = snipe.listHardware(sn['serial_number'])
-                                if asset_refetch is None:
-                                    logger.error(f"Failed to refetch asset {sn['serial_number']} after creation")
-                                    total_devices_processed += 1
-                                    progress.advance(task)
-                                    continue
-                                try:
-                                    refetch_data = asset_refetch.json()
-                                    if refetch_data and isinstance(refetch_data, dict):
-                                        asset = refetch_data
-                                    else:
-                                        logger.error(f"Refetch returned invalid data for {sn['serial_number']}: {refetch_data}")
-                                        total_devices_processed += 1
-                                        progress.advance(task)
-                                        continue
-                                except (ValueError, TypeError, AttributeError) as e:
-                                    logger.error(f"Failed to parse refetched asset JSON for {sn['serial_number']}: {e}")
-                                    total_devices_processed += 1
-                                    progress.advance(task)
-                                    continue
-                            else:
-                                logger.error(f"Failed to extract asset ID from creation response for {sn['serial_number']}")
-                                total_devices_processed += 1
-                                progress.advance(task)
-                                continue
-
-                            # Continue to sync user assignment and asset tag with refetched asset
-                            # (don't use the old continue statement)
-
-                        # Safety check before accessing asset structure
-                        if not isinstance(asset, dict):
-                            logger.error(f"Asset is not a dict for {sn['serial_number']}: {type(asset)}")
-                            progress.advance(task)
-                            continue
-
-                        # Update existing asset
-                        if asset.get('total') == 1 and asset.get('rows'):
-                            logger.info(f"Updating asset: {sn['serial_number']}")
-                            snipe.updateAsset(asset['rows'][0]['id'], devicePayload, model)
-
-                        # Sync user assignment
-                        if mosyle_user:
-                            if not asset.get('rows'):
-                                logger.error(f"Asset has no rows for {sn['serial_number']}, cannot sync user assignment")
-                                total_devices_processed += 1
-                                progress.advance(task)
-                                continue
-                            assigned = asset['rows'][0]['assigned_to']
-                            if assigned is None and sn.get('useremail'):
-                                logger.info(f"Assigning asset to user: {sn['useremail']}")
-                                snipe.assignAsset(sn['useremail'], asset['rows'][0]['id'])
-                            elif sn.get('useremail') is None:
-                                logger.info(f"Unassigning asset: {asset['rows'][0]['id']}")
-                                snipe.unasigneAsset(asset['rows'][0]['id'])
-                            elif assigned and assigned['username'] != sn['useremail']:
-                                logger.info(f"Reassigning asset from {assigned['username']} to {sn['useremail']}")
-                                snipe.unasigneAsset(asset['rows'][0]['id'])
-                                snipe.assignAsset(sn['useremail'], asset['rows'][0]['id'])
-
-                        # Sync asset tag back to Mosyle
-                        asset_tag = asset['rows'][0].get('asset_tag') if asset.get('rows') else None
-                        if not sn.get('asset_tag') or sn['asset_tag'] != asset_tag:
-                            if asset_tag:
-                                logger.info(f"Syncing asset tag to Mosyle: {sn['serial_number']} -> {asset_tag}")
-                                mosyle.setAssetTag(sn['serial_number'], asset_tag)
-
-                        total_devices_processed += 1
-                        progress.advance(task)
+    # Apply user assignment changes collected across all device types. While
+    # Snipe-IT is down they are queued for a retry
+    status.set_phase('assignments', tenant)
+    finish_assignments(config, snipe, assignment_plan, summary, attempted, label)
 
-                    except Exception as e:
-                        logger.error(f"Error processing device {sn.get('serial_number', 'unknown')}: {e}")
-                        progress.advance(task)
-                        continue
+    # Join the devices with their assets after assignments, so the snapshot
+    # shows where every asset ended up
+    for deviceType, devices in synced_devices:
+        snapshot.add_devices(tenant, deviceType, devices, snipe.assets)
+
+    summary['processed'] = total_devices_processed
+    update_retry_queue(config, attempted, summary)
+    if summary.get('aborted'):
+        log_aborted_run(label, summary)
+    elif summary['device_types_failed']:
+        logger.error(f"=== {label}Synchronization run incomplete: {summary['device_types_failed']} device types failed. "
+                     f"Total devices processed: {total_devices_processed} ===")
+    else:
+        logger.info(f"=== {label}Synchronization run complete. Total devices processed: {total_devices_processed} ===")
+    return summary
 
-            logger.info(f"Finished {deviceType}: {total_devices_processed} total devices processed")
 
+def prefetch_assets(config, snipe, devices, label=""):
+    """
+    Look up the devices' assets concurrently with the asyncio client before
+    they are synced, when httpx is installed. Lookups that fail here are
+    simply made again by sync_device().
+    """
+    logger = get_logger()
+    if not asyncclients.available():
+        logger.warning("async_lookups is enabled but httpx is not installed, looking up assets one at a time")
+        return
+    started = time.monotonic()
+    try:
+        failed = asyncclients.prefetch_hardware(
+            snipe,
+            [device['serial_number'] for device in devices if device['serial_number']],
+            concurrency=config['snipe'].get('async_concurrency', 50),
+            http2=config['snipe'].get('http2', False)
+        )
+    except CircuitOpenError:
+        raise
+    except Exception as e:
+        logger.error(f"{label}Concurrent asset lookup failed: {e}")
+        return
+    logger.info(f"{label}Looked up {len(devices)} assets in {time.monotonic() - started:.1f} seconds"
+                + (f", {len(failed)} failed" if failed else ""))
+
+
+def retry_queue(config):
+    """The retry queue under the state directory, or None if it is disabled."""
+    settings = config.get('retry') or {}
+    if not config.get('state_dir') or not settings.get('enabled', True):
+        return None
+    return RetryQueue(
+        config['state_dir'],
+        max_attempts=settings.get('max_attempts', 8),
+        base_delay=settings.get('base_delay', 300),
+        max_delay=settings.get('max_delay', 6 * 3600)
+    )
+
+
+def update_retry_queue(config, attempted, summary, resolved=()):
+    """Queue a tenant run's failed devices and drop the queued ones that now synced."""
+    logger = get_logger()
+    queue = retry_queue(config)
+    if queue is None:
+        return
+    failures = summary.get('failed_devices', [])
+    failed = {failure['serial'] for failure in failures}
+    try:
+        queued, recovered = queue.update(config.get('tenant') or 'default', failures,
+                                         (set(attempted) - failed) | set(resolved))
+    except OSError as e:
+        logger.error(f"Failed to update retry queue {queue.path}: {e}")
+        return
+    if queued or recovered:
+        logger.info(f"Retry queue: {queued} failed devices queued, {recovered} recovered")
+
+
+def run_retry(config, ignore_backoff=False, shard=None):
+    """
+    Retry only the devices in the retry queue that are due.
+
+    Args:
+        shard: (index, count) to retry only this shard's serials, as a
+            --shard process shares the queue with the other shards
+
+    Returns:
+        dict: Run summary, or None if nothing was due
+    """
+    logger = get_logger()
+    queue = retry_queue(config)
+    if queue is None:
+        return None
+
+    due = queue.due(ignore_backoff=ignore_backoff)
+    if shard is not None:
+        shard_index, shard_count = shard
+        due = {
+            name: {device_type: {serial for serial in serials if shard_for(serial, shard_count) == shard_index}
+                   for device_type, serials in by_type.items()}
+            for name, by_type in due.items()
+        }
+        due = {name: {device_type: serials for device_type, serials in by_type.items() if serials}
+               for name, by_type in due.items() if any(by_type.values())}
+    tenants = [tenant for tenant in config['tenants'] if tenant['name'] in due]
+    for name in set(due) - {tenant['name'] for tenant in tenants}:
+        logger.warning(f"Retry queue has devices for tenant {name}, which is no longer configured")
+    total = sum(len(serials) for tenant in tenants for serials in due[tenant['name']].values())
+    if not total:
+        logger.info("Retry queue: no devices due for a retry")
+        return None
+
+    logger.info(f"=== Retrying {total} devices from the retry queue ===")
+    results = run_tenants(dict(config, tenants=tenants),
+                          lambda cfg, types: run_tenant_device_sync(cfg, due[cfg['tenant']]))
+    summary = merge_tenant_summaries([(name, tenant_summary) for name, (tenant_summary, _) in results])
+
+    exhausted = queue.exhausted()
+    logger.info(f"=== Retry complete. Devices processed: {summary.get('processed', 0)}, "
+                f"failed again: {summary.get('failed', 0) + summary.get('skipped', 0)}, "
+                f"given up after {queue.max_attempts} attempts: {len(exhausted)} ===")
+    return summary
+
+
+def run_onboard(config, device_types=None, chunk_size=DEFAULT_CHUNK_SIZE, csv_dir=None, dry_run=False):
+    """
+    Onboard every tenant's devices that are not in Snipe-IT yet through the
+    Snipe-IT CSV importer, see onboarding.bulk_onboard().
+
+    Returns:
+        dict: Run summary, as for run_sync()
+    """
+    logger = get_logger()
+    results = run_tenants(config, lambda cfg, types: run_tenant_onboard(cfg, types, chunk_size, csv_dir, dry_run),
+                          device_types)
+    summary = merge_tenant_summaries(results)
+    logger.info(f"=== Bulk onboarding {'dry run ' if dry_run else ''}complete. Assets created: {summary.get('created', 0)}, "
+                f"tags synced: {summary.get('tags_synced', 0)}, failed: {summary.get('failed', 0)} ===")
+    return summary
+
+
+def run_tenant_onboard(config, device_types, chunk_size=DEFAULT_CHUNK_SIZE, csv_dir=None, dry_run=False):
+    """
+    Bulk onboard one tenant. Devices the import did not create are queued
+    in the retry queue, so they go through the normal per-device sync.
+
+    Returns:
+        dict: Run summary, as for run_sync()
+    """
+    logger = get_logger()
+    tenant = config.get('tenant') or 'default'
+    label = f"[{tenant}] " if len(config.get('tenants') or ()) > 1 else ""
+    logger.info(f"=== {label}Starting bulk onboarding ===")
+
+    mosyle, snipe = connect_clients(config)
+    assignment_plan = AssignmentPlan()
+    summary = new_summary()
+
+    # Device type each serial was listed under, for routing retries
+    types_by_serial = {}
+    try:
+        devices = []
+        for deviceType in device_types or config['mosyle']['deviceTypes']:
+            deviceType = deviceType.strip()
+            for device in mosyle.iterDevices(deviceType):
+                devices.append(device)
+                types_by_serial[device['serial_number']] = deviceType
+        result = bulk_onboard(devices, snipe, mosyle, assignment_plan, chunk_size=chunk_size,
+                              csv_dir=csv_dir, csv_prefix=f"onboard-{tenant}", dry_run=dry_run)
+    except CircuitOpenError as e:
+        summary['aborted'] = str(e)
+        log_aborted_run(label, summary)
+        return summary
+    except Exception as e:
+        # Listing devices, reading Snipe-IT's assets or the importer's names failed
+        logger.error(f"{label}Bulk onboarding failed: {e}")
+        summary['aborted'] = str(e)
+        log_aborted_run(label, summary)
+        return summary
+
+    for device, step, error_class, error in result['failures']:
+        record_failure(summary, device, step, error_class, error, types_by_serial.get(device['serial_number']))
+    summary['processed'] = len(result['onboarded'])
+    summary['created'] = result['imported']
+    summary['tags_synced'] = result['tags_synced']
+    summary['assignment_changes'] = result['assignment_changes']
+    summary['changes_by_type']['onboard'] = result['imported']
+    if dry_run:
+        return summary
+
+    finish_assignments(config, snipe, assignment_plan, summary, types_by_serial, label)
+    update_retry_queue(config, result['onboarded'], summary)
+    logger.info(f"=== {label}Bulk onboarding complete: {result['imported']} assets created, "
+                f"{result['existing']} already in Snipe-IT, {summary['failed']} failed ===")
+    return summary
+
+
+def log_aborted_run(label, summary):
+    """Log why a run stopped early, what it got done and the state of every breaker."""
+    logger = get_logger()
+    logger.error(
+        f"=== {label}Synchronization run aborted: {summary['aborted']}. "
+        f"{summary.get('processed', 0)} devices processed, {summary.get('skipped', 0)} skipped, "
+        f"paused for {summary.get('paused_seconds', 0)} seconds ==="
+    )
+    for name, breaker in sorted(all_breakers().items()):
+        status = breaker.status()
+        logger.error(f"  {name}: {status['state']}, opened {status['times_opened']} times, "
+                     f"{status['rejected']} calls refused, last error: {status['last_error'] or 'none'}")
+
+
+def run_device_sync(config, serials_by_type):
+    """
+    Sync only the given serial numbers, e.g. in response to webhook events.
+    Events do not say which tenant a device belongs to, so every tenant is
+    asked for the serials and syncs the ones it has.
+
+    Args:
+        config: Configuration dictionary from load_configuration()
+        serials_by_type: {device type or None: set of serials}. Serials
+            under None are looked up in every configured device type.
+
+    Returns:
+        dict: Run summary, as for run_sync()
+    """
+    logger = get_logger()
+    total = sum(len(serials) for serials in serials_by_type.values())
+    logger.info(f"=== Starting event sync for {total} devices ===")
+
+    results = run_tenants(config, lambda cfg, types: run_tenant_device_sync(cfg, serials_by_type))
+    missing = set().union(*serials_by_type.values()) if serials_by_type else set()
+    for _, (_, tenant_missing) in results:
+        missing &= tenant_missing
+    if missing:
+        logger.warning(f"{len(missing)} serials from events were not found in Mosyle: {', '.join(sorted(missing))}")
+
+    summary = merge_tenant_summaries([(name, tenant_summary) for name, (tenant_summary, _) in results])
+    logger.info(f"=== Event sync complete. Devices processed: {summary.get('processed', 0)} ===")
+    return summary
+
+
+def run_tenant_device_sync(config, serials_by_type):
+    """
+    Sync the given serial numbers that exist in one tenant.
+
+    Returns:
+        tuple: (run summary, set of serials not found in this tenant)
+    """
+    logger = get_logger()
+    mosyle, snipe = connect_clients(config)
+    assignment_plan = AssignmentPlan()
+    summary = new_summary()
+    configured_types = [t.strip() for t in config['mosyle']['deviceTypes']]
+    untyped = set(serials_by_type.get(None, ()))
+    missing = set().union(*serials_by_type.values()) if serials_by_type else set()
+    # Serial number -> device type of every device this run tried to sync
+    attempted = {}
+    lookup_failed = False
+
+    for deviceType in configured_types:
+        serials = set(serials_by_type.get(deviceType, ())) | untyped
+        if not serials:
+            continue
+        try:
+            response = mosyle.listBySerial(deviceType, sorted(serials))
+            if response.get('status') != "OK":
+                logger.error(f"Mosyle API error for {deviceType}: {response.get('message')}")
+                lookup_failed = True
+                continue
+            devices = [
+                MosyleDevice.from_json(device) for device in response.get('response', {}).get('devices', [])
+                if device.get('serial_number') in serials
+            ]
+            if not devices:
+                continue
+            found = {device['serial_number'] for device in devices}
+            untyped -= found
+            missing -= found
+            attempted.update(dict.fromkeys(found, deviceType))
+            processed, type_changes = sync_devices(devices, deviceType, snipe, mosyle, assignment_plan, summary,
+                                                   show_progress=config.get('show_progress', True),
+                                                   max_pause=config.get('breaker', {}).get('max_pause', 0))
+            summary['processed'] += processed
+            summary['changes_by_type'][deviceType] = type_changes
         except Exception as e:
-            logger.error(f"Error processing device type {deviceType}: {e}")
+            logger.error(f"Error processing {deviceType} event devices: {e}")
+            lookup_failed = True
             continue
 
-    logger.info(f"=== Synchronization run complete. Total devices processed: {total_devices_processed} ===")
-    return total_devices_processed
+    finish_assignments(config, snipe, assignment_plan, summary, attempted)
+    # Serials Mosyle reliably did not return no longer need retrying
+    update_retry_queue(config, attempted, summary, resolved=() if lookup_failed else missing)
+    return summary, missing
+
+
+def run_shard(config, index, count, state_dir, device_types=None, same_host=False):
+    """
+    Run one shard of a sharded sync under its lease.
+
+    The shared rate budget (shared_rate_limit) only counts the processes
+    that use one state directory, so the shards draw from it only when they
+    all do: same_host (the workers of run_sharded) or state_dir_shared set
+    for a state directory every host mounts. Otherwise the shard gets an
+    equal fixed share of the Snipe-IT rate limit. It writes its summary to
+    the state directory for shard-report.
+
+    Returns:
+        dict: Run summary, or None if another worker holds the shard
+    """
+    logger = get_logger()
+    lease = ShardLease(state_dir, index, count)
+    if not lease.acquire():
+        logger.warning(f"Shard {index}/{count} is already being processed by {lease.holder()}, skipping")
+        return None
+
+    shared_budget = bool(config.get('state_dir')) and (same_host or config.get('state_dir_shared'))
+
+    def shard_tenant(tenant):
+        # Split the tenant's Snipe-IT budget between the shards, unless the
+        # shared limiter already divides it between them as they run
+        if shared_budget and tenant['snipe'].get('shared_rate_limit'):
+            return tenant
+        return dict(tenant, snipe=dict(tenant['snipe'], shared_rate_limit=False,
+                                       rate_limit=max(1, tenant['snipe']['rate_limit'] // count)))
+
+    with lease:
+        shard_config = dict(config, tenants=[
+            shard_tenant(tenant)
+            for tenant in config.get('tenants') or [{'name': 'default', 'mosyle': config['mosyle'], 'snipe': config['snipe']}]
+        ])
+        shard_config['snipe'] = shard_config['tenants'][0]['snipe']
+        if config.get('snapshot_path'):
+            shard_config['snapshot_path'] = shard_snapshot_path(config['snapshot_path'], index, count)
+        logger.info(f"Shard {index}/{count}: rate limit {shard_config['snipe']['rate_limit']} requests/minute"
+                    + (" shared by all shards" if shard_config['snipe'].get('shared_rate_limit') else "")
+                    + (" per tenant" if len(shard_config['tenants']) > 1 else ""))
+        summary = run_sync(shard_config, device_types, shard=(index, count))
+        write_shard_summary(state_dir, index, count, summary)
+        return summary
+
+
+def shard_snapshot_path(path, index, count):
+    """fleet.jsonl.gz -> fleet.shard-0-of-4.jsonl.gz"""
+    path = Path(path)
+    stem, dot, suffixes = path.name.partition('.')
+    return str(path.with_name(f"{stem}.{shard_name(index, count)}{dot}{suffixes}"))
+
+
+def run_sharded(config, count, state_dir, device_types=None, log_dir='logs', log_level='INFO'):
+    """
+    Run every shard in its own worker process and merge the results.
+
+    Returns:
+        dict: Merged run summary across shards that ran
+    """
+    logger = get_logger()
+    logger.info(f"=== Starting sharded synchronization run across {count} workers ===")
+
+    # Device progress happens in the workers; the status only shows this phase
+    status = get_status()
+    status.set_phase(f'{count} shard workers')
+    status.set_sharded()
+    summaries = []
+    with ProcessPoolExecutor(max_workers=count, initializer=setup_logging, initargs=(log_dir, log_level)) as executor:
+        futures = {
+            executor.submit(run_shard, config, index, count, state_dir, device_types, same_host=True): index
+            for index in range(count)
+        }
+        for future in as_completed(futures):
+            index = futures[future]
+            try:
+                summary = future.result()
+            except Exception as e:
+                logger.error(f"Shard {index}/{count} failed: {e}")
+                continue
+            if summary is not None:
+                summaries.append(summary)
+
+    merged = merge_summaries(summaries)
+    merged['shards_completed'] = len(summaries)
+    aborted = [summary['aborted'] for summary in summaries if summary.get('aborted')]
+    if aborted:
+        merged['aborted'] = '; '.join(aborted)
+    log_shard_report(merged, count)
+    return merged
+
+
+def log_shard_report(merged, count):
+    """Log a merged sharded run report."""
+    logger = get_logger()
+    logger.info(
+        f"=== Sharded run report: {merged.get('shards_completed', 0)}/{count} shards, "
+        f"{merged.get('processed', 0)} devices processed, {merged.get('created', 0)} created, "
+        f"{merged.get('assignment_changes', 0)} assignment changes, {merged.get('tags_synced', 0)} tags synced ==="
+    )
+    for device_type, changes in sorted(merged.get('changes_by_type', {}).items()):
+        logger.info(f"  {device_type}: {changes} changes")
 
 
-def main():
-    """Main entry point supporting both one-time and daemon modes."""
+def install_profiler(profiler):
+    """Instrument the clients and this module's per-device and assignment steps."""
+    module = sys.modules[__name__]
+    profiler.instrument_clients()
+    profiler.patch(module, 'sync_device', profiler.wrap_device(module.sync_device))
+    profiler.instrument(module, 'apply_assignments', 'assignment phase')
+
+
+def _field_list(value):
+    fields = [field.strip() for field in value.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in SNAPSHOT_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown field(s) {', '.join(unknown)}, expected: {', '.join(SNAPSHOT_FIELDS)}")
+    return fields
+
+
+def run_query(args):
+    """The query command: filter and group fleet snapshots, print the result."""
+    filters = [parse_filter(expression) for expression in args.where]
+    group_by = _field_list(args.group_by) if args.group_by else []
+    result = query(args.snapshots, filters, group_by)
+
+    if group_by:
+        header = group_by + ['count']
+        rows = [list(key) + [count] for key, count in result]
+    else:
+        header = _field_list(args.fields)
+        rows = [[row.get(field) for field in header] for row in result]
+
+    if args.format == 'json':
+        print(json.dumps([dict(zip(header, row)) for row in rows], indent=2))
+    elif args.format == 'csv':
+        writer = csv.writer(sys.stdout)
+        writer.writerow(header)
+        writer.writerows(rows)
+    else:
+        sys.stdout.write(format_table(header, rows))
+        print(f"{len(rows)} {'groups' if group_by else 'devices'}"
+              + (f", {sum(count for _, count in result)} devices" if group_by else ""))
+    return 0
+
+
+def print_retry_queue(queue):
+    """Print the retry queue as a table."""
+    entries = queue.entries()
+    header = ['tenant', 'serial', 'device_type', 'step', 'error_class', 'attempts', 'next_attempt', 'error']
+    rows = []
+    for entry in entries:
+        exhausted = entry['attempts'] >= queue.max_attempts
+        next_attempt = 'never' if exhausted else datetime.datetime.fromtimestamp(entry['next_attempt']).strftime('%Y-%m-%d %H:%M')
+        rows.append([entry['tenant'], entry['serial'], entry.get('device_type'), entry['step'],
+                     entry['error_class'], entry['attempts'], next_attempt, (entry.get('error') or '')[:60]])
+    sys.stdout.write(format_table(header, rows))
+    print(f"{len(entries)} queued devices")
+
+
+def build_parser():
+    """The command line parser: top-level options and one parser per subcommand."""
     parser = argparse.ArgumentParser(
         description='Synchronize Apple devices from Mosyle to Snipe-IT'
     )
@@ -376,6 +1247,108 @@ def main():
         default=3600,
         help='Interval between runs in seconds (default: 3600 = 1 hour). Only used in daemon mode.'
     )
+    parser.add_argument(
+        '--min-interval',
+        type=int,
+        default=None,
+        help='Shortest period the daemon tightens to when many changes are seen (default: interval/4)'
+    )
+    parser.add_argument(
+        '--max-interval',
+        type=int,
+        default=None,
+        help='Longest period the daemon stretches to when runs are quiet (default: interval*4)'
+    )
+    parser.add_argument(
+        '--jitter',
+        type=int,
+        default=60,
+        help='Randomize each daemon start by up to this many seconds (default: 60)'
+    )
+    parser.add_argument(
+        '--fixed-interval',
+        action='store_true',
+        help='Disable adaptive scheduling; run every --interval seconds (start to start)'
+    )
+    parser.add_argument(
+        '--webhook-port',
+        type=int,
+        default=None,
+        help='Listen for Mosyle webhook events on this port and sync affected devices right away. Only used in daemon mode.'
+    )
+    parser.add_argument(
+        '--webhook-host',
+        default='127.0.0.1',
+        help='Address the webhook receiver binds to (default: 127.0.0.1)'
+    )
+    parser.add_argument(
+        '--webhook-debounce',
+        type=int,
+        default=30,
+        help='Seconds without new events before a webhook batch is synced (default: 30)'
+    )
+    parser.add_argument(
+        '--status-port',
+        type=int,
+        default=None,
+        help='Serve the live run status as JSON (/status) and Prometheus metrics (/metrics) on this port. Only used in daemon mode.'
+    )
+    parser.add_argument(
+        '--status-host',
+        default='127.0.0.1',
+        help='Address the status endpoint binds to (default: 127.0.0.1)'
+    )
+    parser.add_argument(
+        '--shard',
+        default=None,
+        help='Only sync serials in shard INDEX/COUNT (e.g. 0/4), one worker per systemd instance'
+    )
+    parser.add_argument(
+        '--shards',
+        type=int,
+        default=1,
+        help='Split each run across this many worker processes by serial number (default: 1)'
+    )
+    parser.add_argument(
+        '--state-dir',
+        default=None,
+        help='Directory for shard leases, the shared rate limit and other run state '
+             '(default: [general] state_dir in settings.ini, else state/ next to main.py)'
+    )
+    parser.add_argument(
+        '--profile',
+        action='store_true',
+        help='Log a per-phase wall/CPU/sleep breakdown and the slowest devices after each run'
+    )
+    parser.add_argument(
+        '--profile-output',
+        default=None,
+        help='With --profile, also dump cProfile stats for each run to this file (read with pstats)'
+    )
+    parser.add_argument(
+        '--snapshot',
+        metavar='PATH',
+        default=None,
+        help='After each sync run, write the joined Mosyle/Snipe-IT fleet to this file (.jsonl.gz or .csv.gz) for the query command'
+    )
+    parser.add_argument(
+        '--record',
+        metavar='CASSETTE',
+        default=None,
+        help='Record every Snipe-IT, Mosyle and AppleDB request/response (secrets redacted) to this gzip cassette'
+    )
+    parser.add_argument(
+        '--replay',
+        metavar='CASSETTE',
+        default=None,
+        help='Serve all HTTP requests from a recorded cassette instead of the network'
+    )
+    parser.add_argument(
+        '--replay-latency-scale',
+        type=float,
+        default=1.0,
+        help='Multiply recorded latencies by this factor during --replay (default: 1.0, 0 disables the delays)'
+    )
     parser.add_argument(
         '--config',
         default='settings.ini',
@@ -393,47 +1366,339 @@ def main():
         help='Directory for log files (default: logs)'
     )
 
-    args = parser.parse_args()
+    subparsers = parser.add_subparsers(dest='command', metavar='command')
+    subparsers.add_parser(
+        'sync',
+        help='Synchronize devices from Mosyle to Snipe-IT (default)'
+    )
+    backfill_parser = subparsers.add_parser(
+        'backfill-images',
+        help='Fill in missing AppleDB images for every Apple model in Snipe-IT'
+    )
+    backfill_parser.add_argument(
+        '--workers',
+        type=int,
+        default=8,
+        help='Number of models resolved concurrently (default: 8)'
+    )
+
+    report_parser = subparsers.add_parser(
+        'shard-report',
+        help='Merge the latest per-shard summaries from the state directory into one report'
+    )
+    report_parser.add_argument(
+        'count',
+        type=int,
+        help='Number of shards the runs were split into'
+    )
+
+    retry_parser = subparsers.add_parser(
+        'retry',
+        help='Retry only the devices that failed in earlier runs (kept in <state-dir>/retry-queue.json)'
+    )
+    retry_parser.add_argument(
+        '--all',
+        action='store_true',
+        help='Retry every queued device now, ignoring the backoff'
+    )
+    retry_parser.add_argument(
+        '--list',
+        action='store_true',
+        help='Show the queued devices and exit'
+    )
+
+    onboard_parser = subparsers.add_parser(
+        'onboard',
+        help='Create the devices missing from Snipe-IT in bulk through the Snipe-IT CSV importer (first-time and large imports)'
+    )
+    onboard_parser.add_argument(
+        '--chunk-size',
+        type=int,
+        default=DEFAULT_CHUNK_SIZE,
+        help=f'Assets per uploaded CSV file (default: {DEFAULT_CHUNK_SIZE})'
+    )
+    onboard_parser.add_argument(
+        '--csv-dir',
+        default=None,
+        help='Keep a copy of every uploaded CSV file in this directory (default: <state-dir>/onboarding)'
+    )
+    onboard_parser.add_argument(
+        '--dry-run',
+        action='store_true',
+        help='Only write the CSV files; no assets are imported and Mosyle is not changed'
+    )
+
+    query_parser = subparsers.add_parser(
+        'query',
+        help='Report on fleet snapshots written with --snapshot, without calling any API'
+    )
+    query_parser.add_argument(
+        'snapshots',
+        nargs='+',
+        metavar='SNAPSHOT',
+        help='Snapshot file(s); pass every shard file of a sharded run'
+    )
+    query_parser.add_argument(
+        '--where',
+        action='append',
+        default=[],
+        metavar='FILTER',
+        help='Filter such as os=ios, osversion<17.4, device_model~MacBook or assignee!= (repeatable)'
+    )
+    query_parser.add_argument(
+        '--group-by',
+        default=None,
+        metavar='FIELDS',
+        help='Count devices per value of these comma-separated fields, e.g. osversion or os,device_model'
+    )
+    query_parser.add_argument(
+        '--fields',
+        default='serial_number,device_model,osversion,assignee,asset_id,last_seen',
+        help='Comma-separated columns to list when not grouping'
+    )
+    query_parser.add_argument(
+        '--format',
+        choices=['table', 'json', 'csv'],
+        default='table',
+        help='Output format (default: table)'
+    )
+    return parser
+
+
+def main(args=None):
+    """
+    Main entry point supporting both one-time and daemon modes.
+
+    Args:
+        args: Parsed build_parser() arguments, instead of parsing sys.argv
+    """
+    parser = build_parser()
+    if args is None:
+        args = parser.parse_args()
+    command = args.command or 'sync'
+    try:
+        shard = parse_shard(args.shard) if args.shard else None
+    except ValueError as e:
+        parser.error(str(e))
+    if args.record and args.replay:
+        parser.error("--record and --replay cannot be combined")
+    if (args.record or args.replay) and args.shards > 1:
+        parser.error("--record/--replay only cover one process; use --shard INDEX/COUNT instead of --shards")
+
+    if command == 'query':
+        # Reads only the snapshot files: no configuration, logging or API calls
+        try:
+            sys.exit(run_query(args))
+        except (OSError, EOFError, ValueError) as e:
+            parser.exit(1, f"query failed: {e}\n")
 
     # Setup logging
     setup_logging(log_dir=args.log_dir, log_level=args.log_level)
     logger = get_logger()
 
     logger.info("MosyleSnipeSync started")
-    logger.info(f"Mode: {'daemon' if args.daemon else 'one-time'}")
-    if args.daemon:
-        logger.info(f"Interval: {args.interval} seconds ({args.interval / 3600:.1f} hours)")
+    if command == 'sync':
+        logger.info(f"Mode: {'daemon' if args.daemon else 'one-time'}")
+        if args.daemon:
+            logger.info(f"Interval: {args.interval} seconds ({args.interval / 3600:.1f} hours)")
+    else:
+        logger.info(f"Command: {command}")
 
+    cassette = None
+    profiler = None
     try:
         # Load configuration
         config = load_configuration(args.config)
+        # Absolute, so shard workers and every later chdir agree on it
+        config['state_dir'] = os.path.abspath(args.state_dir or config['state_dir'] or DEFAULT_STATE_DIR)
+        if args.snapshot:
+            config['snapshot_path'] = args.snapshot
 
-        if args.daemon:
+        # Mounted on every HTTP session created from here on
+        if args.record:
+            cassette = CassetteRecorder(args.record)
+            logger.info(f"Recording HTTP traffic to {args.record}")
+            # Let a systemd stop unwind through the finally below, which
+            # writes the end of the cassette
+            signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
+        elif args.replay:
+            cassette = CassettePlayer(args.replay, latency_scale=args.replay_latency_scale)
+            logger.info(f"Replaying HTTP traffic from {args.replay} ({cassette.recorded} recorded requests)")
+        if cassette is not None:
+            cassette.install()
+            # The httpx clients behind async_lookups bypass the cassette
+            for tenant in config['tenants']:
+                if tenant['snipe'].get('async_lookups'):
+                    logger.warning(f"[{tenant['name']}] async_lookups is disabled while recording or replaying HTTP traffic")
+                    tenant['snipe']['async_lookups'] = False
+
+        if args.profile:
+            if args.shards > 1:
+                logger.warning("--profile only covers the parent process; shard workers are not profiled")
+            profiler = Profiler()
+            install_profiler(profiler)
+
+        def run_selected_sync(device_types):
+            # Plain, single-shard or process-pool run depending on --shard/--shards
+            if args.shards > 1:
+                return run_sharded(config, args.shards, config['state_dir'], device_types,
+                                   log_dir=args.log_dir, log_level=args.log_level)
+            if shard is not None:
+                return run_shard(config, shard[0], shard[1], config['state_dir'], device_types)
+            return run_sync(config, device_types)
+
+        def run_full_sync(device_types=None):
+            if profiler is None:
+                return run_selected_sync(device_types)
+
+            profiler.reset()
+            stats = cProfile.Profile() if args.profile_output else None
+            try:
+                with profiler.phase('sync run'):
+                    if stats is not None:
+                        stats.enable()
+                    try:
+                        return run_selected_sync(device_types)
+                    finally:
+                        if stats is not None:
+                            stats.disable()
+            finally:
+                for line in profiler.report():
+                    logger.info(line)
+                if stats is not None:
+                    stats.dump_stats(args.profile_output)
+                    logger.info(f"cProfile stats written to {args.profile_output}")
+
+        if command == 'backfill-images':
+            # AppleDB is downloaded once and shared by every tenant's backfill
+            failed = 0
+            for tenant in config['tenants']:
+                if len(config['tenants']) > 1:
+                    logger.info(f"Backfilling model images for tenant {tenant['name']}")
+                summary = backfill_model_images(create_snipe_client(tenant_config(config, tenant)), workers=args.workers)
+                failed += summary['failed']
+            if failed:
+                sys.exit(1)
+        elif command == 'retry':
+            queue = retry_queue(config)
+            if queue is None:
+                logger.error("The retry queue is disabled in settings.ini ([retry-queue] enabled)")
+                sys.exit(1)
+            if args.list:
+                print_retry_queue(queue)
+            else:
+                summary = run_retry(config, ignore_backoff=args.all, shard=shard)
+                if summary and summary.get('aborted'):
+                    sys.exit(2)
+        elif command == 'onboard':
+            summary = run_onboard(config, chunk_size=args.chunk_size,
+                                  csv_dir=args.csv_dir or os.path.join(config['state_dir'], 'onboarding'),
+                                  dry_run=args.dry_run)
+            if summary.get('aborted'):
+                sys.exit(2)
+        elif command == 'shard-report':
+            summaries = read_shard_summaries(config['state_dir'], args.count)
+            missing = [str(index) for index in range(args.count) if index not in summaries]
+            if missing:
+                logger.warning(f"No summary yet for shards: {', '.join(missing)}")
+            merged = merge_summaries(summaries.values())
+            merged['shards_completed'] = len(summaries)
+            log_shard_report(merged, args.count)
+            print(json.dumps(merged, indent=2))
+        elif args.daemon:
             # Daemon mode: run continuously
             logger.info("Entering daemon mode")
+            scheduler = AdaptiveScheduler(
+                args.interval,
+                min_interval=args.min_interval,
+                max_interval=args.max_interval,
+                jitter=args.jitter,
+                adaptive=not args.fixed_interval
+            )
+            all_device_types = configured_device_types(config)
+
+            # Full runs and webhook batches never overlap
+            sync_lock = threading.Lock()
+            status = get_status()
+            status_server = None
+            if args.status_port is not None:
+                status_server = StatusServer(status, host=args.status_host, port=args.status_port)
+                status_server.start()
+
+            receiver = None
+            if args.webhook_port is not None:
+                def sync_event_batch(batch):
+                    with sync_lock:
+                        status.start_run('event')
+                        event_summary = None
+                        try:
+                            event_summary = run_device_sync(config, batch)
+                        finally:
+                            status.finish_run(event_summary)
+
+                receiver = WebhookReceiver(
+                    sync_event_batch,
+                    host=args.webhook_host,
+                    port=args.webhook_port,
+                    token=config['webhook']['token'],
+                    delay=args.webhook_debounce
+                )
+                receiver.start()
+
             run_count = 0
             while True:
                 try:
                     run_count += 1
-                    logger.info(f"--- Run {run_count} ---")
-                    run_sync(config)
-                    logger.info(f"Sleeping for {args.interval} seconds")
-                    time.sleep(args.interval)
+                    device_types = scheduler.plan_device_types(all_device_types)
+                    logger.info(f"--- Run {run_count} ({', '.join(device_types)}) ---")
+                    started_at = time.monotonic()
+                    summary = None
+                    try:
+                        with sync_lock:
+                            # Devices that failed earlier get their retry first
+                            status.start_run('retry')
+                            retry_summary = None
+                            try:
+                                retry_summary = run_retry(config, shard=shard)
+                            finally:
+                                status.finish_run(retry_summary)
+                            status.start_run('sync')
+                            try:
+                                summary = run_full_sync(device_types)
+                            finally:
+                                status.finish_run(summary)
+                    except Exception as e:
+                        logger.error(f"Error in daemon run {run_count}: {e}")
+                    # An aborted run says nothing about how busy the fleet is
+                    scheduler.record_run(started_at, None if summary and summary.get('aborted') else summary)
+                    delay = scheduler.delay()
+                    logger.info(f"Run took {time.monotonic() - started_at:.0f} seconds. "
+                                f"Current period {scheduler.period} seconds, sleeping for {delay:.0f} seconds")
+                    status.set_next_run(time.time() + delay)
+                    time.sleep(delay)
                 except KeyboardInterrupt:
                     logger.info("Received interrupt signal, exiting daemon mode")
                     break
-                except Exception as e:
-                    logger.error(f"Error in daemon run {run_count}: {e}")
-                    logger.info(f"Sleeping for {args.interval} seconds before retry")
-                    time.sleep(args.interval)
+
+            if receiver is not None:
+                receiver.stop()
+            if status_server is not None:
+                status_server.stop()
         else:
             # One-time mode: run once and exit
-            run_sync(config)
+            summary = run_full_sync()
             logger.info("Exiting")
+            if summary and summary.get('aborted'):
+                sys.exit(2)
 
     except Exception as e:
         logger.error(f"Fatal error: {e}")
         sys.exit(1)
+    finally:
+        if profiler is not None:
+            profiler.uninstrument()
+        if cassette is not None:
+            cassette.close()
 
 
 if __name__ == "__main__":
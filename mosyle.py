@@ -1,5 +1,77 @@
+import sys
+
 import requests
 
+import jsonstream
+from breaker import get_breaker
+from logger_config import get_logger
+
+
+class MosyleDevice:
+    """
+    Compact record of a Mosyle device.
+
+    Mosyle returns dozens of fields per device; only the ones the sync and
+    buildPayloadFromMosyle() read are kept, in __slots__, and the heavily
+    repeated values (model, OS, OS version, CPU) are interned so thousands of
+    devices share one string each. Supports sn['field'], sn.get('field')
+    and 'field' in sn, so mapping code can treat it like the raw JSON dict.
+    To map another Mosyle field, add it to FIELDS.
+    """
+
+    FIELDS = (
+        'serial_number',
+        'device_name',
+        'device_model',
+        'os',
+        'osversion',
+        'cpu_model',
+        'bluetooth_mac_address',
+        'wifi_mac_address',
+        'ethernet_mac_address',
+        'useremail',
+        'CurrentConsoleManagedUser',
+        'asset_tag',
+        'date_info',
+        'date_last_beat',
+    )
+    INTERNED = frozenset(('device_model', 'os', 'osversion', 'cpu_model'))
+
+    __slots__ = FIELDS
+
+    def __init__(self, **fields):
+        for name in self.FIELDS:
+            value = fields.get(name)
+            if name in self.INTERNED and isinstance(value, str):
+                value = sys.intern(value)
+            setattr(self, name, value)
+
+    @classmethod
+    def from_json(cls, device):
+        """Build a record from one device dict of a listdevices response."""
+        return cls(**{name: device.get(name) for name in cls.FIELDS})
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def get(self, key, default=None):
+        value = getattr(self, key, None)
+        return default if value is None else value
+
+    def __contains__(self, key):
+        # Absent and null fields are both stored as None
+        return getattr(self, key, None) is not None
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.FIELDS}
+
+    def __repr__(self):
+        return f"MosyleDevice(serial_number={self.serial_number!r}, device_model={self.device_model!r}, os={self.os!r})"
+
+
 class Mosyle:
     def __init__(self, access_token, email, password, url="https://managerapi.mosyle.com/v2"):
         self.url = url
@@ -7,6 +79,8 @@ class Mosyle:
         self.email = email
         self.password = password
         self.session = requests.Session()
+        # Shared with every other client of this Mosyle API in the process
+        self.breaker = get_breaker("Mosyle", url)
         self.jwt_token = self.login()
 
         if self.jwt_token:
@@ -23,7 +97,7 @@ class Mosyle:
             "email": self.email,
             "password": self.password
         }
-        response = self.session.post(f"{self.url}/login", json=payload)
+        response = self._send("login", payload)
 
         if response.status_code == 200:
             auth_header = response.headers.get("Authorization", "")
@@ -36,14 +110,44 @@ class Mosyle:
             print(f"Error: {response.text}")
         return None
 
+    def _send(self, endpoint, data, stream=False):
+        """
+        POST to the API through the Mosyle circuit breaker. Raises
+        CircuitOpenError without sending anything while it is open.
+        """
+        probe = self.breaker.check()
+        try:
+            try:
+                response = self.session.post(f"{self.url}/{endpoint}", json=data, stream=stream)
+            except requests.RequestException as e:
+                self.breaker.record_failure(e)
+                raise
+            if response.status_code >= 500:
+                self.breaker.record_failure(f"HTTP {response.status_code}")
+            else:
+                self.breaker.record_success()
+            return response
+        finally:
+            # Frees the probe slot if the call ended without reporting
+            self.breaker.release(probe)
+
     def _post(self, endpoint, data):
         data["accessToken"] = self.access_token
-        response = self.session.post(f"{self.url}/{endpoint}", json=data)
+        response = self._send(endpoint, data)
         try:
-            return response.json()
+            return jsonstream.loads(response.content)
         except Exception:
             return {"error": "Invalid JSON response", "text": response.text}
 
+    def _postStream(self, endpoint, data, path, header=None):
+        """
+        POST and yield the items of the array at `path` in the response as
+        they are parsed. Top-level fields such as status go into header.
+        """
+        data["accessToken"] = self.access_token
+        response = self._send(endpoint, data, stream=True)
+        return jsonstream.iter_response_array(response, path, header)
+
     def list(self, os, specific_columns=None, page=1):
         print("Listing devices for OS:", os, "Page:", page)
         data = {
@@ -57,6 +161,61 @@ class Mosyle:
         if specific_columns:
             data["specific_columns"] = specific_columns
         return self._post("listdevices", data)
+
+    def iterDevices(self, os):
+        """
+        Yield every device of one OS as a MosyleDevice, page by page.
+
+        Each page is stream-parsed and devices are converted as they arrive,
+        so neither a raw page body nor its decoded JSON is ever held whole.
+
+        Raises:
+            ValueError: a page is not valid JSON, or its status is not OK
+            (an expired token, say). Devices of that page may already have
+            been yielded, so the caller must treat the whole list as
+            incomplete rather than sync it as the full fleet.
+        """
+        page = 1
+        while True:
+            print("Listing devices for OS:", os, "Page:", page)
+            data = {
+				"operation": "list",
+				"options": {
+					"os": os,
+					"page": page
+				}
+			}
+            count = 0
+            header = {}
+            try:
+                for device in self._postStream("listdevices", data, ('response', 'devices'), header):
+                    count += 1
+                    yield MosyleDevice.from_json(device)
+            except jsonstream.DECODE_ERRORS as e:
+                get_logger().error(f"Invalid JSON in listdevices response for OS {os}, page {page} "
+                                   f"(after {count} devices): {e}")
+                raise ValueError(f"Mosyle returned invalid JSON for {os} devices, page {page}: {e}") from e
+            if header.get('status') != "OK":
+                detail = header.get('message') or header.get('info') or header.get('status') or "no status"
+                get_logger().error(f"listdevices failed for OS {os}, page {page} (after {count} devices): {detail}")
+                raise ValueError(f"Mosyle listdevices failed for {os} devices, page {page}: {detail}")
+            if not count:
+                break
+            page += 1
+
+    def listBySerial(self, os, serial_numbers, specific_columns=None):
+        print("Listing devices for OS:", os, "Serials:", len(serial_numbers))
+        data = {
+			"accessToken": self.access_token,
+			"operation": "list",
+			"options": {
+				"os": os,
+				"serial_numbers": list(serial_numbers)
+			}
+		}
+        if specific_columns:
+            data["specific_columns"] = specific_columns
+        return self._post("listdevices", data)
     def setAssetTag(self, serialnumber, tag):
         return self._post("devices", {
 			"operation": "update_device",
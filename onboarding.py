@@ -0,0 +1,268 @@
+"""
+Bulk onboarding for MosyleSnipeSync.
+A first run against an empty (or nearly empty) Snipe-IT would create every
+asset with its own POST /hardware, which at the API rate limit takes hours
+for a large fleet. Instead, the Mosyle devices that are not in Snipe-IT yet
+are written to Snipe-IT import CSVs, uploaded through the /imports API and
+processed by Snipe-IT's own importer. The new asset ids are then read back,
+so asset tags go back to Mosyle and user assignments are applied as in a
+normal run.
+"""
+import csv
+import io
+from pathlib import Path
+
+from logger_config import get_logger
+from snipe import response_ok
+
+# Standard import columns: (CSV header, Snipe-IT importer field)
+IMPORT_COLUMNS = (
+    ('Asset Tag', 'asset_tag'),
+    ('Item Name', 'item_name'),
+    ('Serial Number', 'serial'),
+    ('Model Name', 'asset_model'),
+    ('Model Number', 'model_number'),
+    ('Category', 'category'),
+    ('Manufacturer', 'manufacturer'),
+    ('Status', 'status'),
+)
+
+# Status label of imported assets, as for assets created by Snipe.createAsset()
+IMPORT_STATUS_ID = 2
+
+# Assets per uploaded CSV, so one file stays well under PHP upload and
+# execution time limits
+DEFAULT_CHUNK_SIZE = 2000
+
+
+def _category_id(snipe, device_os):
+    return {
+        'mac': snipe.macos_category_id,
+        'ios': snipe.ios_category_id,
+        'tvos': snipe.tvos_category_id,
+    }.get(device_os)
+
+
+def resolve_model(snipe, device, create=True):
+    """
+    Find or create the Snipe-IT model of a device the same way a normal sync
+    does (so it gets its fieldset and image). Returns the model row, or None.
+    With create=False nothing is written to Snipe-IT: a missing model is
+    described by the row it would get and a missing image is not set.
+    """
+    response = snipe.searchModel(device['device_model'], set_image=create)
+    if not response_ok(response):
+        return None
+    if response.json().get('total', 0):
+        return response.json()['rows'][0]
+    if not create:
+        return {'name': device['device_model'], 'model_number': device['device_model']}
+
+    create_model = {
+        'mac': snipe.createModel,
+        'ios': snipe.createMobileModel,
+        'tvos': snipe.createAppleTvModel,
+    }.get(device['os'])
+    if create_model is None or not response_ok(create_model(device['device_model'])):
+        return None
+    # The importer matches models on name and model number, so use the row
+    # exactly as Snipe-IT stored it
+    response = snipe.searchModel(device['device_model'])
+    if not response_ok(response) or not response.json().get('total', 0):
+        return None
+    return response.json()['rows'][0]
+
+
+def custom_field_names(snipe):
+    """Custom field display names by database column (_snipeit_...)."""
+    return {row['db_column_name']: row['name'] for row in snipe.listFields() or []
+            if row.get('db_column_name') and row.get('name')}
+
+
+def import_row(snipe, device, model, names, field_names):
+    """
+    One import CSV row for a device, keyed by CSV header.
+
+    Args:
+        model: Snipe-IT model row from resolve_model()
+        names: category/manufacturer/status names, see bulk_onboard()
+        field_names: custom field names by database column
+    """
+    payload = snipe.buildPayloadFromMosyle(device)
+    row = {
+        'Asset Tag': payload['serial'],
+        'Item Name': payload['name'],
+        'Serial Number': payload['serial'],
+        'Model Name': model.get('name'),
+        'Model Number': model.get('model_number'),
+        'Category': names['categories'][device['os']],
+        'Manufacturer': names['manufacturer'],
+        'Status': names['status'],
+    }
+    for column, value in payload.items():
+        if column.startswith('_snipeit_'):
+            row[field_names.get(column, column)] = value
+    return row
+
+
+def column_mappings(headers, field_names):
+    """The importer's column-mappings for the given CSV headers."""
+    mappings = dict(IMPORT_COLUMNS)
+    columns_by_name = {name: column for column, name in field_names.items()}
+    # Custom fields are mapped to their database column; the header is the
+    # field's display name, which is also what older importers match on
+    return {header: mappings.get(header) or columns_by_name.get(header, header) for header in headers}
+
+
+def write_import_csv(rows):
+    """Render import rows as CSV bytes, with the standard columns first."""
+    headers = [header for header, _ in IMPORT_COLUMNS]
+    for row in rows:
+        headers.extend(header for header in row if header not in headers)
+    out = io.StringIO()
+    writer = csv.DictWriter(out, fieldnames=headers, restval='')
+    writer.writeheader()
+    writer.writerows(rows)
+    return headers, out.getvalue().encode('utf8')
+
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def bulk_onboard(devices, snipe, mosyle, assignment_plan, chunk_size=DEFAULT_CHUNK_SIZE,
+                 csv_dir=None, csv_prefix='onboard', dry_run=False):
+    """
+    Import the devices that are not in Snipe-IT yet through the CSV importer.
+
+    Devices already in Snipe-IT are left for the normal sync. Imported
+    assets are read back from /hardware, their asset tags are written to
+    Mosyle and checkouts to their Mosyle users are queued on
+    assignment_plan.
+
+    Args:
+        devices: Mosyle devices
+        snipe: Snipe client
+        mosyle: Mosyle client
+        assignment_plan: AssignmentPlan collecting checkouts
+        chunk_size: Assets per uploaded CSV file
+        csv_dir: Keep a copy of every CSV file in this directory
+        csv_prefix: File name prefix for the kept CSV files
+        dry_run: Only write the CSV files, do not upload anything
+
+    Returns:
+        dict: Counts of devices, existing, imported, tags_synced and
+        assignment_changes, the serials that were onboarded, and failures
+        as (device, step, error class, error) tuples
+    """
+    logger = get_logger()
+    result = {'devices': 0, 'existing': 0, 'imported': 0, 'tags_synced': 0, 'assignment_changes': 0,
+              'onboarded': [], 'failures': []}
+
+    devices = [device for device in devices if device.get('serial_number')]
+    result['devices'] = len(devices)
+    existing = {row.get('serial') for row in snipe.iterHardware()}
+    new_devices = [device for device in devices if device['serial_number'] not in existing]
+    result['existing'] = len(devices) - len(new_devices)
+    logger.info(f"{result['existing']} of {len(devices)} devices are already in Snipe-IT, "
+                f"{len(new_devices)} to import")
+    if not new_devices:
+        return result
+
+    # Names the importer matches on, instead of the ids the API uses
+    names = {
+        'manufacturer': snipe.getName('manufacturers', snipe.manufacturer_id),
+        'status': snipe.getName('statuslabels', IMPORT_STATUS_ID),
+        'categories': {},
+    }
+    for device_os in {device['os'] for device in new_devices}:
+        category_id = _category_id(snipe, device_os)
+        names['categories'][device_os] = snipe.getName('categories', category_id) if category_id else None
+    if not names['manufacturer'] or not names['status']:
+        raise RuntimeError("Could not read the manufacturer and status label names from Snipe-IT")
+    field_names = custom_field_names(snipe)
+
+    # One model lookup per distinct model rather than per device
+    models = {}
+    rows = []
+    importing = []
+    for device in new_devices:
+        key = (device['os'], device['device_model'])
+        if key not in models:
+            models[key] = resolve_model(snipe, device, create=not dry_run) if names['categories'].get(device['os']) else None
+        if models[key] is None:
+            logger.error(f"No Snipe-IT model for {device['serial_number']} ({device['device_model']}, {device['os']})")
+            result['failures'].append((device, 'model create', 'RequestFailed', "model lookup or create failed"))
+            continue
+        rows.append(import_row(snipe, device, models[key], names, field_names))
+        importing.append(device)
+
+    if csv_dir is not None:
+        Path(csv_dir).mkdir(parents=True, exist_ok=True)
+
+    uploaded = []
+    for number, chunk in enumerate(_chunks(list(zip(importing, rows)), max(1, chunk_size)), 1):
+        chunk_devices = [device for device, _ in chunk]
+        headers, content = write_import_csv([row for _, row in chunk])
+        filename = f"{csv_prefix}-{number}.csv"
+        if csv_dir is not None:
+            (Path(csv_dir) / filename).write_bytes(content)
+        if dry_run:
+            logger.info(f"Wrote {filename} with {len(chunk)} assets" + (f" to {csv_dir}" if csv_dir else ""))
+            continue
+
+        import_id = snipe.uploadImport(filename, content)
+        if import_id is None:
+            result['failures'].extend((device, 'bulk import', 'RequestFailed', "import upload failed")
+                                      for device in chunk_devices)
+            continue
+        response = snipe.processImport(import_id, column_mappings(headers, field_names))
+        if not response_ok(response):
+            # The importer reports per-row errors but still imports the
+            # valid rows, so the read-back below decides what made it
+            detail = response.text if response is not None else "API request failed"
+            logger.error(f"Snipe-IT reported errors importing {filename}: {detail}")
+        else:
+            logger.info(f"Imported {filename}: {len(chunk)} assets")
+        uploaded.extend(chunk_devices)
+
+    if dry_run or not uploaded:
+        return result
+
+    # Imported assets have the newest ids, so reading back newest first
+    # usually only needs as many rows as were imported. The margin covers
+    # assets created by someone else meanwhile.
+    pending = {device['serial_number'] for device in uploaded}
+    budget = 2 * len(pending) + 500
+    for scanned, row in enumerate(snipe.iterHardware(order='desc'), 1):
+        pending.discard(row.get('serial'))
+        if not pending or scanned >= budget:
+            break
+
+    for device in uploaded:
+        serial = device['serial_number']
+        asset = snipe.assets.get(serial) if serial not in pending else None
+        if asset is None:
+            logger.error(f"Asset {serial} was not created by the import")
+            result['failures'].append((device, 'bulk import', 'NotImported', "not found after import"))
+            continue
+        result['imported'] += 1
+        result['onboarded'].append(serial)
+
+        if device.get('CurrentConsoleManagedUser') and device.get('useremail') and not asset.get('assigned_to'):
+            assignment_plan.checkout(asset['id'], serial, device['useremail'])
+            result['assignment_changes'] += 1
+
+        asset_tag = asset.get('asset_tag')
+        if asset_tag and device.get('asset_tag') != asset_tag:
+            try:
+                mosyle.setAssetTag(serial, asset_tag)
+                result['tags_synced'] += 1
+            except Exception as e:
+                logger.error(f"Failed to sync asset tag of {serial} to Mosyle: {e}")
+                result['failures'].append((device, 'tag sync', type(e).__name__, str(e)))
+
+    logger.info(f"Bulk import complete: {result['imported']} of {len(uploaded)} assets created, "
+                f"{result['tags_synced']} asset tags synced to Mosyle")
+    return result
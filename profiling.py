@@ -0,0 +1,222 @@
+"""
+Per-phase profiling for MosyleSnipeSync.
+Wraps the Snipe and Mosyle client methods (and anything else registered)
+with timers that attribute wall time, thread CPU time and time spent
+sleeping (rate limiting, retries) to named phases, and keeps the slowest
+devices of a run. Phases nest; each phase is charged only its own time, so
+the rows add up to the profiled total.
+
+Sleeps are only timed where the clients make them: the `time` name of the
+modules in SLEEP_MODULES is swapped for a stand-in with a timed sleep(), so
+time.sleep() elsewhere in the process (webhook, status and scheduler threads)
+is left alone. Everything is undone by uninstrument().
+"""
+import functools
+import inspect
+import threading
+import time
+from contextlib import contextmanager
+
+import ratelimit
+import snipe
+from mosyle import Mosyle
+from snipe import Snipe
+
+# (class, method, phase) instrumented by Profiler.instrument_clients()
+CLIENT_PHASES = (
+    (Mosyle, 'login', 'mosyle login'),
+    (Mosyle, 'list', 'mosyle fetch'),
+    (Mosyle, 'iterDevices', 'mosyle fetch'),
+    (Mosyle, 'listBySerial', 'mosyle fetch'),
+    (Mosyle, 'setAssetTag', 'tag write-back'),
+    (Snipe, 'listHardware', 'hardware lookup'),
+    (Snipe, 'searchModel', 'model search'),
+    (Snipe, 'createModel', 'model create'),
+    (Snipe, 'createMobileModel', 'model create'),
+    (Snipe, 'createAppleTvModel', 'model create'),
+    (Snipe, 'updateModel', 'model update'),
+    (Snipe, 'getImageForModel', 'image probing'),
+    (Snipe, 'createAsset', 'asset create'),
+    (Snipe, 'updateAsset', 'asset update'),
+    (Snipe, 'findUser', 'user lookup'),
+    (Snipe, 'checkoutAsset', 'checkout'),
+    (Snipe, 'bulkCheckout', 'checkout'),
+    (Snipe, 'unasigneAsset', 'checkin'),
+)
+
+# Modules whose time.sleep() calls (retries, rate limit waits) are timed
+SLEEP_MODULES = (snipe, ratelimit)
+
+UNPROFILED = '(outside phases)'
+
+
+class _TimedTime:
+    """Stands in for the time module inside an instrumented module, with a timed sleep()."""
+
+    def __init__(self, sleep):
+        self.sleep = sleep
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+
+class _Frame:
+    __slots__ = ('name', 'wall', 'cpu', 'child_wall', 'child_cpu', 'sleep')
+
+    def __init__(self, name):
+        self.name = name
+        self.wall = time.perf_counter()
+        self.cpu = time.thread_time()
+        self.child_wall = 0.0
+        self.child_cpu = 0.0
+        self.sleep = 0.0
+
+
+class Profiler:
+    """Collects per-phase wall/CPU/sleep totals and per-device timings."""
+
+    def __init__(self, slowest=10):
+        self.slowest = slowest
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._patches = []
+        self.reset()
+
+    def reset(self):
+        """Clear collected timings (instrumentation stays in place)."""
+        with self._lock:
+            # phase -> [calls, self wall, self cpu, sleep]
+            self.phases = {}
+            self.devices = []
+            self.started = time.perf_counter()
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _record(self, name, calls, wall, cpu, sleep):
+        with self._lock:
+            totals = self.phases.setdefault(name, [0, 0.0, 0.0, 0.0])
+            totals[0] += calls
+            totals[1] += wall
+            totals[2] += cpu
+            totals[3] += sleep
+
+    @contextmanager
+    def phase(self, name):
+        """Time a block as `name`, excluding time spent in nested phases."""
+        stack = self._stack()
+        frame = _Frame(name)
+        stack.append(frame)
+        try:
+            yield
+        finally:
+            stack.pop()
+            wall = time.perf_counter() - frame.wall
+            cpu = time.thread_time() - frame.cpu
+            self._record(name, 1, wall - frame.child_wall, cpu - frame.child_cpu, frame.sleep)
+            if stack:
+                stack[-1].child_wall += wall
+                stack[-1].child_cpu += cpu
+
+    def wrap(self, func, name):
+        """Wrap a function (or generator function) so each call is timed as `name`."""
+        profiler = self
+
+        if inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def generator_wrapper(*args, **kwargs):
+                iterator = func(*args, **kwargs)
+                while True:
+                    # Only time spent producing items is charged to the phase
+                    with profiler.phase(name):
+                        try:
+                            item = next(iterator)
+                        except StopIteration:
+                            return
+                    yield item
+            return generator_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with profiler.phase(name):
+                return func(*args, **kwargs)
+        return wrapper
+
+    def wrap_device(self, func, name='device sync'):
+        """Wrap sync_device(sn, ...) to also keep per-device wall times."""
+        profiler = self
+
+        @functools.wraps(func)
+        def wrapper(sn, *args, **kwargs):
+            started = time.perf_counter()
+            try:
+                with profiler.phase(name):
+                    return func(sn, *args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - started
+                with profiler._lock:
+                    profiler.devices.append((elapsed, sn.get('serial_number'), sn.get('device_model')))
+        return wrapper
+
+    def patch(self, owner, attr, wrapped):
+        """Replace owner.attr with `wrapped` until uninstrument()."""
+        self._patches.append((owner, attr, owner.__dict__[attr]))
+        setattr(owner, attr, wrapped)
+
+    def instrument(self, owner, attr, name):
+        self.patch(owner, attr, self.wrap(owner.__dict__[attr], name))
+
+    def sleep(self, seconds):
+        """time.sleep(), charged to the calling thread's current phase."""
+        started = time.perf_counter()
+        try:
+            time.sleep(seconds)
+        finally:
+            slept = time.perf_counter() - started
+            stack = self._stack()
+            if stack:
+                stack[-1].sleep += slept
+            else:
+                self._record(UNPROFILED, 0, 0.0, 0.0, slept)
+
+    def instrument_clients(self):
+        """Instrument the Snipe and Mosyle methods in CLIENT_PHASES and the sleeps in SLEEP_MODULES."""
+        for owner, attr, name in CLIENT_PHASES:
+            self.instrument(owner, attr, name)
+        for module in SLEEP_MODULES:
+            self.patch(module, 'time', _TimedTime(self.sleep))
+
+    def uninstrument(self):
+        """Undo every patch made by this profiler."""
+        while self._patches:
+            owner, attr, original = self._patches.pop()
+            setattr(owner, attr, original)
+
+    def report(self):
+        """Return the breakdown as a list of text lines."""
+        with self._lock:
+            elapsed = time.perf_counter() - self.started
+            phases = sorted(self.phases.items(), key=lambda item: item[1][1], reverse=True)
+            devices = sorted(self.devices, reverse=True)[:self.slowest]
+            device_count = len(self.devices)
+
+        lines = [
+            f"Profile: {elapsed:.1f}s elapsed. Phase times are self time summed over all threads",
+            f"{'phase':<20}{'calls':>8}{'wall s':>10}{'cpu s':>10}{'sleep s':>10}{'avg ms':>10}",
+        ]
+        total = [0, 0.0, 0.0, 0.0]
+        for name, (calls, wall, cpu, sleep) in phases:
+            avg = (wall / calls * 1000) if calls else 0.0
+            lines.append(f"{name:<20}{calls:>8}{wall:>10.2f}{cpu:>10.2f}{sleep:>10.2f}{avg:>10.1f}")
+            for index, value in enumerate((calls, wall, cpu, sleep)):
+                total[index] += value
+        lines.append(f"{'total':<20}{total[0]:>8}{total[1]:>10.2f}{total[2]:>10.2f}{total[3]:>10.2f}")
+
+        if devices:
+            lines.append(f"Slowest {len(devices)} of {device_count} devices:")
+            for wall, serial, model in devices:
+                lines.append(f"  {wall:>8.2f}s  {serial}  {model or ''}")
+        return lines
@@ -0,0 +1,142 @@
+"""
+Host-wide Snipe-IT rate limiting for MosyleSnipeSync.
+Snipe-IT throttles per API key, but every Snipe client only counts its own
+requests, so a daemon, a manual run and a backfill running at the same time
+each spend the full rate_limit and together run into 429s and minute-long
+stalls. SharedRateLimiter keeps the requests sent in the last minute in a
+small JSON file under the state directory, updated under an flock, so every
+process using the same Snipe-IT instance and key draws from one budget.
+
+While several processes want to send, each is guaranteed an equal share of
+the budget; a share another process leaves unused can be taken by the
+others, so together they keep sending at the limit.
+"""
+import fcntl
+import hashlib
+import json
+import os
+import socket
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+# Longest single sleep while waiting, so a freed-up budget is noticed quickly
+MAX_POLL_INTERVAL = 1.0
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class SharedRateLimiter:
+    """
+    At most `rate_limit` requests per `period` seconds across every process
+    on the host that uses the same state directory and budget name.
+
+    Requests are counted in one-second buckets per process, each kept until
+    its whole second has left the window. Entries of
+    processes that exited, or that have been idle for a whole period, are
+    dropped.
+    """
+
+    def __init__(self, state_dir, name, rate_limit, period=60, clock=time.time, sleep=None):
+        digest = hashlib.sha1(name.encode('utf8')).hexdigest()[:16]
+        self.path = Path(state_dir) / "ratelimit" / f"{digest}.json"
+        self.rate_limit = rate_limit
+        self.period = period
+        self.clock = clock
+        self._sleep = sleep
+        self._me = f"{socket.gethostname()}:{os.getpid()}"
+        self.waited = 0.0
+
+    @contextmanager
+    def _locked(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(self.path.with_suffix(".lock"), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    def _load(self):
+        try:
+            return json.loads(self.path.read_text()).get('processes', {})
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self, processes):
+        tmp = self.path.with_suffix(".json.tmp")
+        tmp.write_text(json.dumps({'rate_limit': self.rate_limit, 'period': self.period, 'processes': processes}))
+        os.replace(tmp, self.path)
+
+    def _prune(self, processes, now):
+        host = socket.gethostname()
+        cutoff = now - self.period
+        for key in list(processes):
+            entry = processes[key]
+            entry['sent'] = {second: count for second, count in entry.get('sent', {}).items()
+                             if int(second) + 1 > cutoff}
+            process_host, _, pid = key.rpartition(':')
+            gone = process_host == host and key != self._me and not _alive(int(pid))
+            if gone or (key != self._me and entry.get('seen', 0) <= cutoff):
+                del processes[key]
+
+    def _try_acquire(self):
+        """Count one request if the budget allows it. Returns 0, or the seconds to wait."""
+        now = self.clock()
+        with self._locked():
+            processes = self._load()
+            self._prune(processes, now)
+            mine = processes.setdefault(self._me, {'sent': {}, 'waiting': False})
+            mine['seen'] = now
+
+            counts = {key: sum(entry['sent'].values()) for key, entry in processes.items()}
+            total = sum(counts.values())
+            share = self.rate_limit / len(processes)
+            # Another process is waiting and has not had its share yet
+            starved = any(entry.get('waiting') and counts[key] < share
+                          for key, entry in processes.items() if key != self._me)
+
+            if total < self.rate_limit and (counts[self._me] < share or not starved):
+                second = str(int(now))
+                mine['sent'][second] = mine['sent'].get(second, 0) + 1
+                mine['waiting'] = False
+                self._save(processes)
+                return 0
+
+            mine['waiting'] = True
+            self._save(processes)
+            if total < self.rate_limit:
+                # Only giving way to a starved process
+                return MAX_POLL_INTERVAL
+            oldest = min(int(second) for entry in processes.values() for second in entry['sent'])
+            return max(0.05, oldest + 1 + self.period - now)
+
+    def acquire(self):
+        """Block until a request may be sent, and count it."""
+        while True:
+            wait = self._try_acquire()
+            if not wait:
+                return
+            wait = min(wait, MAX_POLL_INTERVAL)
+            self.waited += wait
+            # Looked up per call so profiling.Profiler can time the wait
+            (self._sleep or time.sleep)(wait)
+
+    def usage(self):
+        """Requests sent in the last period: {'total': n, 'processes': {host:pid: n}}."""
+        now = self.clock()
+        with self._locked():
+            processes = self._load()
+        cutoff = now - self.period
+        counts = {key: sum(count for second, count in entry.get('sent', {}).items() if int(second) + 1 > cutoff)
+                  for key, entry in processes.items()}
+        return {'total': sum(counts.values()), 'processes': counts}
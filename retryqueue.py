@@ -0,0 +1,139 @@
+"""
+Dead-letter retry queue for MosyleSnipeSync.
+Devices that fail during a run are kept in <state-dir>/retry-queue.json
+with the step that failed and the error, and retried on their own (see
+`main.py retry`, which daemon mode also runs at the start of every cycle)
+with exponential backoff until they succeed or run out of attempts. The
+file is updated under an flock, so shard processes can share it.
+"""
+import fcntl
+import json
+import os
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+QUEUE_VERSION = 1
+
+# Step recorded for devices a run never got to (e.g. aborted by a circuit breaker)
+SKIPPED_STEP = 'skipped'
+
+
+class RetryQueue:
+    """
+    Failed devices keyed by (tenant, serial).
+
+    Each failed attempt pushes the next retry back by base_delay * 2^(n-1)
+    seconds, capped at max_delay. After max_attempts failures an entry is
+    kept for inspection but no longer retried.
+    """
+
+    def __init__(self, state_dir, max_attempts=8, base_delay=300, max_delay=6 * 3600, clock=time.time):
+        self.path = Path(state_dir) / "retry-queue.json"
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.clock = clock
+
+    @contextmanager
+    def _locked(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(self.path.with_suffix(".lock"), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    def _load(self):
+        try:
+            data = json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            return {}
+        return {(entry['tenant'], entry['serial']): entry for entry in data.get('entries', [])}
+
+    def _save(self, entries):
+        tmp = self.path.with_suffix(".json.tmp")
+        tmp.write_text(json.dumps({
+            'version': QUEUE_VERSION,
+            'entries': sorted(entries.values(), key=lambda entry: (entry['tenant'], entry['serial'])),
+        }, indent=1))
+        os.replace(tmp, self.path)
+
+    def entries(self):
+        """Every queued entry, including ones that ran out of attempts."""
+        with self._locked():
+            return sorted(self._load().values(), key=lambda entry: (entry['next_attempt'], entry['serial']))
+
+    def delay_for(self, attempts):
+        return min(self.max_delay, self.base_delay * 2 ** max(0, attempts - 1))
+
+    def update(self, tenant, failures, succeeded=()):
+        """
+        Record the outcome of syncing devices for one tenant.
+
+        Args:
+            failures: dicts with serial, device_type, step, error_class and error
+            succeeded: serials that synced; they leave the queue
+
+        Returns:
+            tuple: (entries added or updated, entries removed)
+        """
+        if not failures and not succeeded:
+            return 0, 0
+        now = self.clock()
+        with self._locked():
+            entries = self._load()
+            removed = 0
+            for serial in succeeded:
+                if entries.pop((tenant, serial), None) is not None:
+                    removed += 1
+            for failure in failures:
+                key = (tenant, failure['serial'])
+                entry = entries.get(key) or {
+                    'tenant': tenant,
+                    'serial': failure['serial'],
+                    'attempts': 0,
+                    'first_failed': now,
+                }
+                # A device the run never reached has not used up an attempt
+                attempted = failure['step'] != SKIPPED_STEP
+                if attempted:
+                    entry['attempts'] += 1
+                entry.update(
+                    device_type=failure.get('device_type') or entry.get('device_type'),
+                    step=failure['step'],
+                    error_class=failure['error_class'],
+                    error=failure['error'],
+                    last_failed=now,
+                    next_attempt=now + self.delay_for(entry['attempts']) if attempted else now,
+                )
+                entries[key] = entry
+            self._save(entries)
+        return len(failures), removed
+
+    def due(self, tenant=None, now=None, ignore_backoff=False):
+        """
+        Entries ready to be retried, as {tenant: {device type or None: set of serials}}.
+        Entries that ran out of attempts are left out.
+        """
+        now = self.clock() if now is None else now
+        batches = {}
+        for entry in self.entries():
+            if tenant is not None and entry['tenant'] != tenant:
+                continue
+            if entry['attempts'] >= self.max_attempts:
+                continue
+            if not ignore_backoff and entry['next_attempt'] > now:
+                continue
+            batches.setdefault(entry['tenant'], {}).setdefault(entry.get('device_type'), set()).add(entry['serial'])
+        return batches
+
+    def exhausted(self):
+        """Entries that will not be retried again."""
+        return [entry for entry in self.entries() if entry['attempts'] >= self.max_attempts]
+
+    def remove(self, tenant, serials):
+        """Drop entries, e.g. for devices that no longer exist in Mosyle."""
+        return self.update(tenant, [], serials)[1]
@@ -0,0 +1,105 @@
+"""
+Adaptive daemon scheduling for MosyleSnipeSync.
+Keeps run start times on a fixed-rate grid (a long run does not push every
+later run back), stretches the period when runs see few changes, tightens it
+when changes spike, and jitters each start so several instances don't align.
+"""
+import random
+import time
+
+
+class AdaptiveScheduler:
+    """
+    Decide when the next daemon run starts and which device types it covers.
+
+    The period starts at `interval`. After each run it is doubled (up to
+    `max_interval`) when the run saw at most `quiet_changes` changes, halved
+    (down to `min_interval`) when it saw at least `busy_changes`, and moved
+    back towards `interval` otherwise.
+
+    Device types that were quiet in their last run are skipped for up to
+    `max_skips` runs in a row, so a quiet fleet is re-checked less often
+    without ever being left out for long.
+    """
+
+    def __init__(self, interval, min_interval=None, max_interval=None, jitter=60,
+                 quiet_changes=0, busy_changes=50, max_skips=2, adaptive=True,
+                 clock=time.monotonic, rng=None):
+        self.interval = interval
+        self.min_interval = min_interval or max(60, interval // 4)
+        self.max_interval = max_interval or interval * 4
+        self.jitter = jitter
+        self.quiet_changes = quiet_changes
+        self.busy_changes = busy_changes
+        self.max_skips = max_skips
+        self.adaptive = adaptive
+        self.clock = clock
+        self.rng = rng or random.Random()
+
+        self.period = interval
+        self.next_start = None
+        self._skips = {}
+        self._quiet_types = set()
+
+    def plan_device_types(self, device_types):
+        """Return the device types the next run should cover."""
+        if not self.adaptive:
+            return list(device_types)
+        planned = []
+        for device_type in device_types:
+            skips = self._skips.get(device_type, 0)
+            if device_type in self._quiet_types and skips < self.max_skips:
+                self._skips[device_type] = skips + 1
+            else:
+                self._skips[device_type] = 0
+                planned.append(device_type)
+        # Never plan an empty run; fall back to a full one
+        if not planned:
+            for device_type in device_types:
+                self._skips[device_type] = 0
+            return list(device_types)
+        return planned
+
+    def record_run(self, started_at, summary):
+        """
+        Feed back the result of a run and schedule the next start.
+
+        Args:
+            started_at: clock() value at which the run started
+            summary: run_sync() summary, or None if the run failed
+        """
+        if summary is not None and self.adaptive:
+            changes_by_type = summary.get('changes_by_type', {})
+            for device_type, changes in changes_by_type.items():
+                if changes <= self.quiet_changes:
+                    self._quiet_types.add(device_type)
+                else:
+                    self._quiet_types.discard(device_type)
+
+            changes = sum(changes_by_type.values())
+            if changes <= self.quiet_changes:
+                self.period = min(self.max_interval, self.period * 2)
+            elif changes >= self.busy_changes:
+                self.period = max(self.min_interval, self.period // 2)
+            elif self.period > self.interval:
+                self.period = max(self.interval, self.period // 2)
+            elif self.period < self.interval:
+                self.period = min(self.interval, self.period * 2)
+
+        # Fixed rate: the next slot is measured from the previous scheduled
+        # start, not from when this run happened to finish
+        base = self.next_start if self.next_start is not None else started_at
+        next_start = base + self.period
+        now = self.clock()
+        if next_start < now:
+            # The run overran one or more slots; start the next one right away
+            next_start = now
+        self.next_start = next_start
+
+    def delay(self):
+        """Seconds to sleep before the next run, including jitter."""
+        if self.next_start is None:
+            return 0
+        spread = min(self.jitter, self.period / 2)
+        offset = self.rng.uniform(-spread, spread) if spread > 0 else 0
+        return max(0.0, self.next_start + offset - self.clock())
@@ -0,0 +1,208 @@
+"""
+Fleet snapshots for MosyleSnipeSync.
+At the end of a run the synced Mosyle devices are joined with their Snipe-IT
+assets and written to a gzip-compressed JSON-lines or CSV file (replaced
+atomically), so reports can be answered from the snapshot with `main.py
+query` instead of calling either API.
+"""
+import csv
+import gzip
+import io
+import json
+import os
+import re
+import threading
+from pathlib import Path
+
+# Columns of a snapshot row, in file order
+SNAPSHOT_FIELDS = (
+    'tenant',
+    'serial_number',
+    'device_name',
+    'os',
+    'device_model',
+    'osversion',
+    'assignee',
+    'asset_id',
+    'asset_tag',
+    'snipe_model',
+    'snipe_assignee',
+    'last_seen',
+)
+
+# Filter operators understood by parse_filter(), longest first
+FILTER_OPERATORS = ('!=', '<=', '>=', '=', '<', '>', '~')
+
+
+def _is_csv(path):
+    return Path(path).name.lower().endswith(('.csv', '.csv.gz'))
+
+
+def snapshot_row(tenant, device, asset_row):
+    """Join one Mosyle device with its Snipe-IT hardware row (or None)."""
+    asset_row = asset_row or {}
+    assigned = asset_row.get('assigned_to') or {}
+    model = asset_row.get('model') or {}
+    return {
+        'tenant': tenant,
+        'serial_number': device.get('serial_number'),
+        'device_name': device.get('device_name'),
+        'os': device.get('os'),
+        'device_model': device.get('device_model'),
+        'osversion': device.get('osversion'),
+        'assignee': device.get('useremail'),
+        'asset_id': asset_row.get('id'),
+        'asset_tag': asset_row.get('asset_tag'),
+        'snipe_model': model.get('name') if isinstance(model, dict) else None,
+        'snipe_assignee': assigned.get('username') if isinstance(assigned, dict) else None,
+        # Mosyle reports these as unix timestamps
+        'last_seen': device.get('date_last_beat') or device.get('date_info'),
+    }
+
+
+class SnapshotCollector:
+    """
+    Thread-safe collection of snapshot rows from one or more tenant runs.
+    Tracks which (tenant, device type) pairs were synced so rows for the
+    ones a run skipped can be carried over from the previous snapshot.
+    """
+
+    def __init__(self):
+        self.rows = []
+        self.covered = set()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.rows)
+
+    def add_devices(self, tenant, device_type, devices, assets):
+        """Add rows for one tenant's devices of a type, joined against its Snipe client's AssetCache."""
+        rows = []
+        for device in devices:
+            if device.get('serial_number'):
+                row = snapshot_row(tenant, device, assets.get(device.get('serial_number')))
+                # The configured device type is what carry_over() matches on
+                row['os'] = device_type
+                rows.append(row)
+        with self._lock:
+            self.rows.extend(rows)
+            self.covered.add((tenant, device_type))
+
+    def carry_over(self, path):
+        """Keep rows of the snapshot at `path` for tenants/device types this run did not sync."""
+        try:
+            previous = [row for row in read_snapshot(path)
+                        if (row.get('tenant'), row.get('os')) not in self.covered]
+        except (OSError, EOFError, ValueError):
+            return 0
+        with self._lock:
+            self.rows.extend(previous)
+        return len(previous)
+
+
+def write_snapshot(path, rows):
+    """
+    Write rows to a gzip JSON-lines file, or gzip CSV if the name ends in
+    .csv.gz, replacing any previous snapshot atomically.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + '.tmp')
+    with gzip.open(tmp, 'wt', encoding='utf8', newline='') as f:
+        if _is_csv(path):
+            writer = csv.DictWriter(f, fieldnames=SNAPSHOT_FIELDS, extrasaction='ignore')
+            writer.writeheader()
+            writer.writerows(rows)
+        else:
+            for row in rows:
+                f.write(json.dumps(row) + '\n')
+    os.replace(tmp, path)
+    return path
+
+
+def read_snapshot(path):
+    """Yield the rows of a snapshot written by write_snapshot()."""
+    with gzip.open(path, 'rt', encoding='utf8', newline='') as f:
+        if _is_csv(path):
+            for row in csv.DictReader(f):
+                yield {key: (value if value != '' else None) for key, value in row.items()}
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def _sort_key(value):
+    """Order values naturally, so OS version 17.10 sorts after 17.9."""
+    if value is None:
+        return ()
+    return tuple((0, int(part), '') if part.isdigit() else (1, 0, part.lower())
+                 for part in re.split(r'[.\-_ ]', str(value)))
+
+
+def parse_filter(expression):
+    """
+    Parse 'field<op>value' into (field, op, value).
+
+    Operators: = and != (case-insensitive equality), ~ (contains), and
+    <, <=, >, >= (natural order, so osversion<17.4 works as expected).
+    """
+    for operator in FILTER_OPERATORS:
+        field, found, value = expression.partition(operator)
+        if found and field:
+            field = field.strip()
+            if field not in SNAPSHOT_FIELDS:
+                raise ValueError(f"Unknown field '{field}', expected one of: {', '.join(SNAPSHOT_FIELDS)}")
+            return field, operator, value.strip()
+    raise ValueError(f"Invalid filter '{expression}', expected FIELD=VALUE (or !=, ~, <, <=, >, >=)")
+
+
+def matches(row, filters):
+    """True if the row passes every (field, op, value) filter."""
+    for field, operator, expected in filters:
+        value = row.get(field)
+        text = '' if value is None else str(value).lower()
+        wanted = expected.lower()
+        if operator == '=':
+            ok = text == wanted
+        elif operator == '!=':
+            ok = text != wanted
+        elif operator == '~':
+            ok = wanted in text
+        elif value is None:
+            ok = False
+        else:
+            left, right = _sort_key(value), _sort_key(expected)
+            ok = {'<': left < right, '<=': left <= right, '>': left > right, '>=': left >= right}[operator]
+        if not ok:
+            return False
+    return True
+
+
+def query(paths, filters=(), group_by=()):
+    """
+    Filter snapshot rows and optionally count them per group.
+
+    Returns:
+        list: matching rows, or [(group values tuple, count), ...] sorted
+        by count when group_by is given
+    """
+    rows = (row for path in paths for row in read_snapshot(path) if matches(row, filters))
+    if not group_by:
+        return list(rows)
+    counts = {}
+    for row in rows:
+        key = tuple(row.get(field) for field in group_by)
+        counts[key] = counts.get(key, 0) + 1
+    return sorted(counts.items(), key=lambda item: (-item[1], [_sort_key(value) for value in item[0]]))
+
+
+def format_table(header, rows):
+    """Render rows of values as aligned text columns."""
+    cells = [[str(value) for value in header]] + [['' if value is None else str(value) for value in row]
+                                                  for row in rows]
+    widths = [max(len(row[index]) for row in cells) for index in range(len(header))]
+    out = io.StringIO()
+    for row in cells:
+        out.write('  '.join(value.ljust(width) for value, width in zip(row, widths)).rstrip() + '\n')
+    return out.getvalue()
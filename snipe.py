@@ -1,11 +1,62 @@
-import mimetypes
 from unittest import result
 import requests
+import threading
 import time
-import base64
+from collections import deque
 from colorama import Fore
 from colorama import Style
 
+import appledb
+from breaker import CircuitOpenError, get_breaker
+from inventory import AssetCache
+
+
+def response_ok(response):
+    """True if a Snipe-IT response is a 2xx without an error status in the body."""
+    if response is None or response.status_code >= 400:
+        return False
+    try:
+        body = response.json()
+    except (ValueError, TypeError):
+        return True
+    return not (isinstance(body, dict) and body.get('status') == 'error')
+
+
+class RequestWindow:
+    """
+    At most `rate_limit` requests in any `period` seconds within this process.
+    Thread-safe; callers wait outside the lock, so a thread sleeping on a
+    used-up budget does not hold up the others. A blocking Snipe client and
+    the asyncio clients made from it draw on the same window.
+    """
+
+    def __init__(self, rate_limit, period=60, clock=time.monotonic):
+        self.rate_limit = rate_limit
+        self.period = period
+        self.clock = clock
+        self._sent = deque()
+        self._lock = threading.Lock()
+
+    def _expire(self, now):
+        while self._sent and self._sent[0] <= now - self.period:
+            self._sent.popleft()
+
+    def try_acquire(self):
+        """Count one request if the budget allows it. Returns 0, or the seconds to wait."""
+        with self._lock:
+            now = self.clock()
+            self._expire(now)
+            if len(self._sent) < self.rate_limit:
+                self._sent.append(now)
+                return 0
+            return max(0.05, self._sent[0] + self.period - now)
+
+    def in_window(self):
+        """Requests sent during the last `period` seconds."""
+        with self._lock:
+            self._expire(self.clock())
+            return len(self._sent)
+
 
 class Snipe:
     def __init__(self, snipetoken, url,manufacturer_id,macos_category_id,ios_category_id,tvos_category_id,rate_limit,macos_fieldset_id,ios_fieldset_id,tvos_fieldset_id,apple_image_check):
@@ -16,11 +67,28 @@ class Snipe:
         self.ios_category_id = ios_category_id
         self.tvos_category_id = tvos_category_id
         self.rate_limit = rate_limit
-        self.request_count = 0
+        # Requests sent in the last minute, unless shared_limiter is set
+        self.window = RequestWindow(rate_limit)
         self.macos_fieldset_id = macos_fieldset_id
         self.ios_fieldset_id = ios_fieldset_id
         self.tvos_fieldset_id = tvos_fieldset_id
         self.apple_image_check = apple_image_check
+        # Shared session keeps connections alive between calls
+        self.session = requests.Session()
+        # Read and written by the assignment worker threads
+        self._user_cache = {}
+        self._users_by_id = {}
+        self._user_lock = threading.Lock()
+        self._name_cache = {}
+        self.bulk_checkout_supported = True
+        # Optional ratelimit.SharedRateLimiter; when set it replaces
+        # window so every process on the host shares rate_limit
+        self.shared_limiter = None
+        # Shared with every other client of this Snipe-IT instance in the process
+        self.breaker = get_breaker("Snipe-IT", url)
+        # Assets seen or written during this client's lifetime, kept current
+        # from our own write responses
+        self.assets = AssetCache()
 
     @property
     def headers(self):
@@ -35,11 +103,98 @@ class Snipe:
         print('Requesting Snipe Harware list at url '+ self.url + "/hardware/byserial/")
         return self.snipeItRequest("GET", "/hardware/byserial/" + serial)
 
-    def listAllModels(self):
-        print('requesting all apple models')
-        return self.snipeItRequest("GET","/models", params = {"limit": "200", "offset": "0", "sort": "created_at", "order": "asc"})
+    def listAllModels(self, limit=200, offset=0):
+        print(f'requesting models {offset}-{offset + limit}')
+        return self.snipeItRequest("GET","/models", params = {"limit": str(limit), "offset": str(offset), "sort": "created_at", "order": "asc"})
+
+    def iterAllModels(self, page_size=200):
+        """Yield every model row in Snipe-IT, paging through /models."""
+        offset = 0
+        while True:
+            response = self.listAllModels(limit=page_size, offset=offset)
+            if response is None or response.status_code >= 400:
+                raise RuntimeError(f"Failed to list models at offset {offset}")
+            data = response.json()
+            if isinstance(data, dict) and data.get('status') == 'error':
+                raise RuntimeError(f"listAllModels: API returned error: {data.get('messages', data)}")
+            rows = data.get('rows', [])
+            yield from rows
+            offset += len(rows)
+            if not rows or offset >= data.get('total', 0):
+                break
+
+    def listAllHardware(self, limit=500, offset=0, order="asc"):
+        print(f'requesting hardware {offset}-{offset + limit}')
+        return self.snipeItRequest("GET", "/hardware", params={"limit": str(limit), "offset": str(offset), "sort": "id", "order": order})
+
+    def iterHardware(self, page_size=500, order="asc"):
+        """
+        Yield every hardware row in Snipe-IT, paging through /hardware by id
+        (newest first with order="desc"). Rows are added to the asset cache.
+        """
+        offset = 0
+        while True:
+            response = self.listAllHardware(limit=page_size, offset=offset, order=order)
+            if response is None or response.status_code >= 400:
+                raise RuntimeError(f"Failed to list hardware at offset {offset}")
+            data = response.json()
+            if isinstance(data, dict) and data.get('status') == 'error':
+                raise RuntimeError(f"listAllHardware: API returned error: {data.get('messages', data)}")
+            rows = data.get('rows', [])
+            self.assets.store_rows(rows)
+            yield from rows
+            offset += len(rows)
+            if not rows or offset >= data.get('total', 0):
+                break
+
+    def listFields(self):
+        """Custom field rows from /fields, or None if they could not be read."""
+        response = self.snipeItRequest("GET", "/fields")
+        if not response_ok(response):
+            return None
+        return response.json().get('rows', [])
+
+    def getName(self, endpoint, object_id):
+        """
+        Name of a category, manufacturer, status label, ... by id, e.g.
+        getName("categories", 3). Cached for the lifetime of the client.
+        """
+        key = (endpoint, str(object_id))
+        if key not in self._name_cache:
+            response = self.snipeItRequest("GET", f"/{endpoint}/{object_id}")
+            self._name_cache[key] = response.json().get('name') if response_ok(response) else None
+        return self._name_cache[key]
+
+    def uploadImport(self, filename, content):
+        """Upload a CSV file to the Snipe-IT importer. Returns the import id, or None."""
+        print(f'Uploading import file {filename}')
+        response = self.snipeItRequest("POST", "/imports", files={"files[]": (filename, content, "text/csv")})
+        if not response_ok(response):
+            print(Fore.RED + f"Failed to upload import file: {response.text if response is not None else 'API request failed'}" + Style.RESET_ALL)
+            return None
+        body = response.json()
+        # Older releases answer {"files": [...]}, newer ones wrap it in a payload
+        files = body.get('files') or body.get('payload') or []
+        if isinstance(files, dict):
+            files = [files]
+        return files[0].get('id') if files else None
+
+    def processImport(self, import_id, column_mappings, update=False):
+        """Run an uploaded import file as an asset import."""
+        print(f'Processing import {import_id}')
+        return self.snipeItRequest("POST", f"/imports/process/{import_id}", json={
+            "import-type": "asset",
+            "import-update": update,
+            "send-welcome": False,
+            "run-backup": False,
+            "column-mappings": column_mappings,
+        })
 
-    def searchModel(self, model):
+    def searchModel(self, model, set_image=True):
+        """
+        Search models by name. When the first match has no image one is looked
+        up and set on it, unless set_image is False (read-only search).
+        """
         print('Requesting Snipe Model list')
         result = self.snipeItRequest("GET", "/models", params={
             "limit": "50", "offset": "0", "search": model, "sort": "created_at", "order": "asc"
@@ -60,6 +215,8 @@ class Snipe:
             print("Model was found.")
             model_data = jsonResult['rows'][0]
 
+            if not set_image:
+                return result
             if model_data['image'] is None:
                 print("The model does not have a picture. Let's set one.")
                 image_data_url = self.getImageForModel(model)
@@ -134,44 +291,103 @@ class Snipe:
                 print(Fore.RED + f"createAsset: API returned error: {result.get('messages', result)}" + Style.RESET_ALL)
                 return None
             print(f"createAsset: Successfully created, response: {result}")
+            self.assets.record_create(result, payload)
             return result
         except (ValueError, TypeError, AttributeError) as e:
             print(Fore.RED + f"createAsset: Failed to parse JSON: {e}, body: {response.text}" + Style.RESET_ALL)
             return None
 
-    def assignAsset(self, user, asset_id):
-        print('Assigning asset '+str(asset_id)+' to user '+user)
+    def findUser(self, user, raise_errors=False):
+        """
+        Look up a Snipe-IT user row by exact email match.
+
+        Results (including misses) are cached for the lifetime of the client,
+        so grouping many assets under one user costs a single search. A
+        failed search is not cached, so the next call asks again. It returns
+        None like a miss, or raises RuntimeError if raise_errors is set.
+        """
         email_to_match = user.lower()
+        with self._user_lock:
+            if email_to_match in self._user_cache:
+                return self._user_cache[email_to_match]
 
         payload = {
             "search": email_to_match,
             "limit": 10  # Increase in case multiple matches exist
         }
         response_obj = self.snipeItRequest("GET", "/users", params=payload)
-        if response_obj is None:
-            return
+        if not response_ok(response_obj):
+            if raise_errors:
+                status = response_obj.status_code if response_obj is not None else 'no response'
+                raise RuntimeError(f"User search for {email_to_match} failed: {status}")
+            return None
         response = response_obj.json()
         print(f"{response} Payload: {payload}")
-        if response['total'] == 0:
-            return
 
         # Find exact email match
-        user_row = next((row for row in response['rows'] if row['email'].lower() == email_to_match), None)
-
+        user_row = next((row for row in response.get('rows', []) if (row.get('email') or '').lower() == email_to_match), None)
         if not user_row:
             print(f"No exact match found for {email_to_match}")
+        with self._user_lock:
+            if user_row:
+                self._users_by_id[user_row['id']] = user_row
+            self._user_cache[email_to_match] = user_row
+        return user_row
+
+    def assignAsset(self, user, asset_id):
+        print('Assigning asset '+str(asset_id)+' to user '+user)
+        user_row = self.findUser(user)
+        if not user_row:
             return
+        return self.checkoutAsset(asset_id, user_row['id'])
 
+    def checkoutAsset(self, asset_id, user_id):
         payload = {
-            "assigned_user": user_row['id'],
+            "assigned_user": user_id,
             "checkout_to_type": "user"
         }
-        return self.snipeItRequest("POST", f"/hardware/{asset_id}/checkout", json=payload)
+        response = self.snipeItRequest("POST", f"/hardware/{asset_id}/checkout", json=payload)
+        if response_ok(response):
+            self.assets.record_checkout(asset_id, self._users_by_id.get(user_id, {'id': user_id}))
+        return response
+
+    def bulkCheckout(self, user_id, asset_ids):
+        """
+        Check out several assets to one user in a single request.
 
+        Stock Snipe-IT only exposes bulk checkout through the web UI, so this
+        is only called with bulk_checkout enabled, for instances that add the
+        API route. A 404/405 is remembered as unsupported.
+
+        Returns:
+            Response on success, or None if bulk checkout is not available
+            and the caller should fall back to checkoutAsset()
+        """
+        if not self.bulk_checkout_supported:
+            return None
+        payload = {
+            "selected_assets": list(asset_ids),
+            "assigned_user": user_id,
+            "checkout_to_type": "user"
+        }
+        response = self.snipeItRequest("POST", "/hardware/bulkcheckout", json=payload)
+        if response is not None and response.status_code in (404, 405):
+            print(Fore.YELLOW + "Bulk checkout is not available on this Snipe-IT instance, using per-asset checkout" + Style.RESET_ALL)
+            self.bulk_checkout_supported = False
+            return None
+        if response_ok(response):
+            with self._user_lock:
+                user_row = self._users_by_id.get(user_id, {'id': user_id})
+            for asset_id in asset_ids:
+                self.assets.record_checkout(asset_id, user_row)
+        return response
 
     def unasigneAsset(self, asset_id):
         print('Unassigning asset '+str(asset_id))
-        return self.snipeItRequest("POST", "/hardware/" + str(asset_id) + "/checkin")
+        response = self.snipeItRequest("POST", "/hardware/" + str(asset_id) + "/checkin")
+        if response_ok(response):
+            self.assets.record_checkin(asset_id)
+        return response
 
     def updateAsset(self, asset_id, payload, model_id=None):
         print('Updating asset ' + str(asset_id))
@@ -181,7 +397,10 @@ class Snipe:
         if model_id:
             payload['model_id'] = model_id  # Include model assignment
 
-        return self.snipeItRequest("PATCH", "/hardware/" + str(asset_id), json=payload)
+        response = self.snipeItRequest("PATCH", "/hardware/" + str(asset_id), json=payload)
+        if response_ok(response):
+            self.assets.record_update(asset_id, response.json(), payload)
+        return response
 
 
     def createMobileModel(self, model):
@@ -285,44 +504,59 @@ class Snipe:
 
         return finalPayload
 
-    def snipeItRequest(self, type, url, params=None, json=None):
+    def snipeItRequest(self, type, url, params=None, json=None, files=None):
+        """
+        Send a request, retrying rate limits, server errors and network errors.
+
+        Server and network errors back off from 5 seconds up to retry_delay
+        and count against the Snipe-IT circuit breaker. Once it opens, this
+        and every later call raise CircuitOpenError right away instead of
+        retrying.
+        """
         max_retries = 10
         retry_delay = 60  # seconds - matches Snipe-IT rate limit window
 
         for attempt in range(max_retries):
-            if self.request_count >= self.rate_limit:
-                print(Fore.YELLOW + "Max requests per minute reached. Sleeping for 60 seconds..." + Style.RESET_ALL)
-                time.sleep(60)
-                self.request_count = 0
+            probe = self.breaker.check()
+            backoff = min(retry_delay, 5 * 2 ** attempt)
 
             try:
-                self.request_count += 1
+                self._reserveRequest()
                 print(f'Sending {type} request to Snipe-IT: {url}')
 
                 if type == "GET":
-                    response = requests.get(self.url + url, headers=self.headers, params=params)
+                    response = self.session.get(self.url + url, headers=self.headers, params=params)
+                elif type == "POST" and files:
+                    # Let requests set the multipart content type and boundary
+                    headers = {key: value for key, value in self.headers.items() if key != "content-type"}
+                    response = self.session.post(self.url + url, headers=headers, files=files)
                 elif type == "POST":
-                    response = requests.post(self.url + url, headers=self.headers, json=json)
+                    response = self.session.post(self.url + url, headers=self.headers, json=json)
                 elif type == "PATCH":
-                    response = requests.patch(self.url + url, headers=self.headers, json=json)
+                    response = self.session.patch(self.url + url, headers=self.headers, json=json)
                 elif type == "DELETE":
-                    response = requests.delete(self.url + url, headers=self.headers)
+                    response = self.session.delete(self.url + url, headers=self.headers)
                 else:
                     print(Fore.RED + 'Unknown request type' + Style.RESET_ALL)
                     return None
 
                 if response.status_code == 429:
+                    # The server is up, it just wants us to slow down
+                    self.breaker.record_success()
                     print(Fore.YELLOW + f"Rate limited by server (429). Waiting {retry_delay} seconds before retrying..." + Style.RESET_ALL)
                     time.sleep(retry_delay)
                     continue
 
                 if response.status_code >= 500:
-                    print(Fore.RED + f"Server error {response.status_code}. Retrying in {retry_delay} seconds..." + Style.RESET_ALL)
+                    if self.breaker.record_failure(f"HTTP {response.status_code}"):
+                        raise CircuitOpenError(self.breaker)
+                    print(Fore.RED + f"Server error {response.status_code}. Retrying in {backoff} seconds..." + Style.RESET_ALL)
                     print(f"Response body: {response.text}")
-                    time.sleep(retry_delay)
-                    self.request_count = 0
+                    time.sleep(backoff)
                     continue
 
+                self.breaker.record_success()
+
                 if response.status_code >= 400:
                     print(Fore.RED + f"Client error {response.status_code}: {response.text}" + Style.RESET_ALL)
                     return response
@@ -330,8 +564,14 @@ class Snipe:
                 return response
 
             except requests.RequestException as e:
-                print(Fore.RED + f"Request failed (attempt {attempt + 1}/{max_retries}): {e}. Retrying in {retry_delay} seconds..." + Style.RESET_ALL)
-                time.sleep(retry_delay)
+                if self.breaker.record_failure(e):
+                    raise CircuitOpenError(self.breaker)
+                print(Fore.RED + f"Request failed (attempt {attempt + 1}/{max_retries}): {e}. Retrying in {backoff} seconds..." + Style.RESET_ALL)
+                time.sleep(backoff)
+            finally:
+                # A probe that ended without reporting (unknown request type,
+                # an unexpected exception) must not keep the breaker half-open
+                self.breaker.release(probe)
 
         print(Fore.RED + f"FATAL: Failed to complete request after {max_retries} attempts." + Style.RESET_ALL)
         print(Fore.RED + f"  URL: {self.url}{url}" + Style.RESET_ALL)
@@ -341,80 +581,48 @@ class Snipe:
         return None
 
 
-    def getImageForModel(self, model_number):
+    def getImageForModel(self, model_number, raise_errors=False):
+        """
+        AppleDB image for a model number as a data URL, or False. Lookup
+        errors are printed and return False, unless raise_errors is set.
+        """
         if not self.apple_image_check:
             print("Image checking is disabled.")
             return False
 
         print(f"Trying to look up model info from AppleDB: {model_number}")
         try:
-            response = requests.get("https://api.appledb.dev/device/main.json")
-            response.raise_for_status()
-            devices = response.json()
-
-            for device in devices:
-                identifiers = device.get("identifier", [])
-                device_maps = device.get("deviceMap", [])
-
-                if model_number in device_maps or model_number in identifiers:
-                    print(f"DEBUG: Found device in AppleDB: {device.get('name', 'Unknown')}")
-
-                    # Try to get image using imageKey (preferred) or key fallback
-                    image_key = device.get("imageKey") or device.get("key", model_number)
-                    print(f"DEBUG: Image key: {image_key}")
-
-                    colors = device.get("colors", [])
-                    print(f"DEBUG: Available colors: {colors}")
-
-                    if colors and isinstance(colors[0], dict) and "key" in colors[0]:
-                        color = colors[0]["key"]
-                    else:
-                        color = "Silver"
-                    print(f"DEBUG: Selected color: {color}")
-
-                    # Try multiple URL formats in order of preference
-                    image_urls = [
-                        f"https://img.appledb.dev/device@256/{image_key}/{color}.png",  # Original format
-                        f"https://img.appledb.dev/device/{image_key}/{color}.png",       # Without size
-                        f"https://img.appledb.dev/device@256/{image_key}.png",           # Without color
-                        f"https://img.appledb.dev/device/{image_key}.png",               # Simplest format
-                    ]
-
-                    for image_url in image_urls:
-                        try:
-                            print(f"Trying image URL: {image_url}")
-                            img_response = requests.get(image_url, timeout=5)
-                            if img_response.status_code == 200:
-                                print(f"Successfully fetched image from: {image_url}")
-                                base64encoded = base64.b64encode(img_response.content).decode("utf8")
-                                full_image_string = "data:image/png;name=image.png;base64," + base64encoded
-                                return full_image_string
-                            else:
-                                print(f"  404 - Image not found at {image_url}")
-                        except requests.exceptions.RequestException as e:
-                            print(f"  Error fetching {image_url}: {e}")
-                            continue
-
-                    print(f"Could not fetch image from any URL format for {model_number}")
-                    return False
-
-            print(f"No matching identifier or deviceMap found for {model_number}")
-            # Print sample device structure for debugging
-            if devices and len(devices) > 0:
-                print(f"DEBUG: Sample device structure (first device):")
-                print(f"  Keys: {list(devices[0].keys())}")
-                if 'identifier' in devices[0]:
-                    print(f"  identifier type: {type(devices[0]['identifier'])}, value: {devices[0]['identifier']}")
-                if 'deviceMap' in devices[0]:
-                    print(f"  deviceMap type: {type(devices[0]['deviceMap'])}, value: {devices[0]['deviceMap'][:100] if isinstance(devices[0]['deviceMap'], (list, str)) else devices[0]['deviceMap']}")
-
+            return appledb.get_index().image_for(model_number)
         except requests.exceptions.RequestException as e:
+            if raise_errors:
+                raise
             print(Fore.RED + f"Error getting image from AppleDB: {e}" + Style.RESET_ALL)
         except Exception as e:
+            if raise_errors:
+                raise
             print(Fore.RED + f"Unexpected error during AppleDB lookup: {e}" + Style.RESET_ALL)
 
         return False
 
+    def _reserveRequest(self):
+        """Count a request against the per-minute budget, sleeping if it is used up."""
+        if self.shared_limiter is not None:
+            self.shared_limiter.acquire()
+            return
+        while True:
+            wait = self.window.try_acquire()
+            if not wait:
+                return
+            print(Fore.YELLOW + f"Max requests per minute reached. Sleeping for {wait:.0f} seconds..." + Style.RESET_ALL)
+            time.sleep(wait)
+
+    @property
+    def request_count(self):
+        """Requests counted against this client's budget in the last minute."""
+        if self.shared_limiter is not None:
+            return self.shared_limiter.usage()['total']
+        return self.window.in_window()
+
 
 
     def setImageForModel(self, model_id, image_bytes):
@@ -433,7 +641,7 @@ class Snipe:
         }
 
         try:
-            response = requests.post(url, headers=headers, files=files)
+            response = self.session.post(url, headers=headers, files=files)
             response.raise_for_status()
             print(Fore.GREEN + f"Successfully uploaded image for model ID {model_id}" + Style.RESET_ALL)
             return response
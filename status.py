@@ -0,0 +1,319 @@
+"""
+Live run status for MosyleSnipeSync.
+The sync reports what it is doing (phase, tenant, device type, devices done
+out of the planned total) to the process-wide RunStatus, which adds the
+recent throughput, an ETA, how long ago the last device finished, the
+Snipe-IT rate budget left, the state of every circuit breaker and the
+summary of the last run. In daemon mode StatusServer serves it on a local
+port as JSON (/status) and Prometheus text (/metrics), so slow or stalled
+runs can be alerted on.
+
+Try it locally with:
+    curl http://127.0.0.1:9187/status
+"""
+import json
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+from breaker import all_breakers
+from logger_config import get_logger
+
+# Throughput is measured over the devices finished in this many seconds
+THROUGHPUT_WINDOW = 300
+
+METRIC_PREFIX = 'mosylesnipesync'
+
+IDLE = 'idle'
+
+
+class RunStatus:
+    """Thread-safe state of the current and last runs."""
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self._lock = threading.Lock()
+        # url -> (rate_limit, request window, shared limiter) of the latest Snipe client
+        self._rate_budgets = {}
+        self.runs_started = 0
+        self.last_runs = {}
+        self.next_run_at = None
+        self._reset(None)
+
+    def _reset(self, kind):
+        self.kind = kind
+        self.phase = IDLE if kind is None else 'starting'
+        self.started_at = self.clock() if kind is not None else None
+        self.tenants = {}
+        self.devices_total = 0
+        self.devices_done = 0
+        self.last_progress_at = self.started_at
+        # Devices are synced in worker processes this one cannot see
+        self.sharded = False
+        self._finished = deque()
+
+    def start_run(self, kind='sync'):
+        """A new run (sync, retry, event, onboard) begins; progress counters start over."""
+        with self._lock:
+            self._reset(kind)
+            self.runs_started += 1
+            self.next_run_at = None
+
+    def finish_run(self, summary=None):
+        """The current run ended; keep its summary as the last run of its kind."""
+        with self._lock:
+            now = self.clock()
+            if self.kind is not None:
+                self.last_runs[self.kind] = {
+                    'started_at': self.started_at,
+                    'finished_at': now,
+                    'duration': round(now - self.started_at, 3),
+                    'devices_done': None if self.sharded else self.devices_done,
+                    # Counts only; failed_devices can run into thousands of entries
+                    'summary': {key: value for key, value in summary.items() if not isinstance(value, list)}
+                    if summary else summary,
+                }
+            self._reset(None)
+
+    def set_phase(self, phase, tenant=None, device_type=None):
+        """What the run (or one tenant of it) is doing now."""
+        with self._lock:
+            self.phase = phase
+            if tenant is not None:
+                self.tenants[tenant] = {'phase': phase, 'device_type': device_type}
+
+    def set_sharded(self):
+        """
+        The run's devices are synced by shard worker processes. Device
+        progress, throughput, ETA and time since progress are not reported
+        for the rest of the run rather than reading as a stall.
+        """
+        with self._lock:
+            self.sharded = True
+
+    def set_next_run(self, timestamp):
+        with self._lock:
+            self.next_run_at = timestamp
+
+    def add_planned(self, count):
+        """Devices about to be synced, added to the run's total."""
+        with self._lock:
+            self.devices_total += count
+
+    def advance(self, count=1):
+        """Devices finished (synced, failed or skipped)."""
+        with self._lock:
+            now = self.clock()
+            self.devices_done += count
+            self.last_progress_at = now
+            self._finished.append((now, count))
+
+    def track_client(self, snipe):
+        """
+        Report the rate budget of this Snipe client (the latest one per URL).
+        Only the budget is kept, not the client, so finished clients and
+        their sessions can be freed.
+        """
+        with self._lock:
+            self._rate_budgets[snipe.url] = (snipe.rate_limit, snipe.window, snipe.shared_limiter)
+
+    def _throughput(self, now):
+        while self._finished and self._finished[0][0] < now - THROUGHPUT_WINDOW:
+            self._finished.popleft()
+        done = sum(count for _, count in self._finished)
+        if not done or self.started_at is None:
+            return 0.0
+        # Early in a run the window has not filled up yet
+        span = min(THROUGHPUT_WINDOW, max(1.0, now - self.started_at))
+        return done * 60.0 / span
+
+    @staticmethod
+    def _rate_limits(budgets):
+        # Called without the status lock: the shared limiter takes a file lock
+        limits = {}
+        for url, (rate_limit, window, shared_limiter) in budgets:
+            if shared_limiter is not None:
+                try:
+                    used = shared_limiter.usage()['total']
+                except OSError:
+                    continue
+                scope = 'host'
+            else:
+                # Requests sent in the last minute
+                used = window.in_window()
+                scope = 'process'
+            limits[url] = {'limit': rate_limit, 'used': used,
+                           'headroom': max(0, rate_limit - used), 'scope': scope}
+        return limits
+
+    def snapshot(self):
+        """Everything reported by /status, as a JSON-serializable dict."""
+        with self._lock:
+            now = self.clock()
+            throughput = self._throughput(now)
+            remaining = max(0, self.devices_total - self.devices_done)
+            progress = {
+                'devices_done': self.devices_done,
+                'devices_total': self.devices_total,
+                'devices_remaining': remaining,
+                'throughput_per_minute': round(throughput, 2),
+                'eta_seconds': round(remaining * 60.0 / throughput) if throughput and remaining else None,
+                'seconds_since_progress': round(now - self.last_progress_at, 3) if self.last_progress_at else None,
+            }
+            if self.sharded:
+                progress = dict.fromkeys(progress)
+            status = {
+                'time': now,
+                'run': {
+                    'active': self.kind is not None,
+                    'kind': self.kind,
+                    'number': self.runs_started,
+                    'phase': self.phase,
+                    'tenants': dict(self.tenants),
+                    'started_at': self.started_at,
+                    'elapsed': round(now - self.started_at, 3) if self.started_at else None,
+                    'sharded': self.sharded,
+                    **progress,
+                },
+                'next_run_at': self.next_run_at,
+                'last_runs': dict(self.last_runs),
+            }
+            budgets = list(self._rate_budgets.items())
+        status['rate_limits'] = self._rate_limits(budgets)
+        status['breakers'] = {name: breaker.status() for name, breaker in sorted(all_breakers().items())}
+        return status
+
+
+_status = RunStatus()
+
+
+def get_status():
+    """Return the process-wide RunStatus."""
+    return _status
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + '}'
+
+
+def format_metrics(status):
+    """Render a RunStatus.snapshot() as Prometheus text exposition."""
+    # name -> (help, type, samples); every sample of a metric must follow its header
+    families = {}
+
+    def metric(name, value, help_text, labels=None, kind='gauge'):
+        if value is None:
+            return
+        name = f'{METRIC_PREFIX}_{name}'
+        family = families.setdefault(name, (help_text, kind, []))
+        value = value if isinstance(value, int) else repr(float(value))
+        family[2].append(f'{name}{_labels(labels)} {value}')
+
+    run = status['run']
+    metric('run_active', int(run['active']), 'Whether a run is in progress.')
+    metric('runs_started_total', run['number'], 'Runs started by this process.', kind='counter')
+    metric('run_info', 1, 'Kind and phase of the current run.',
+           {'kind': run['kind'] or '', 'phase': run['phase']})
+    for tenant, state in sorted(run['tenants'].items()):
+        metric('tenant_phase_info', 1, 'Phase and device type of each tenant in the current run.',
+               {'tenant': tenant, 'phase': state['phase'], 'device_type': state['device_type'] or ''})
+    metric('run_sharded', int(run['sharded']), 'Whether the current run syncs its devices in shard workers.')
+    metric('run_elapsed_seconds', run['elapsed'], 'Seconds since the current run started.')
+    metric('run_devices_done', run['devices_done'], 'Devices finished in the current run.')
+    metric('run_devices_total', run['devices_total'], 'Devices planned so far in the current run.')
+    metric('run_devices_remaining', run['devices_remaining'], 'Planned devices not finished yet.')
+    metric('run_throughput_devices_per_minute', run['throughput_per_minute'],
+           f'Devices finished per minute over the last {THROUGHPUT_WINDOW} seconds.')
+    metric('run_eta_seconds', run['eta_seconds'], 'Estimated seconds until the planned devices are done.')
+    metric('run_seconds_since_progress', run['seconds_since_progress'],
+           'Seconds since the last device finished (or the run started).')
+    metric('next_run_timestamp_seconds', status['next_run_at'], 'When the daemon starts its next run.')
+
+    for url, limit in sorted(status['rate_limits'].items()):
+        labels = {'url': url, 'scope': limit['scope']}
+        metric('rate_limit_requests', limit['limit'], 'Snipe-IT requests allowed per minute.', labels)
+        metric('rate_limit_used_requests', limit['used'], 'Snipe-IT requests sent in the last minute.', labels)
+        metric('rate_limit_headroom_requests', limit['headroom'], 'Snipe-IT requests left in the current budget.', labels)
+
+    for name, breaker in status['breakers'].items():
+        labels = {'upstream': name}
+        metric('breaker_open', int(breaker['state'] != 'closed'), 'Whether a circuit breaker is open or half-open.', labels)
+        metric('breaker_consecutive_failures', breaker['failures'], 'Consecutive failures counted by a breaker.', labels)
+        metric('breaker_opened_total', breaker['times_opened'], 'Times a breaker has opened.', labels, kind='counter')
+        metric('breaker_rejected_total', breaker['rejected'], 'Calls refused by an open breaker.', labels, kind='counter')
+
+    for kind, last in sorted(status['last_runs'].items()):
+        labels = {'kind': kind}
+        metric('last_run_finished_timestamp_seconds', last['finished_at'], 'When the last run of a kind finished.', labels)
+        metric('last_run_duration_seconds', last['duration'], 'Duration of the last run of a kind.', labels)
+        summary = last['summary'] or {}
+        metric('last_run_aborted', int(bool(summary.get('aborted'))), 'Whether the last run of a kind was aborted.', labels)
+        for key, value in sorted(summary.items()):
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                metric(f'last_run_{key}', value, f'{key} in the summary of the last run of a kind.', labels)
+
+    lines = []
+    for name, (help_text, kind, samples) in families.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        lines.extend(samples)
+    return '\n'.join(lines) + '\n'
+
+
+class _StatusHandler(BaseHTTPRequestHandler):
+    server_version = "MosyleSnipeSync"
+
+    def log_message(self, format, *args):
+        get_logger().debug("status: " + format % args)
+
+    def _send(self, status, body, content_type):
+        data = body.encode("utf8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        status = self.server.status
+        if path == "/status":
+            self._send(200, json.dumps(status.snapshot(), indent=1, default=str), "application/json")
+        elif path == "/metrics":
+            self._send(200, format_metrics(status.snapshot()), "text/plain; version=0.0.4; charset=utf-8")
+        elif path == "/health":
+            self._send(200, json.dumps({"status": "ok"}), "application/json")
+        else:
+            self._send(404, json.dumps({"error": "not found"}), "application/json")
+
+
+class StatusServer:
+    """HTTP listener serving a RunStatus as /status (JSON) and /metrics (Prometheus)."""
+
+    def __init__(self, status=None, host="127.0.0.1", port=9187):
+        self.httpd = ThreadingHTTPServer((host, port), _StatusHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.status = status or get_status()
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="status-http", daemon=True)
+
+    @property
+    def address(self):
+        return self.httpd.server_address
+
+    def start(self):
+        logger = get_logger()
+        self._thread.start()
+        host, port = self.address[:2]
+        logger.info(f"Status endpoint listening on http://{host}:{port}/status and /metrics")
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
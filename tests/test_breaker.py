@@ -0,0 +1,162 @@
+"""
+Tests for the circuit breaker state machine in breaker.py.
+
+Run from the repository root with:
+    python3 -m unittest discover tests
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import breaker  # noqa: E402
+from breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError  # noqa: E402
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class CircuitBreakerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.breaker = CircuitBreaker('test', failure_threshold=3, reset_timeout=10, max_reset_timeout=40,
+                                      clock=self.clock)
+
+    def open_breaker(self):
+        for _ in range(3):
+            self.breaker.record_failure('HTTP 503')
+        self.assertEqual(self.breaker.state, OPEN)
+
+    def test_opens_after_consecutive_failures(self):
+        self.breaker.record_failure('HTTP 503')
+        self.breaker.record_failure('HTTP 503')
+        self.breaker.record_success()
+        self.breaker.record_failure('HTTP 503')
+        self.breaker.record_failure('HTTP 503')
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.assertTrue(self.breaker.record_failure('HTTP 503'))
+        self.assertEqual(self.breaker.state, OPEN)
+        self.assertEqual(self.breaker.last_error, 'HTTP 503')
+
+    def test_open_refuses_calls_until_reset_timeout(self):
+        self.open_breaker()
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.check()
+        self.assertEqual(self.breaker.rejected, 1)
+        self.assertEqual(self.breaker.retry_after(), 10)
+        self.clock.now += 10
+        self.assertTrue(self.breaker.check())
+        self.assertEqual(self.breaker.state, HALF_OPEN)
+
+    def test_half_open_allows_a_single_probe(self):
+        self.open_breaker()
+        self.clock.now += 10
+        self.assertTrue(self.breaker.allow())
+        self.assertFalse(self.breaker.allow())
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.assertIs(self.breaker.check(), False)
+
+    def test_failed_probe_doubles_the_timeout(self):
+        self.open_breaker()
+        for expected in (20, 40, 40):
+            self.clock.now += self.breaker.retry_after()
+            self.assertTrue(self.breaker.check())
+            self.assertTrue(self.breaker.record_failure('timeout'))
+            self.assertEqual(self.breaker.retry_after(), expected)
+        self.clock.now += 40
+        self.breaker.check()
+        self.breaker.record_success()
+        self.open_breaker()
+        self.assertEqual(self.breaker.retry_after(), 10)
+
+    def test_released_probe_frees_the_slot(self):
+        self.open_breaker()
+        self.clock.now += 10
+        probe = self.breaker.check()
+        self.assertFalse(self.breaker.allow())
+        self.breaker.release(probe)
+        self.assertEqual(self.breaker.state, HALF_OPEN)
+        self.assertTrue(self.breaker.check())
+
+    def test_release_of_a_normal_call_keeps_the_probe(self):
+        call = self.breaker.check()
+        self.open_breaker()
+        self.clock.now += 10
+        self.breaker.check()
+        self.breaker.release(call)
+        self.assertFalse(self.breaker.allow())
+
+    def test_release_after_reporting_is_a_no_op(self):
+        self.open_breaker()
+        self.clock.now += 10
+        probe = self.breaker.check()
+        self.breaker.record_failure('HTTP 502')
+        self.breaker.release(probe)
+        self.assertEqual(self.breaker.state, OPEN)
+
+    def test_stale_probe_is_given_up_after_reset_timeout(self):
+        self.open_breaker()
+        self.clock.now += 10
+        self.breaker.check()
+        self.clock.now += 9
+        self.assertFalse(self.breaker.allow())
+        self.clock.now += 1
+        self.assertTrue(self.breaker.check())
+        self.assertFalse(self.breaker.allow())
+
+
+class ConfigureTest(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = (dict(breaker._breakers), dict(breaker._settings), dict(breaker.DEFAULTS))
+        breaker._breakers.clear()
+        breaker._settings.clear()
+
+    def tearDown(self):
+        breakers, settings, defaults = self.saved
+        breaker._breakers.clear()
+        breaker._breakers.update(breakers)
+        breaker._settings.clear()
+        breaker._settings.update(settings)
+        self.assertEqual(breaker.DEFAULTS, defaults)
+
+    def test_configure_applies_to_existing_and_new_breakers(self):
+        snipe = breaker.get_breaker('Snipe-IT', 'https://snipe.example/api/v1')
+        breaker.configure(failure_threshold=2, reset_timeout=30)
+        mosyle = breaker.get_breaker('Mosyle', 'https://mosyle.example/v2')
+        for instance in (snipe, mosyle):
+            self.assertEqual(instance.failure_threshold, 2)
+            self.assertEqual(instance.reset_timeout, 30)
+        self.assertEqual(breaker.DEFAULTS['failure_threshold'], 5)
+
+    def test_configure_one_upstream(self):
+        snipe = breaker.get_breaker('Snipe-IT', 'https://snipe.example/api/v1')
+        mosyle = breaker.get_breaker('Mosyle', 'https://mosyle.example/v2')
+        breaker.configure('Mosyle', failure_threshold=9)
+        self.assertEqual(mosyle.failure_threshold, 9)
+        self.assertEqual(snipe.failure_threshold, breaker.DEFAULTS['failure_threshold'])
+        self.assertEqual(breaker.get_breaker('Mosyle', 'https://other.example/v2').failure_threshold, 9)
+
+    def test_configure_rejects_unknown_settings(self):
+        with self.assertRaises(TypeError):
+            breaker.configure(threshold=3)
+
+    def test_breakers_are_shared_per_upstream_and_url(self):
+        first = breaker.get_breaker('Snipe-IT', 'https://a.example/api/v1')
+        self.assertIs(breaker.get_breaker('Snipe-IT', 'https://a.example/api/v1'), first)
+        second = breaker.get_breaker('Snipe-IT', 'https://b.example/api/v1')
+        self.assertIsNot(second, first)
+        self.assertEqual(first.name, 'Snipe-IT')
+        self.assertEqual(second.name, 'Snipe-IT (https://b.example/api/v1)')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+"""
+Tests for the streaming JSON array parser in jsonstream.py.
+
+Run from the repository root with:
+    python3 -m unittest discover tests
+"""
+import json
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import jsonstream  # noqa: E402
+
+DEVICES = [
+    {'serial_number': 'C02XXXXXXXXX', 'os': 'mac', 'battery': 0.97, 'storage': 256e9, 'tags': ['a', 'b']},
+    {'serial_number': 'DMPXXXXXXXXX', 'os': 'ios', 'device_name': 'Zoë’s iPad ✓', 'battery': -1, 'enrolled': True},
+    {'serial_number': 'F9FXXXXXXXXX', 'os': 'tvos', 'nested': {'deep': [1, {'x': None}]}, 'count': 12345678901234},
+]
+PAGE = json.dumps({'status': 'OK', 'response': {'rows': 3, 'devices': DEVICES, 'page': 1}}).encode('utf8')
+
+
+def chunked(data, size):
+    return [data[start:start + size] for start in range(0, len(data), size)]
+
+
+class StdlibParserTest(unittest.TestCase):
+
+    def parse(self, chunks, path=('response', 'devices'), header=None):
+        return list(jsonstream._iter_stdlib(chunks, path, header))
+
+    def test_items_survive_every_chunk_boundary(self):
+        # Splits land inside strings, multi-byte UTF-8 characters, numbers and literals
+        for size in range(1, 40):
+            with self.subTest(size=size):
+                self.assertEqual(self.parse(chunked(PAGE, size)), DEVICES)
+
+    def test_numbers_split_at_the_end_of_a_chunk(self):
+        data = b'[1.5, 2e10, -3, 12345]'
+        for split in range(1, len(data)):
+            with self.subTest(split=split):
+                self.assertEqual(self.parse([data[:split], data[split:]], path=()), [1.5, 2e10, -3, 12345])
+
+    def test_top_level_array_and_empty_chunks(self):
+        self.assertEqual(self.parse([b'', b'[{"a": 1},', b'', b' {"a": 2}]', b''], path=()), [{'a': 1}, {'a': 2}])
+        self.assertEqual(self.parse([b'[ ]'], path=()), [])
+
+    def test_missing_path_yields_nothing(self):
+        self.assertEqual(self.parse([b'{"status": "OK", "response": {"rows": 0}}']), [])
+        self.assertEqual(self.parse([b'{"status": "OK", "response": null}']), [])
+        self.assertEqual(self.parse([b'[]']), [])
+
+    def test_header_holds_scalars_before_and_after_the_array(self):
+        header = {}
+        body = b'{"status": "OK", "response": {"devices": [{"a": 1}]}, "info": "done", "meta": {"x": 1}}'
+        for size in (1, 7, len(body)):
+            header.clear()
+            self.assertEqual(self.parse(chunked(body, size), header=header), [{'a': 1}])
+            self.assertEqual(header, {'status': 'OK', 'info': 'done'})
+
+    def test_header_of_an_error_body(self):
+        header = {}
+        self.assertEqual(self.parse([b'{"status": "ERROR", "message": "Invalid accessToken"}'], header=header), [])
+        self.assertEqual(header, {'status': 'ERROR', 'message': 'Invalid accessToken'})
+
+    def test_truncated_body_raises(self):
+        for cut in (len(PAGE) // 2, PAGE.index(b'DMP')):
+            with self.subTest(cut=cut), self.assertRaises(jsonstream.DECODE_ERRORS):
+                self.parse(chunked(PAGE[:cut], 16))
+
+    def test_truncated_after_the_array_raises_with_a_header(self):
+        with self.assertRaises(jsonstream.DECODE_ERRORS):
+            self.parse([PAGE[:-3]], header={})
+
+    def test_garbage_between_items_raises(self):
+        with self.assertRaises(ValueError):
+            self.parse([b'[{"a": 1} {"a": 2}]'], path=())
+
+
+@unittest.skipIf(jsonstream.ijson is None, "ijson is not installed")
+class IjsonParserTest(unittest.TestCase):
+
+    def test_read_zero_does_not_drop_a_chunk(self):
+        self.assertEqual(list(jsonstream.iter_array([PAGE], ('response', 'devices'))), DEVICES)
+
+    def test_matches_the_stdlib_parser(self):
+        for size in (1, 13, 4096):
+            stdlib_header, ijson_header = {}, {}
+            stdlib = list(jsonstream._iter_stdlib(chunked(PAGE, size), ('response', 'devices'), stdlib_header))
+            items = list(jsonstream.iter_array(chunked(PAGE, size), ('response', 'devices'), ijson_header))
+            self.assertEqual(items, stdlib)
+            self.assertEqual(ijson_header, stdlib_header)
+
+
+if __name__ == '__main__':
+    unittest.main()
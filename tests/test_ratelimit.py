@@ -0,0 +1,104 @@
+"""
+Tests for the shared Snipe-IT rate budget in ratelimit.py.
+
+Run from the repository root with:
+    python3 -m unittest discover tests
+"""
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from ratelimit import MAX_POLL_INTERVAL, SharedRateLimiter  # noqa: E402
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class SharedRateLimiterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def limiter(self, process, rate_limit=10):
+        limiter = SharedRateLimiter(self.tmp.name, 'https://snipe.example.com key', rate_limit,
+                                    clock=self.clock, sleep=self.clock.sleep)
+        # Processes of other hosts are never checked for liveness
+        limiter._me = process
+        return limiter
+
+    def send(self, limiter, count):
+        return [limiter._try_acquire() for _ in range(count)]
+
+    def test_budget_is_shared_between_processes(self):
+        first, second = self.limiter('host-a:1'), self.limiter('host-b:1')
+        self.assertEqual(self.send(first, 6), [0] * 6)
+        self.assertEqual(self.send(second, 4), [0] * 4)
+        self.assertGreater(first._try_acquire(), 0)
+        self.assertGreater(second._try_acquire(), 0)
+        self.assertEqual(first.usage(), {'total': 10, 'processes': {'host-a:1': 6, 'host-b:1': 4}})
+
+    def test_waiting_process_gets_its_share(self):
+        first, second = self.limiter('host-a:1'), self.limiter('host-b:1')
+        self.assertEqual(self.send(first, 10), [0] * 10)
+        # Both keep polling, at least every MAX_POLL_INTERVAL, until the window moves on
+        for _ in range(61):
+            self.assertGreater(second._try_acquire(), 0)
+            self.assertGreater(first._try_acquire(), 0)
+            self.clock.now += 1
+        # The window is empty again, but the second process is still waiting
+        self.assertEqual(self.send(first, 5), [0] * 5)
+        self.assertEqual(first._try_acquire(), MAX_POLL_INTERVAL)
+        self.assertEqual(self.send(second, 5), [0] * 5)
+        self.assertGreater(second._try_acquire(), 0)
+
+    def test_unused_share_goes_to_the_others(self):
+        first, second = self.limiter('host-a:1'), self.limiter('host-b:1')
+        self.assertEqual(self.send(second, 1), [0])
+        self.assertEqual(self.send(first, 9), [0] * 9)
+
+    def test_acquire_waits_for_the_window(self):
+        limiter = self.limiter('host-a:1', rate_limit=3)
+        for _ in range(4):
+            limiter.acquire()
+        self.assertGreaterEqual(self.clock.now, 1000.0 + 60)
+        self.assertEqual(limiter.usage()['total'], 1)
+
+    def test_idle_processes_are_dropped(self):
+        first, second = self.limiter('host-a:1'), self.limiter('host-b:1')
+        self.send(second, 3)
+        self.clock.now += 61
+        first._try_acquire()
+        self.assertEqual(set(json.loads(first.path.read_text())['processes']), {'host-a:1'})
+
+    def test_dead_processes_on_this_host_are_dropped(self):
+        process = subprocess.Popen([sys.executable, '-c', ''])
+        process.wait()
+        dead = self.limiter(f"{socket.gethostname()}:{process.pid}")
+        alive = self.limiter(f"{socket.gethostname()}:{os.getpid()}")
+        self.send(dead, 5)
+        dead._try_acquire()
+        self.assertEqual(alive._try_acquire(), 0)
+        processes = json.loads(alive.path.read_text())['processes']
+        self.assertEqual(set(processes), {alive._me})
+
+
+if __name__ == '__main__':
+    unittest.main()
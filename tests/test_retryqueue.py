@@ -0,0 +1,85 @@
+"""
+Tests for the dead-letter retry queue in retryqueue.py.
+
+Run from the repository root with:
+    python3 -m unittest discover tests
+"""
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from retryqueue import SKIPPED_STEP, RetryQueue  # noqa: E402
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def failure(serial, step='checkout', device_type='ios'):
+    return {'serial': serial, 'device_type': device_type, 'step': step,
+            'error_class': 'HTTPError', 'error': '503 Service Unavailable'}
+
+
+class RetryQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.queue = RetryQueue(self.tmp.name, max_attempts=4, base_delay=300, max_delay=1000, clock=self.clock)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def fail(self, *serials, step='checkout'):
+        self.queue.update('default', [failure(serial, step) for serial in serials])
+
+    def test_delay_doubles_up_to_max_delay(self):
+        self.assertEqual([self.queue.delay_for(n) for n in range(1, 6)], [300, 600, 1000, 1000, 1000])
+
+    def test_entry_is_due_only_after_its_backoff(self):
+        self.fail('A')
+        self.assertEqual(self.queue.due(), {})
+        self.clock.now += 299
+        self.assertEqual(self.queue.due(), {})
+        self.clock.now += 1
+        self.assertEqual(self.queue.due(), {'default': {'ios': {'A'}}})
+        self.fail('A')
+        self.assertEqual(self.queue.entries()[0]['next_attempt'], self.clock.now + 600)
+        self.assertEqual(self.queue.due(), {})
+        self.assertEqual(self.queue.due(ignore_backoff=True), {'default': {'ios': {'A'}}})
+
+    def test_exhausted_entries_are_kept_but_not_retried(self):
+        for _ in range(4):
+            self.fail('A')
+        self.clock.now += 10000
+        self.assertEqual(self.queue.due(), {})
+        self.assertEqual([entry['serial'] for entry in self.queue.exhausted()], ['A'])
+
+    def test_skipped_devices_do_not_use_an_attempt(self):
+        self.fail('A', step=SKIPPED_STEP)
+        entry = self.queue.entries()[0]
+        self.assertEqual(entry['attempts'], 0)
+        self.assertEqual(self.queue.due(), {'default': {'ios': {'A'}}})
+
+    def test_success_removes_the_entry(self):
+        self.fail('A', 'B')
+        self.assertEqual(self.queue.update('default', [], ['A', 'C']), (0, 1))
+        self.assertEqual(self.queue.remove('default', ['B']), 1)
+        self.assertEqual(self.queue.entries(), [])
+
+    def test_state_persists_across_instances(self):
+        self.fail('A')
+        other = RetryQueue(self.tmp.name, clock=self.clock)
+        self.assertEqual(other.entries()[0]['attempts'], 1)
+        self.assertEqual(other.due(tenant='other', ignore_backoff=True), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
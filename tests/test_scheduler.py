@@ -0,0 +1,136 @@
+"""
+Tests for the adaptive daemon schedule in scheduler.py.
+
+Run from the repository root with:
+    python3 -m unittest discover tests
+"""
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from scheduler import AdaptiveScheduler  # noqa: E402
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def summary(**changes_by_type):
+    return {'changes_by_type': changes_by_type}
+
+
+class IntervalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.scheduler = AdaptiveScheduler(3600, jitter=0, busy_changes=50, clock=self.clock)
+
+    def run_once(self, result):
+        started = self.clock.now
+        self.clock.now += 60
+        self.scheduler.record_run(started, result)
+
+    def test_quiet_runs_stretch_the_period_up_to_max_interval(self):
+        for expected in (7200, 14400, 14400):
+            self.run_once(summary(mac=0, ios=0))
+            self.assertEqual(self.scheduler.period, expected)
+
+    def test_busy_runs_tighten_the_period_down_to_min_interval(self):
+        for expected in (1800, 900, 900):
+            self.run_once(summary(mac=30, ios=20))
+            self.assertEqual(self.scheduler.period, expected)
+
+    def test_ordinary_runs_move_back_towards_interval(self):
+        self.run_once(summary(ios=0))
+        self.run_once(summary(ios=0))
+        self.assertEqual(self.scheduler.period, 14400)
+        self.run_once(summary(ios=10))
+        self.assertEqual(self.scheduler.period, 7200)
+        self.run_once(summary(ios=10))
+        self.assertEqual(self.scheduler.period, 3600)
+        self.run_once(summary(ios=100))
+        self.run_once(summary(ios=10))
+        self.assertEqual(self.scheduler.period, 3600)
+
+    def test_failed_run_keeps_the_period(self):
+        self.run_once(summary(ios=0))
+        self.run_once(None)
+        self.assertEqual(self.scheduler.period, 7200)
+
+    def test_not_adaptive_keeps_the_interval(self):
+        scheduler = AdaptiveScheduler(3600, jitter=0, adaptive=False, clock=self.clock)
+        scheduler.record_run(self.clock.now, summary(ios=0))
+        self.assertEqual(scheduler.period, 3600)
+        self.assertEqual(scheduler.plan_device_types(['mac', 'ios']), ['mac', 'ios'])
+
+
+class StartTimeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+
+    def test_starts_stay_on_a_fixed_rate_grid(self):
+        scheduler = AdaptiveScheduler(3600, jitter=0, adaptive=False, clock=self.clock)
+        scheduler.record_run(1000.0, summary(ios=5))
+        self.assertEqual(scheduler.next_start, 4600.0)
+        # A run that took 20 minutes does not push the next slot back
+        self.clock.now = 4600.0 + 1200
+        scheduler.record_run(4600.0, summary(ios=5))
+        self.assertEqual(scheduler.next_start, 8200.0)
+        self.assertEqual(scheduler.delay(), 8200.0 - 5800.0)
+
+    def test_overrun_starts_the_next_run_right_away(self):
+        scheduler = AdaptiveScheduler(3600, jitter=0, adaptive=False, clock=self.clock)
+        self.clock.now = 1000.0 + 5000
+        scheduler.record_run(1000.0, summary(ios=5))
+        self.assertEqual(scheduler.next_start, 6000.0)
+        self.assertEqual(scheduler.delay(), 0)
+
+    def test_jitter_is_bounded_by_half_the_period(self):
+        scheduler = AdaptiveScheduler(100, min_interval=60, jitter=600, adaptive=False,
+                                      clock=self.clock, rng=random.Random(1))
+        scheduler.record_run(self.clock.now, summary(ios=5))
+        for _ in range(50):
+            self.assertTrue(50 <= scheduler.delay() <= 150)
+
+    def test_no_delay_before_the_first_run(self):
+        self.assertEqual(AdaptiveScheduler(3600, clock=self.clock).delay(), 0)
+
+
+class DeviceTypeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.scheduler = AdaptiveScheduler(3600, jitter=0, max_skips=2, clock=self.clock)
+        self.types = ['mac', 'ios', 'tvos']
+
+    def test_first_run_covers_every_type(self):
+        self.assertEqual(self.scheduler.plan_device_types(self.types), self.types)
+
+    def test_quiet_type_is_skipped_at_most_max_skips_runs_in_a_row(self):
+        self.scheduler.record_run(self.clock.now, summary(mac=3, ios=0, tvos=2))
+        planned = [self.scheduler.plan_device_types(self.types) for _ in range(4)]
+        self.assertEqual(planned, [['mac', 'tvos'], ['mac', 'tvos'], self.types, ['mac', 'tvos']])
+
+    def test_type_with_changes_is_planned_again(self):
+        self.scheduler.record_run(self.clock.now, summary(mac=3, ios=0, tvos=2))
+        self.assertEqual(self.scheduler.plan_device_types(self.types), ['mac', 'tvos'])
+        self.scheduler.record_run(self.clock.now, summary(mac=3, tvos=2))
+        self.scheduler.plan_device_types(self.types)
+        self.scheduler.record_run(self.clock.now, summary(mac=3, ios=4, tvos=2))
+        self.assertEqual(self.scheduler.plan_device_types(self.types), self.types)
+
+    def test_all_quiet_falls_back_to_a_full_run(self):
+        self.scheduler.record_run(self.clock.now, summary(mac=0, ios=0, tvos=0))
+        self.assertEqual(self.scheduler.plan_device_types(self.types), self.types)
+
+
+if __name__ == '__main__':
+    unittest.main()
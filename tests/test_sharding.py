@@ -0,0 +1,75 @@
+"""
+Tests for the shard helpers in sharding.py.
+
+Run from the repository root with:
+    python3 -m unittest discover tests
+"""
+import os
+import sys
+import tempfile
+import unittest
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from sharding import ShardLease, merge_summaries, parse_shard, shard_for  # noqa: E402
+
+
+class ParseShardTest(unittest.TestCase):
+
+    def test_valid_specs(self):
+        self.assertEqual(parse_shard('0/1'), (0, 1))
+        self.assertEqual(parse_shard('2/8'), (2, 8))
+        self.assertEqual(parse_shard(' 3 / 4 '), (3, 4))
+
+    def test_invalid_specs(self):
+        for value in ('', '2', '2/8/1', 'a/b', '1.5/4', '4/4', '-1/4', '0/0', '1/-2'):
+            with self.subTest(value=value), self.assertRaises(ValueError):
+                parse_shard(value)
+
+
+class ShardForTest(unittest.TestCase):
+
+    def test_is_stable_and_ignores_case_and_whitespace(self):
+        self.assertEqual(shard_for('C02XYZ123ABC', 8), shard_for(' c02xyz123abc\n', 8))
+        # crc32 does not depend on PYTHONHASHSEED, so hosts and runs agree
+        self.assertEqual(shard_for('C02XYZ123ABC', 8), 7)
+
+    def test_single_shard_and_missing_serial(self):
+        self.assertEqual(shard_for('C02XYZ123ABC', 1), 0)
+        self.assertEqual(shard_for('', 8), 0)
+        self.assertEqual(shard_for(None, 8), 0)
+
+    def test_serials_spread_over_every_shard(self):
+        counts = Counter(shard_for(f"SERIAL{n:06d}", 4) for n in range(4000))
+        self.assertEqual(sorted(counts), [0, 1, 2, 3])
+        for count in counts.values():
+            self.assertTrue(800 < count < 1200)
+
+
+class ShardLeaseTest(unittest.TestCase):
+
+    def test_lease_is_exclusive_until_released(self):
+        with tempfile.TemporaryDirectory() as state_dir:
+            first = ShardLease(state_dir, 0, 2)
+            self.assertTrue(first.acquire())
+            self.assertFalse(ShardLease(state_dir, 0, 2).acquire())
+            self.assertTrue(ShardLease(state_dir, 1, 2).acquire())
+            self.assertEqual(first.holder()['pid'], os.getpid())
+            first.release()
+            self.assertTrue(ShardLease(state_dir, 0, 2).acquire())
+
+
+class MergeSummariesTest(unittest.TestCase):
+
+    def test_sums_numbers_and_nested_counts(self):
+        merged = merge_summaries([
+            {'processed': 3, 'shard': [0, 2], 'dry_run': False, 'errors': {'Timeout': 1}},
+            None,
+            {'processed': 4, 'shard': [1, 2], 'errors': {'Timeout': 2, 'HTTPError': 1}, 'tenant': 'x'},
+        ])
+        self.assertEqual(merged, {'processed': 7, 'errors': {'Timeout': 3, 'HTTPError': 1}})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,246 @@
+"""
+Webhook receiver for MosyleSnipeSync.
+A small HTTP listener for Mosyle device events (enrollment, device info
+changes, user assignment). Serial numbers from incoming events are debounced
+into batches and handed to a callback, which in daemon mode runs the normal
+per-device sync for just those devices.
+
+Try it locally with:
+    curl -X POST http://127.0.0.1:8787/webhook \\
+         -H 'Content-Type: application/json' \\
+         -d '{"event": "device_enrolled", "data": {"serial_number": "C02XXXXXXXXX", "os": "mac"}}'
+"""
+import hmac
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from logger_config import get_logger
+
+# Keys Mosyle uses for the serial number and platform across event types
+SERIAL_KEYS = ('serial_number', 'serialnumber', 'serial', 'SerialNumber')
+OS_KEYS = ('os', 'device_type', 'platform')
+KNOWN_OS = ('mac', 'ios', 'tvos')
+
+# Reject request bodies larger than this many bytes
+MAX_BODY_BYTES = 1024 * 1024
+
+# Seconds a client may take to send its request before the connection is dropped
+REQUEST_TIMEOUT = 30
+
+
+def extract_devices(payload):
+    """
+    Pull (serial, os) pairs out of a webhook payload.
+
+    Mosyle event bodies differ per event type, so the payload is walked
+    recursively and any object carrying a serial number is taken as a
+    device. os is None when the event does not say which platform it is.
+    """
+    found = []
+
+    def walk(node, inherited_os):
+        if isinstance(node, list):
+            for item in node:
+                walk(item, inherited_os)
+            return
+        if not isinstance(node, dict):
+            return
+
+        device_os = inherited_os
+        for key in OS_KEYS:
+            value = node.get(key)
+            if isinstance(value, str) and value.lower() in KNOWN_OS:
+                device_os = value.lower()
+                break
+
+        for key in SERIAL_KEYS:
+            value = node.get(key)
+            if isinstance(value, str) and value.strip():
+                found.append((value.strip(), device_os))
+                break
+
+        for value in node.values():
+            if isinstance(value, (dict, list)):
+                walk(value, device_os)
+
+    walk(payload, None)
+    return found
+
+
+class EventDebouncer:
+    """
+    Collect serials from events and flush them to a callback in batches.
+
+    A batch is flushed once no new event has arrived for `delay` seconds, or
+    `max_delay` seconds after its first event, whichever comes first, so a
+    burst of enrollments becomes one sync instead of hundreds.
+    """
+
+    def __init__(self, callback, delay=30, max_delay=300, clock=time.monotonic):
+        self.callback = callback
+        self.delay = delay
+        self.max_delay = max_delay
+        self.clock = clock
+        self._pending = {}
+        self._first_event = None
+        self._last_event = None
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="webhook-debouncer", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        self._thread.join(timeout=5)
+
+    def add(self, serial, device_os=None):
+        """Queue a serial for the next batch."""
+        with self._condition:
+            now = self.clock()
+            if not self._pending:
+                self._first_event = now
+            self._last_event = now
+            # A typed entry wins over an untyped one for the same serial
+            if device_os or serial not in self._pending:
+                self._pending[serial] = device_os
+            self._condition.notify()
+
+    def pending(self):
+        with self._condition:
+            return len(self._pending)
+
+    def _take_batch(self):
+        """Return {os or None: set(serials)} and clear the pending events."""
+        batch = {}
+        for serial, device_os in self._pending.items():
+            batch.setdefault(device_os, set()).add(serial)
+        self._pending = {}
+        self._first_event = None
+        self._last_event = None
+        return batch
+
+    def _run(self):
+        logger = get_logger()
+        while True:
+            with self._condition:
+                while not self._stopped:
+                    if self._pending:
+                        now = self.clock()
+                        due = min(self._last_event + self.delay, self._first_event + self.max_delay)
+                        if now >= due:
+                            break
+                        self._condition.wait(due - now)
+                    else:
+                        self._condition.wait()
+                if self._stopped:
+                    return
+                batch = self._take_batch()
+
+            try:
+                self.callback(batch)
+            except Exception as e:
+                logger.error(f"Error syncing webhook batch: {e}")
+
+
+class _WebhookHandler(BaseHTTPRequestHandler):
+    server_version = "MosyleSnipeSync"
+    timeout = REQUEST_TIMEOUT
+
+    def log_message(self, format, *args):
+        get_logger().debug("webhook: " + format % args)
+
+    def _send_json(self, status, body):
+        data = json.dumps(body).encode("utf8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _authorized(self):
+        token = self.server.receiver.token
+        if not token:
+            return True
+        supplied = self.headers.get("X-Webhook-Token")
+        if supplied is None:
+            supplied = parse_qs(urlparse(self.path).query).get("token", [""])[0]
+        return hmac.compare_digest(supplied.encode("utf8"), token.encode("utf8"))
+
+    def do_GET(self):
+        if urlparse(self.path).path == "/health":
+            self._send_json(200, {"status": "ok", "pending": self.server.receiver.debouncer.pending()})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        logger = get_logger()
+        if urlparse(self.path).path != self.server.receiver.path:
+            self._send_json(404, {"error": "not found"})
+            return
+        if not self._authorized():
+            self._send_json(401, {"error": "invalid token"})
+            return
+
+        header = self.headers.get("Content-Length")
+        if header is None:
+            self._send_json(411, {"error": "Content-Length required"})
+            return
+        try:
+            length = int(header)
+        except ValueError:
+            length = -1
+        if length < 0:
+            self._send_json(400, {"error": "invalid Content-Length"})
+            return
+        if length > MAX_BODY_BYTES:
+            self._send_json(413, {"error": "payload too large"})
+            return
+        try:
+            payload = json.loads(self.rfile.read(length) or b"null")
+        except ValueError:
+            self._send_json(400, {"error": "invalid JSON"})
+            return
+
+        devices = extract_devices(payload)
+        event = (payload.get("event") or payload.get("type")) if isinstance(payload, dict) else None
+        logger.info(f"Webhook event {event or 'unknown'}: {len(devices)} devices")
+        for serial, device_os in devices:
+            self.server.receiver.debouncer.add(serial, device_os)
+        self._send_json(202, {"accepted": len(devices)})
+
+
+class WebhookReceiver:
+    """HTTP listener that feeds Mosyle webhook events into an EventDebouncer."""
+
+    def __init__(self, callback, host="127.0.0.1", port=8787, path="/webhook",
+                 token=None, delay=30, max_delay=300):
+        self.path = path
+        self.token = token
+        self.debouncer = EventDebouncer(callback, delay=delay, max_delay=max_delay)
+        self.httpd = ThreadingHTTPServer((host, port), _WebhookHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.receiver = self
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="webhook-http", daemon=True)
+
+    @property
+    def address(self):
+        return self.httpd.server_address
+
+    def start(self):
+        logger = get_logger()
+        self.debouncer.start()
+        self._thread.start()
+        host, port = self.address[:2]
+        logger.info(f"Webhook receiver listening on http://{host}:{port}{self.path}")
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.debouncer.stop()